@@ -0,0 +1,444 @@
+import os
+import time
+import asyncio
+import threading
+import contextvars
+import logging
+from collections import OrderedDict
+from datetime import date
+from typing import Dict, Any, List, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.database.admission import LANE_BACKGROUND, LANE_CANNED
+
+logger = logging.getLogger(__name__)
+
+# A user's cube is built once they ran this many canned analyses while it was missing
+AGGREGATE_CUBE_HOT_REQUESTS = int(os.getenv("AGGREGATE_CUBE_HOT_REQUESTS", "3"))
+
+# Memory for all cubes together; the least recently used ones are dropped beyond it
+AGGREGATE_CUBE_MAX_MB = float(os.getenv("AGGREGATE_CUBE_MAX_MB", "128"))
+
+# How long a new cube remembers the row ids it was loaded with; a notification of one of
+# those rows can still be in flight after the build, and must not be added a second time
+AGGREGATE_CUBE_SETTLE_SECONDS = float(os.getenv("AGGREGATE_CUBE_SETTLE_SECONDS", "300"))
+
+# Users whose request counts are tracked towards becoming hot
+MAX_TRACKED_USERS = 10000
+
+# Measures kept per (day, category); sums in float64, counts in int64
+SUMS = ("income", "expenses")
+COUNTS = ("income_transactions", "expense_transactions", "transactions")
+
+CUBE_LOAD_QUERY = """
+    SELECT
+        CAST(t.date AS DATE) as day,
+        t.category_id,
+        c.name as category_name,
+        SUM(CASE WHEN t.amount > 0 THEN t.amount ELSE 0 END) as income,
+        SUM(CASE WHEN t.amount < 0 THEN ABS(t.amount) ELSE 0 END) as expenses,
+        COUNT(CASE WHEN t.amount > 0 THEN 1 END) as income_transactions,
+        COUNT(CASE WHEN t.amount < 0 THEN 1 END) as expense_transactions,
+        COUNT(*) as transactions,
+        ARRAY_AGG(t.id) as ids
+    FROM transactions t
+    LEFT JOIN categories c ON t.category_id = c.id
+    WHERE t.user_id = :user_id
+    GROUP BY CAST(t.date AS DATE), t.category_id, c.name
+"""
+
+CUBE_CATEGORIES_QUERY = "SELECT id, name FROM categories WHERE user_id = :user_id"
+
+
+def _ordinal(value) -> int:
+    return value.toordinal() if isinstance(value, date) else pd.Timestamp(value).date().toordinal()
+
+
+class UserCube:
+    def __init__(self, rows: pd.DataFrame, categories: pd.DataFrame):
+        """Prefix sums over the user's active days (rows) and category names (columns)"""
+        names = [*rows["category_name"], *categories["name"], None]
+        self.categories: List[Optional[str]] = list(dict.fromkeys(None if pd.isna(n) else n for n in names))
+        column = {name: i for i, name in enumerate(self.categories)}
+
+        # Transactions without a (known) category land in the NULL-name column, like the LEFT JOIN
+        self.category_ids: Dict[str, int] = {
+            cid: column[None if pd.isna(name) else name]
+            for cid, name in zip(categories["id"], categories["name"])
+        }
+        self._null_ids = {cid for cid, name in zip(rows["category_id"], rows["category_name"]) if pd.isna(name)}
+
+        days = np.array([_ordinal(d) for d in rows["day"]], dtype=np.int64)
+        cols = np.array([column[None if pd.isna(n) else n] for n in rows["category_name"]], dtype=np.int64)
+        self.days = np.unique(days)
+        daily = self._empty(len(self.days))
+        at = (np.searchsorted(self.days, days), cols)
+        for measure in SUMS + COUNTS:
+            np.add.at(daily[measure], at, rows[measure].to_numpy(dtype=daily[measure].dtype))
+        self._set_prefix(daily)
+
+        self._pending: List[Tuple[int, int, float]] = []  # (day ordinal, column, amount)
+
+        # Ids in the same snapshot as the sums; only kept while late notifications may still arrive
+        self._loaded_ids: Set[str] = {row_id for ids in rows["ids"] for row_id in ids}
+        self._settle_until = time.monotonic() + AGGREGATE_CUBE_SETTLE_SECONDS
+
+    def _empty(self, n_days: int) -> Dict[str, np.ndarray]:
+        shape = (n_days, len(self.categories))
+        return {
+            **{measure: np.zeros(shape, dtype=np.float64) for measure in SUMS},
+            **{measure: np.zeros(shape, dtype=np.int64) for measure in COUNTS}
+        }
+
+    def _set_prefix(self, daily: Dict[str, np.ndarray]):
+        # Row k holds the totals of every day before self.days[k]; row 0 is all zeros
+        self.prefix = {}
+        for measure, values in daily.items():
+            prefix = np.zeros((values.shape[0] + 1, values.shape[1]), dtype=values.dtype)
+            np.cumsum(values, axis=0, out=prefix[1:])
+            self.prefix[measure] = prefix
+        # Month key (year * 12 + month - 1) of every active day, for monthly breakdowns
+        months = [date.fromordinal(int(d)) for d in self.days]
+        self.months = np.array([d.year * 12 + d.month - 1 for d in months], dtype=np.int64)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in self.prefix.values()) + self.days.nbytes + self.months.nbytes
+
+    def loaded(self, row_id: Optional[str]) -> bool:
+        """True if the row was already counted when the cube was loaded"""
+        if self._loaded_ids and time.monotonic() > self._settle_until:
+            self._loaded_ids = set()
+        return row_id in self._loaded_ids
+
+    def add(self, day: date, amount: float, category_id: Optional[str]) -> bool:
+        """Queue one inserted transaction; False if its category is unknown to this cube"""
+        if category_id is None or category_id in self._null_ids:
+            column = self.categories.index(None)
+        elif category_id in self.category_ids:
+            column = self.category_ids[category_id]
+        else:
+            return False
+        self._pending.append((day.toordinal(), column, amount))
+        return True
+
+    def _fold(self):
+        """Merge queued inserts into the prefix sums, inserting rows for new days"""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        days = np.array([p[0] for p in pending], dtype=np.int64)
+        cols = np.array([p[1] for p in pending], dtype=np.int64)
+        amounts = np.array([p[2] for p in pending], dtype=np.float64)
+
+        all_days = np.union1d(self.days, days)
+        old_rows = np.searchsorted(all_days, self.days)
+        daily = self._empty(len(all_days))
+        for measure, prefix in self.prefix.items():
+            daily[measure][old_rows] = np.diff(prefix, axis=0)
+
+        at = (np.searchsorted(all_days, days), cols)
+        np.add.at(daily["income"], at, np.where(amounts > 0, amounts, 0))
+        np.add.at(daily["expenses"], at, np.where(amounts < 0, -amounts, 0))
+        np.add.at(daily["income_transactions"], at, (amounts > 0).astype(np.int64))
+        np.add.at(daily["expense_transactions"], at, (amounts < 0).astype(np.int64))
+        np.add.at(daily["transactions"], at, 1)
+
+        self.days = all_days
+        self._set_prefix(daily)
+
+    def _bounds(self, start: date, end: date) -> Tuple[int, int]:
+        return (
+            int(np.searchsorted(self.days, start.toordinal())),
+            int(np.searchsorted(self.days, end.toordinal()))
+        )
+
+    def totals(self, start: date, end: date) -> Dict[str, np.ndarray]:
+        """Per-category totals of [start, end): one subtraction per measure"""
+        self._fold()
+        i, j = self._bounds(start, end)
+        return {measure: prefix[j] - prefix[i] for measure, prefix in self.prefix.items()}
+
+    def monthly(self, start: date, end: date) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+        """Month keys of [start, end) with activity, and per-category totals of each (months x categories)"""
+        self._fold()
+        i, j = self._bounds(start, end)
+        months, first = np.unique(self.months[i:j], return_index=True)
+        edges = np.append(first + i, j)
+        return months, {measure: prefix[edges[1:]] - prefix[edges[:-1]] for measure, prefix in self.prefix.items()}
+
+
+def _month_start(key: int) -> pd.Timestamp:
+    return pd.Timestamp(year=int(key) // 12, month=int(key) % 12 + 1, day=1)
+
+
+def _spending_frame(cube: UserCube, start: date, end: date) -> pd.DataFrame:
+    t = cube.totals(start, end)
+    used = np.flatnonzero(t["expense_transactions"])
+    total = t["expenses"][used].sum()
+    rows = [{
+        "category_name": cube.categories[c] if cube.categories[c] is not None else "Uncategorized",
+        "transaction_count": int(t["expense_transactions"][c]),
+        "total_amount": float(t["expenses"][c]),
+        "percentage": round(float(t["expenses"][c]) * 100.0 / total, 2) if total else None,
+        "avg_amount": float(t["expenses"][c]) / int(t["expense_transactions"][c])
+    } for c in used]
+    rows.sort(key=lambda row: row["total_amount"], reverse=True)
+    return pd.DataFrame(rows[:15], columns=["category_name", "transaction_count", "total_amount", "percentage", "avg_amount"])
+
+
+def _income_frame(cube: UserCube, start: date, end: date) -> pd.DataFrame:
+    months, m = cube.monthly(start, end)
+    rows = [{
+        "category_name": cube.categories[c] if cube.categories[c] is not None else "Income",
+        "transaction_count": int(m["income_transactions"][k, c]),
+        "total_amount": float(m["income"][k, c]),
+        "avg_amount": float(m["income"][k, c]) / int(m["income_transactions"][k, c]),
+        "month": _month_start(months[k])
+    } for k, c in zip(*np.nonzero(m["income_transactions"]))]
+    rows.sort(key=lambda row: row["total_amount"], reverse=True)
+    return pd.DataFrame(rows, columns=["category_name", "transaction_count", "total_amount", "avg_amount", "month"])
+
+
+def _summary_frame(cube: UserCube, start: date, end: date) -> pd.DataFrame:
+    t = {measure: values.sum() for measure, values in cube.totals(start, end).items()}
+    # Aggregates over no rows are NULL, as in SQL
+    count = int(t["transactions"])
+    income_n, expense_n = int(t["income_transactions"]), int(t["expense_transactions"])
+    return pd.DataFrame([{
+        "total_transactions": count,
+        "total_income": float(t["income"]) if count else None,
+        "total_expenses": float(t["expenses"]) if count else None,
+        "net_amount": float(t["income"] - t["expenses"]) if count else None,
+        "avg_income": float(t["income"]) / income_n if income_n else None,
+        "avg_expense": float(t["expenses"]) / expense_n if expense_n else None,
+        "income_transactions": income_n,
+        "expense_transactions": expense_n,
+        "analysis_period": start
+    }])
+
+
+def _monthly_totals(cube: UserCube, start: date, end: date) -> List[Dict[str, Any]]:
+    """Months with transactions, newest first"""
+    months, m = cube.monthly(start, end)
+    totals = {measure: values.sum(axis=1) for measure, values in m.items()}
+    return [{
+        "month": _month_start(months[k]),
+        "income": float(totals["income"][k]),
+        "expenses": float(totals["expenses"][k]),
+        "transactions": int(totals["transactions"][k])
+    } for k in range(len(months))][::-1]
+
+
+def _comparison_frame(cube: UserCube, start: date, end: date) -> pd.DataFrame:
+    return pd.DataFrame([{
+        "month": row["month"],
+        "monthly_income": row["income"],
+        "monthly_expenses": row["expenses"],
+        "monthly_net": row["income"] - row["expenses"],
+        "monthly_transactions": row["transactions"]
+    } for row in _monthly_totals(cube, start, end)],
+        columns=["month", "monthly_income", "monthly_expenses", "monthly_net", "monthly_transactions"])
+
+
+def _savings_frame(cube: UserCube, start: date, end: date) -> pd.DataFrame:
+    return pd.DataFrame([{
+        "month": row["month"],
+        "income": row["income"],
+        "expenses": row["expenses"],
+        "savings": row["income"] - row["expenses"],
+        "savings_rate": round((row["income"] - row["expenses"]) * 100.0 / row["income"], 2) if row["income"] > 0 else 0
+    } for row in _monthly_totals(cube, start, end)[:6]],
+        columns=["month", "income", "expenses", "savings", "savings_rate"])
+
+
+# Canned templates the cube answers, with the same columns and ordering as their SQL
+FRAME_BUILDERS = {
+    "spending_analysis": _spending_frame,
+    "income_analysis": _income_frame,
+    "financial_summary": _summary_frame,
+    "comparison_analysis": _comparison_frame,
+    "savings_analysis": _savings_frame,
+}
+
+# (user_id, cube) loaded once for the user whose batch questions are being analysed
+current_batch_cube: "contextvars.ContextVar[Optional[Tuple[str, UserCube]]]" = contextvars.ContextVar(
+    "current_batch_cube", default=None
+)
+
+
+class AggregateCubeCache:
+    def __init__(self, db_service=None, versions=None, max_bytes: int = None, hot_requests: int = None):
+        """In-process (day x category) aggregates of hot users, kept current from change notifications"""
+        self.db_service = db_service
+        self.versions = versions
+        self.max_bytes = max_bytes or int(AGGREGATE_CUBE_MAX_MB * 1024 * 1024)
+        self.hot_requests = hot_requests or AGGREGATE_CUBE_HOT_REQUESTS
+
+        self._cubes: "OrderedDict[str, UserCube]" = OrderedDict()
+        self._requests: "OrderedDict[str, int]" = OrderedDict()
+        self._building: Dict[str, asyncio.Task] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "batch_hits": 0,
+            "misses": 0,
+            "builds": 0,
+            "stale_builds": 0,
+            "failed_builds": 0,
+            "inserts_applied": 0,
+            "inserts_already_loaded": 0,
+            "invalidations": 0,
+            "evictions": 0
+        }
+
+    def answer(self, user_id: str, query_type: str, date_range: Dict[str, Any]) -> Optional[pd.DataFrame]:
+        """Result of a canned template from the user's cube, or None (and maybe start building one)"""
+        builder = FRAME_BUILDERS.get(query_type)
+        if builder is None:
+            return None
+
+        # A batch's own cube is a snapshot of the batch's reads, so it needs no change notifications
+        batch = current_batch_cube.get()
+        if batch is not None and batch[0] == user_id:
+            with self._lock:
+                self._stats["batch_hits"] += 1
+            return builder(batch[1], date_range["start"], date_range["end"])
+
+        if self.db_service is None:
+            return None
+
+        with self._lock:
+            # Without notifications from every shard, inserts could be missing from the cube
+            cube = self._cubes.get(user_id) if self.versions is not None and self.versions.listening else None
+            if cube is not None:
+                self._cubes.move_to_end(user_id)
+                self._stats["hits"] += 1
+                before = cube.nbytes
+                df = builder(cube, date_range["start"], date_range["end"])
+                self._bytes += cube.nbytes - before
+                return df
+
+            self._stats["misses"] += 1
+            count = self._requests.get(user_id, 0) + 1
+            self._requests[user_id] = count
+            self._requests.move_to_end(user_id)
+            while len(self._requests) > MAX_TRACKED_USERS:
+                self._requests.popitem(last=False)
+
+        if count >= self.hot_requests and self.versions is not None and self.versions.listening:
+            self._start_build(user_id)
+        return None
+
+    def _start_build(self, user_id: str):
+        if user_id in self._building:
+            return
+        task = asyncio.create_task(self._build(user_id))
+        self._building[user_id] = task
+        task.add_done_callback(lambda _: self._building.pop(user_id, None))
+
+    def _load(self, user_id: str, lane: str = LANE_BACKGROUND) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        params = {"user_id": user_id}
+        rows = self.db_service.execute_query(CUBE_LOAD_QUERY, params, read_only=True, user_id=user_id, lane=lane)
+        categories = self.db_service.execute_query(CUBE_CATEGORIES_QUERY, params, read_only=True, user_id=user_id, lane=lane)
+        return rows, categories
+
+    def load_cube(self, user_id: str) -> UserCube:
+        """A one-off cube of the user, read in the caller's unit of work and not cached (blocking)"""
+        return UserCube(*self._load(user_id, LANE_CANNED))
+
+    async def _build(self, user_id: str):
+        marker = self.versions.change_marker(user_id)
+        try:
+            # Outside any request's unit of work: the cube must not come from an older snapshot
+            rows, categories = await asyncio.get_event_loop().run_in_executor(None, self._load, user_id)
+            cube = UserCube(rows, categories)
+        except Exception as e:
+            self._stats["failed_builds"] += 1
+            logger.warning(f"Aggregate cube build failed for user {user_id}: {e}")
+            return
+
+        # A change during the load may or may not be in it: try again on a later request
+        if self.versions.change_marker(user_id) != marker:
+            self._stats["stale_builds"] += 1
+            return
+
+        with self._lock:
+            self._drop(user_id)
+            self._cubes[user_id] = cube
+            self._bytes += cube.nbytes
+            self._requests.pop(user_id, None)
+            self._stats["builds"] += 1
+            while self._bytes > self.max_bytes and len(self._cubes) > 1:
+                self._drop(next(iter(self._cubes)))
+                self._stats["evictions"] += 1
+        logger.info(f"🧊 Aggregate cube built for user {user_id}: {len(cube.days)} days x {len(cube.categories)} categories")
+
+    def _drop(self, user_id: str) -> bool:
+        cube = self._cubes.pop(user_id, None)
+        if cube is None:
+            return False
+        self._bytes -= cube.nbytes
+        return True
+
+    def apply_insert(
+        self,
+        user_id: str,
+        day: date,
+        amount: float,
+        category_id: Optional[str],
+        row_id: Optional[str] = None
+    ):
+        """Add one inserted transaction to the user's cube, dropping the cube if it cannot be applied"""
+        with self._lock:
+            cube = self._cubes.get(user_id)
+            if cube is None:
+                return
+            # Committed before the load but notified after the marker check: already in the sums
+            if cube.loaded(row_id):
+                self._stats["inserts_already_loaded"] += 1
+            elif cube.add(day, amount, category_id):
+                self._stats["inserts_applied"] += 1
+            elif self._drop(user_id):
+                self._stats["invalidations"] += 1
+
+    def invalidate_user(self, user_id: str):
+        """Drop one user's cube (an update or delete cannot be applied incrementally)"""
+        with self._lock:
+            if self._drop(user_id):
+                self._stats["invalidations"] += 1
+
+    def clear(self):
+        """Drop every cube"""
+        with self._lock:
+            self._cubes.clear()
+            self._bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "users": len(self._cubes),
+                "building": len(self._building),
+                "memory_mb": round(self._bytes / (1024 * 1024), 2),
+                "max_memory_mb": round(self.max_bytes / (1024 * 1024), 2),
+                "hit_rate": round(self._stats["hits"] / lookups, 3) if lookups else 0
+            }
+
+
+# Global aggregate cube cache instance
+aggregate_cube_cache = None
+
+
+def get_aggregate_cube_cache() -> AggregateCubeCache:
+    """Get aggregate cube cache with lazy initialization"""
+    global aggregate_cube_cache
+    if aggregate_cube_cache is None:
+        from app.database.database import db_service
+        from app.services.data_version import user_data_versions
+        aggregate_cube_cache = AggregateCubeCache(db_service=db_service, versions=user_data_versions)
+    return aggregate_cube_cache
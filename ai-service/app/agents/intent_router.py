@@ -0,0 +1,306 @@
+import os
+import re
+import asyncio
+import hashlib
+import json
+import logging
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+from app.utils.slots import extract_slots, normalize_question
+
+logger = logging.getLogger(__name__)
+
+FALLBACK_INTENT = "general_analysis"
+
+# Keyword cascade, in priority order (first match wins for the legacy detector)
+INTENT_KEYWORDS: Dict[str, List[str]] = {
+    "spending_analysis": ["chi tiêu", "danh mục", "category", "spending", "expense"],
+    "income_analysis": ["thu nhập", "income", "earning"],
+    "comparison_analysis": ["so sánh", "compare", "xu hướng", "trend"],
+    "financial_summary": ["tổng", "total", "summary", "overview"],
+    "savings_analysis": ["tiết kiệm", "saving", "balance"],
+}
+
+# Exemplar questions used to build one centroid embedding per intent
+INTENT_EXEMPLARS: Dict[str, List[str]] = {
+    "spending_analysis": [
+        "Tôi tiêu tiền vào những gì nhiều nhất?",
+        "Tháng này tôi xài bao nhiêu tiền?",
+        "Khoản chi nào lớn nhất của tôi?",
+        "Tiền của tôi đi đâu hết rồi?",
+        "Tôi mua sắm tốn bao nhiêu?",
+        "Phân bổ chi phí theo từng nhóm",
+        "Where does my money go?",
+        "What did I spend the most on?",
+        "How much did I pay for food?",
+        "Break down my costs by category",
+    ],
+    "income_analysis": [
+        "Tôi kiếm được bao nhiêu tiền?",
+        "Lương tháng này của tôi là bao nhiêu?",
+        "Nguồn tiền vào của tôi từ đâu?",
+        "Tôi nhận được bao nhiêu tiền mỗi tháng?",
+        "Khoản thu lớn nhất là gì?",
+        "How much money did I make?",
+        "What is my salary this month?",
+        "Where does my money come from?",
+        "Show my earnings by source",
+    ],
+    "comparison_analysis": [
+        "Tháng này so với tháng trước thế nào?",
+        "Chi tiêu của tôi tăng hay giảm?",
+        "Biến động tài chính qua các tháng",
+        "Tình hình tài chính thay đổi ra sao theo thời gian?",
+        "Tháng nào tôi tiêu nhiều nhất?",
+        "How does this month compare to last month?",
+        "Is my spending going up or down?",
+        "Show month over month changes",
+    ],
+    "financial_summary": [
+        "Tình hình tài chính của tôi thế nào?",
+        "Tóm tắt tài chính tháng này",
+        "Cho tôi bức tranh toàn cảnh về tiền bạc",
+        "Báo cáo tài chính tháng này",
+        "Tài chính của tôi có ổn không?",
+        "Give me an overview of my finances",
+        "How am I doing financially this month?",
+        "Financial report for this month",
+    ],
+    "savings_analysis": [
+        "Tôi để dành được bao nhiêu?",
+        "Mỗi tháng tôi dư ra bao nhiêu tiền?",
+        "Tỷ lệ tích lũy của tôi là bao nhiêu?",
+        "Tôi còn lại bao nhiêu tiền sau chi tiêu?",
+        "Làm sao để dành dụm nhiều hơn?",
+        "How much money am I putting aside?",
+        "What is my savings rate?",
+        "How much is left over each month?",
+    ],
+}
+
+# Score adjustments on top of the embedding probability
+KEYWORD_BONUS = 0.25
+SLOT_BONUS = 0.05
+SOFTMAX_TEMPERATURE = 0.05
+
+# Upper bound on sub-questions run for one question
+MAX_SUB_QUESTIONS = int(os.getenv("MAX_SUB_QUESTIONS", "4"))
+
+# Clause boundaries: sentence punctuation, ", và"/", and", or "và"/"and" before a new subject.
+# A bare "và" is not a boundary: "thu nhập và chi tiêu" is one comparison.
+_CLAUSE_BOUNDARY = re.compile(
+    r"\s*(?:[?;!]+|,\s*(?:và|còn|rồi|and|also|then)\b|\s(?:và|and)\s+(?=(?:tôi|mình|cho tôi|how|what|show)\b))\s*",
+    re.IGNORECASE
+)
+
+
+def detect_intents_by_keywords(question: str) -> List[str]:
+    """Return every intent whose keywords appear in the question, in cascade order"""
+    question_lower = normalize_question(question)
+    return [
+        intent for intent, keywords in INTENT_KEYWORDS.items()
+        if any(keyword in question_lower for keyword in keywords)
+    ]
+
+
+def detect_intent_by_keywords(question: str) -> str:
+    """Legacy substring cascade: first matching intent or the LLM fallback"""
+    intents = detect_intents_by_keywords(question)
+    return intents[0] if intents else FALLBACK_INTENT
+
+
+def decompose_question(question: str) -> List[str]:
+    """Split a compound question into clauses that can be routed independently"""
+    clauses = [c.strip(" ,.") for c in _CLAUSE_BOUNDARY.split(question or "")]
+    clauses = [c for c in clauses if len(c.split()) >= 2]
+    return clauses[:MAX_SUB_QUESTIONS] or [question]
+
+
+def _route_key(route: Dict[str, Any]) -> Tuple:
+    """Intent plus the slots that change which rows a sub-query reads"""
+    slots = route.get("slots") or {}
+    window = slots.get("time_window") or {}
+    return (
+        route["intent"],
+        (window.get("kind"), window.get("unit"), window.get("offset", window.get("count"))),
+        (slots.get("category") or "").lower() or None,
+        (slots.get("payee") or "").lower() or None,
+    )
+
+
+class IntentRouter:
+    def __init__(
+        self,
+        embeddings=None,
+        confidence_threshold: float = None,
+        centroids_path: str = None
+    ):
+        """Route questions to canned SQL intents using centroid embeddings"""
+        self.embeddings = embeddings
+        self.confidence_threshold = confidence_threshold if confidence_threshold is not None else float(
+            os.getenv("INTENT_CONFIDENCE_THRESHOLD", "0.55")
+        )
+        self.centroids_path = centroids_path or os.getenv(
+            "INTENT_CENTROIDS_PATH", "./cache/intent_centroids.npz"
+        )
+
+        self._intents = list(INTENT_EXEMPLARS.keys())
+        self._centroids: Optional[np.ndarray] = None
+
+    def _exemplar_fingerprint(self) -> str:
+        """Hash of exemplars and model so stale centroid files are ignored"""
+        model_name = "unknown"
+        if self.embeddings is not None:
+            model_name = self.embeddings.get_model_info().get("model_name", "unknown")
+        payload = json.dumps({"model": str(model_name), "exemplars": INTENT_EXEMPLARS}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+    def _load_centroids_file(self, fingerprint: str) -> Optional[np.ndarray]:
+        """Load precomputed centroids if the fingerprint matches"""
+        try:
+            if not os.path.exists(self.centroids_path):
+                return None
+            data = np.load(self.centroids_path, allow_pickle=False)
+            if str(data["fingerprint"]) != fingerprint or list(data["intents"]) != self._intents:
+                return None
+            return data["centroids"]
+        except Exception as e:
+            logger.warning(f"Could not load intent centroids: {e}")
+            return None
+
+    def _save_centroids_file(self, fingerprint: str, centroids: np.ndarray):
+        """Persist centroids so other workers skip exemplar encoding"""
+        try:
+            os.makedirs(os.path.dirname(self.centroids_path) or ".", exist_ok=True)
+            np.savez(
+                self.centroids_path,
+                fingerprint=np.array(fingerprint),
+                intents=np.array(self._intents),
+                centroids=centroids
+            )
+        except Exception as e:
+            logger.warning(f"Could not save intent centroids: {e}")
+
+    async def _ensure_centroids(self) -> Optional[np.ndarray]:
+        """Load or compute one normalized centroid per intent"""
+        if self._centroids is not None or self.embeddings is None:
+            return self._centroids
+
+        fingerprint = self._exemplar_fingerprint()
+        centroids = self._load_centroids_file(fingerprint)
+
+        if centroids is None:
+            rows = []
+            for intent in self._intents:
+                vectors = await self.embeddings.embed_texts(INTENT_EXEMPLARS[intent])
+                centroid = np.asarray(vectors, dtype=np.float32).mean(axis=0)
+                rows.append(centroid / (np.linalg.norm(centroid) or 1.0))
+            centroids = np.vstack(rows)
+            self._save_centroids_file(fingerprint, centroids)
+            logger.info(f"✅ Computed intent centroids for {len(self._intents)} intents")
+
+        self._centroids = centroids
+        return self._centroids
+
+    async def route(
+        self,
+        question: str,
+        known_categories: Optional[List[str]] = None,
+        embedding: Optional[List[float]] = None
+    ) -> Dict[str, Any]:
+        """Route a question to an intent; embedding is the question's vector when the caller already has it"""
+        slots = extract_slots(question, known_categories)
+        keyword_intents = detect_intents_by_keywords(question)
+
+        scores = {intent: 0.0 for intent in self._intents}
+
+        centroids = None
+        try:
+            centroids = await self._ensure_centroids()
+        except Exception as e:
+            logger.warning(f"Intent centroids unavailable: {e}")
+
+        if centroids is not None:
+            if embedding is None:
+                embedding = await self.embeddings.embed_text(question)
+            similarities = centroids @ np.asarray(embedding, dtype=np.float32)
+            logits = (similarities - similarities.max()) / SOFTMAX_TEMPERATURE
+            probabilities = np.exp(logits) / np.exp(logits).sum()
+            for intent, probability in zip(self._intents, probabilities):
+                scores[intent] = float(probability)
+            source = "embedding"
+        else:
+            source = "keyword"
+
+        for intent in keyword_intents:
+            scores[intent] += KEYWORD_BONUS if centroids is not None else 1.0
+
+        # Category or payee mentions point at spending breakdowns
+        if slots["category"] or slots["payee"]:
+            scores["spending_analysis"] += SLOT_BONUS
+
+        intent = max(scores, key=scores.get)
+        confidence = min(1.0, scores[intent])
+
+        if confidence < self.confidence_threshold:
+            return {
+                "intent": FALLBACK_INTENT,
+                "confidence": confidence,
+                "candidate": intent if confidence > 0 else None,
+                "slots": slots,
+                "source": source
+            }
+
+        return {
+            "intent": intent,
+            "confidence": confidence,
+            "candidate": intent,
+            "slots": slots,
+            "source": source
+        }
+
+    async def route_many(
+        self,
+        question: str,
+        known_categories: Optional[List[str]] = None,
+        embedding: Optional[List[float]] = None
+    ) -> List[Dict[str, Any]]:
+        """Route each clause of a compound question; one route per distinct intent and slots"""
+        clauses = decompose_question(question)
+        if len(clauses) == 1:
+            return [{**await self.route(question, known_categories, embedding), "question": question}]
+
+        routes = await asyncio.gather(*(self.route(clause, known_categories) for clause in clauses))
+
+        # "tháng này ... tháng trước" or two categories under one intent are different sub-queries
+        distinct: Dict[Tuple, Dict[str, Any]] = {}
+        for clause, route in zip(clauses, routes):
+            key = _route_key(route)
+            if key not in distinct:
+                distinct[key] = {**route, "question": clause}
+
+        # A clause that only the LLM could answer is kept unless it is a short fragment
+        kept = [
+            route for route in distinct.values()
+            if route["intent"] != FALLBACK_INTENT or len(route["question"].split()) >= 3
+        ]
+        return kept or list(distinct.values())
+
+
+# Global router instance
+intent_router = None
+
+
+def get_intent_router() -> IntentRouter:
+    """Get intent router instance with lazy initialization"""
+    global intent_router
+    if intent_router is None:
+        try:
+            from app.embeddings import embeddings_service
+        except Exception as e:
+            logger.warning(f"Embeddings unavailable for intent routing: {e}")
+            embeddings_service = None
+        intent_router = IntentRouter(embeddings=embeddings_service)
+    return intent_router
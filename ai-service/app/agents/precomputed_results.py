@@ -0,0 +1,101 @@
+import os
+import time
+import threading
+import logging
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class PrecomputedResults:
+    def __init__(self, versions=None, max_users: int = None):
+        """Formatted canned-query results computed ahead of time, valid until the user's data changes"""
+        self.versions = versions
+        self.max_users = max_users or int(os.getenv("PRECOMPUTED_MAX_USERS", "5000"))
+
+        self._users: "OrderedDict[str, Dict[tuple, Dict[str, Any]]]" = OrderedDict()
+        self._last_seen: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "stale_stores": 0, "invalidations": 0}
+
+    def _key(self, query_type: str, date_range: Dict[str, Any]) -> tuple:
+        return query_type, date_range["start"].isoformat(), date_range["end"].isoformat()
+
+    def lookup(self, user_id: str, query_type: str, date_range: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Warm result for this template and period; only trusted while change notifications flow"""
+        with self._lock:
+            self._last_seen[user_id] = time.time()
+            self._last_seen.move_to_end(user_id)
+            while len(self._last_seen) > self.max_users:
+                self._last_seen.popitem(last=False)
+
+            entry = None
+            if self.versions is not None and self.versions.listening:
+                entry = self._users.get(user_id, {}).get(self._key(query_type, date_range))
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._stats["hits"] += 1
+        return {**entry, "df": entry["df"].copy()}
+
+    def store(
+        self,
+        user_id: str,
+        query_type: str,
+        date_range: Dict[str, Any],
+        result: Dict[str, Any],
+        marker: tuple
+    ) -> bool:
+        """Keep a result computed after marker was taken; False if the user's data changed meanwhile"""
+        if self.versions is None or self.versions.change_marker(user_id) != marker:
+            self._stats["stale_stores"] += 1
+            return False
+        with self._lock:
+            results = self._users.setdefault(user_id, {})
+            self._users.move_to_end(user_id)
+            results[self._key(query_type, date_range)] = result
+            self._stats["stores"] += 1
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        return True
+
+    def seen_within(self, user_id: str, seconds: float) -> bool:
+        """Whether the user asked something recently enough to be worth precomputing for"""
+        with self._lock:
+            last_seen = self._last_seen.get(user_id)
+        return last_seen is not None and time.time() - last_seen <= seconds
+
+    def invalidate_user(self, user_id: str):
+        """Forget every precomputed result of one user"""
+        with self._lock:
+            if self._users.pop(user_id, None) is not None:
+                self._stats["invalidations"] += 1
+
+    def clear(self):
+        """Forget all precomputed results"""
+        with self._lock:
+            self._users.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "users": len(self._users),
+                "results": sum(len(results) for results in self._users.values()),
+                "hit_rate": round(self._stats["hits"] / lookups, 3) if lookups else 0
+            }
+
+
+# Global precomputed results instance
+precomputed_results = None
+
+
+def get_precomputed_results() -> PrecomputedResults:
+    """Get precomputed results store with lazy initialization"""
+    global precomputed_results
+    if precomputed_results is None:
+        from app.services.data_version import user_data_versions
+        precomputed_results = PrecomputedResults(versions=user_data_versions)
+    return precomputed_results
@@ -1,13 +1,53 @@
 from langchain_openai import ChatOpenAI
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
+from datetime import date, timedelta
+from functools import partial
+import asyncio
 import logging
 import pandas as pd
 import re
 from textwrap import dedent
 import os
+from app.agents.intent_router import FALLBACK_INTENT, detect_intent_by_keywords, get_intent_router
+from app.agents.sql_template_cache import get_sql_template_cache
+from app.agents.precomputed_results import get_precomputed_results
+from app.agents.aggregate_cube import get_aggregate_cube_cache
+from app.agents.sql_validator import SQLValidator, SQLAdmissionController
+from app.database.admission import DBOverloadedError, LANE_CANNED, LANE_CUSTOM
+from app.database.unit_of_work import run_in_executor
+from app.services.anomaly_detection import anomaly_engine
+from app.utils.slots import extract_time_window, time_window_range
 
 logger = logging.getLogger(__name__)
 
+# Period each template covers when the question names none (None = all history)
+DEFAULT_WINDOWS: Dict[str, Optional[Dict[str, Any]]] = {
+    "spending_analysis": None,
+    "income_analysis": None,
+    "financial_summary": {"kind": "calendar", "unit": "month", "offset": 0},
+    "comparison_analysis": {"kind": "rolling", "unit": "month", "count": 6},
+    "savings_analysis": None,
+}
+
+ALL_TIME_START = date(1970, 1, 1)
+
+# Intents about spending, where a flagged spike belongs in the insights
+ANOMALY_INTENTS = ("spending_analysis", "financial_summary", "comparison_analysis")
+
+# Category and payee slots narrow every canned template; a NULL slot leaves it unfiltered
+SLOT_FILTERS = """
+            AND (CAST(:category AS TEXT) IS NULL OR t.category_id IN (
+                SELECT sc.id FROM categories sc WHERE sc.user_id = :user_id AND sc.name ILIKE :category
+            ))
+            AND (CAST(:payee AS TEXT) IS NULL OR t.payee ILIKE :payee)"""
+
+
+def _contains_pattern(value: Optional[str]) -> Optional[str]:
+    """ILIKE pattern matching the slot text anywhere, with LIKE wildcards in it taken literally"""
+    if not value:
+        return None
+    return "%" + re.sub(r"([\\%_])", r"\\\1", value) + "%"
+
 class FinancialSQLAgent:
     def __init__(self, api_key: str, base_url: str = "https://api.x.ai/v1"):
         """Initialize custom SQL agent for financial data analysis"""
@@ -25,6 +65,14 @@ class FinancialSQLAgent:
         # Import database service
         from app.database.database import db_service
         self.db_service = db_service
+
+        self.intent_router = get_intent_router()
+        self.template_cache = get_sql_template_cache()
+        self.precomputed = get_precomputed_results()
+        self.aggregate_cube = get_aggregate_cube_cache()
+        self.custom_sql_timeout_ms = int(os.getenv("CUSTOM_SQL_TIMEOUT_MS", "10000"))
+        self.sql_validator = SQLValidator()
+        self.admission_controller = SQLAdmissionController(self.db_service, validator=self.sql_validator)
         
         # Test database connection
         if not self.db_service.test_connection():
@@ -36,40 +84,45 @@ class FinancialSQLAgent:
         self, 
         user_id: str, 
         question: str, 
-        system_prompt: str = None
+        system_prompt: str = None,
+        embedding: Optional[List[float]] = None
     ) -> Dict[str, Any]:
-        """Execute financial query with custom logic"""
+        """Execute financial query with custom logic; embedding is the question's vector if already computed"""
         try:
             logger.info(f"🔍 Processing question: {question}")
             
-            # Step 1: Detect query type and generate appropriate SQL
-            query_type = self._detect_query_type(question)
-            sql_query = await self._generate_sql_query(user_id, question, query_type)
-            
-            logger.info(f"🔍 Generated SQL: {sql_query}")
-            
-            # Step 2: Execute SQL query safely
-            results_df = await self._execute_sql_safely(sql_query, user_id)
-            
-            logger.info(f"🔍 Query returned {len(results_df)} rows")
-            
-            # Step 3: Format results based on query type
-            formatted_response = self._format_results(results_df, question, query_type)
-            
-            # Step 4: Extract insights
-            insights = self._extract_insights(results_df, query_type)
-            
-            return {
-                "success": True,
-                "data": {
-                    "message": "SQL analysis completed successfully",
-                    "markdown_response": formatted_response,
-                    "summary": self._generate_summary(results_df, query_type),
-                    "key_insights": insights,
-                    "query_type": query_type,
-                    "row_count": len(results_df)
-                }
-            }
+            # Step 1: Split into sub-questions and route each to an intent
+            routes = await self._route_question_parts(question, embedding)
+            question_window = extract_time_window(question)
+
+            # Step 2: Run every sub-query concurrently on its own pooled connection
+            # (a clause of a compound question is a different text, so the vector is only reused whole)
+            outcomes = await asyncio.gather(
+                *(
+                    self._run_sub_query(user_id, route, question_window, embedding if route["question"] == question else None)
+                    for route in routes
+                ),
+                return_exceptions=True
+            )
+            parts = [outcome for outcome in outcomes if not isinstance(outcome, Exception)]
+            if not parts:
+                raise outcomes[0]
+            for route, outcome in zip(routes, outcomes):
+                if isinstance(outcome, Exception):
+                    logger.warning(f"Sub-query '{route['question']}' ({route['intent']}) failed: {outcome}")
+
+            # Step 3: Merge formatted results into one context
+            if len(parts) == 1:
+                data = self._build_part_data(parts[0])
+            else:
+                data = self._merge_parts(parts, len(routes))
+
+            # Step 4: Lead with spending spikes the anomaly scan flagged in the analysed periods
+            anomalies = self._find_anomalies(user_id, parts)
+            if anomalies:
+                data["anomalies"] = anomalies
+                data["key_insights"] = ([self._format_anomaly(a) for a in anomalies] + data["key_insights"])[:5]
+            return {"success": True, "data": data}
             
         except Exception as e:
             logger.error(f"Custom SQL execution error for user {user_id}: {e}")
@@ -79,162 +132,310 @@ class FinancialSQLAgent:
                 "data": self._generate_fallback_response(user_id, question)
             }
 
+    async def _run_sub_query(
+        self,
+        user_id: str,
+        route: Dict[str, Any],
+        question_window: Optional[Dict[str, Any]],
+        embedding: Optional[List[float]] = None
+    ) -> Dict[str, Any]:
+        """Bind the period and execute SQL for one routed (sub-)question"""
+        question = route["question"]
+        query_type = route["intent"]
+        logger.info(f"🧭 '{question}' routed to {query_type} (confidence {route['confidence']:.2f}, {route['source']})")
+
+        # A clause without its own period inherits the question's
+        slots = dict(route.get("slots") or {})
+        slots["time_window"] = slots.get("time_window") or question_window
+        date_range = self._resolve_date_range(question, query_type, slots)
+        # Precomputed results and the cube hold whole-period totals, not one category's or payee's
+        narrowed = bool(slots.get("category") or slots.get("payee"))
+
+        warm = None
+        if query_type == FALLBACK_INTENT:
+            results_df = await self._execute_custom_query(user_id, question, date_range, embedding)
+        else:
+            warm = self.precomputed.lookup(user_id, query_type, date_range) if not narrowed else None
+            cubed = self.aggregate_cube.answer(user_id, query_type, date_range) if warm is None and not narrowed else None
+            if warm is not None:
+                logger.info(f"🔥 Precomputed {query_type} result for {date_range['start']} .. {date_range['end']}")
+                results_df = warm["df"]
+            elif cubed is not None:
+                logger.info(f"🧊 {query_type} answered from aggregate cube for {date_range['start']} .. {date_range['end']}")
+                results_df = cubed
+            else:
+                sql_query, params = await self._generate_sql_query(user_id, question, query_type, date_range, slots)
+                logger.info(f"🔍 Generated SQL for {date_range['start']} .. {date_range['end']}")
+                results_df = await self._execute_sql_safely(sql_query, user_id, params)
+
+        logger.info(f"🔍 Query returned {len(results_df)} rows")
+        return {
+            "question": question,
+            "query_type": query_type,
+            "route": route,
+            "date_range": date_range,
+            "df": results_df,
+            "formatted": warm["formatted"] if warm is not None else None
+        }
+
+    def _format_part(self, df: pd.DataFrame, question: str, query_type: str) -> Dict[str, Any]:
+        """Markdown, summary and insights of one result"""
+        return {
+            "markdown_response": self._format_results(df, question, query_type),
+            "summary": self._generate_summary(df, query_type),
+            "key_insights": self._extract_insights(df, query_type)
+        }
+
+    async def precompute(self, user_id: str, query_type: str, date_range: Dict[str, Any], lane: str) -> Dict[str, Any]:
+        """Run and format one canned template ahead of a question, in the given admission lane"""
+        sql_query, params = await self._generate_sql_query(user_id, "", query_type, date_range)
+        df = await self._execute_sql_safely(sql_query, user_id, params, lane=lane)
+        return {"df": df, "formatted": self._format_part(df, "", query_type)}
+
+    def _build_part_data(self, part: Dict[str, Any]) -> Dict[str, Any]:
+        """Format one sub-query result"""
+        df = part["df"]
+        query_type = part["query_type"]
+        date_range = part["date_range"]
+        return {
+            "message": "SQL analysis completed successfully",
+            **(part.get("formatted") or self._format_part(df, part["question"], query_type)),
+            "query_type": query_type,
+            "intent_confidence": part["route"]["confidence"],
+            "slots": part["route"]["slots"],
+            "date_range": {
+                "start": date_range["start"].isoformat(),
+                "end": date_range["end"].isoformat(),
+                "label": date_range["label"]
+            },
+            "downsampled": df.attrs.get("downsampled", False),
+            "row_count": len(df)
+        }
+
+    def _merge_parts(self, parts: List[Dict[str, Any]], requested: int) -> Dict[str, Any]:
+        """Merge several sub-query results into one response context"""
+        datas = [self._build_part_data(part) for part in parts]
+        insights = [insight for data in datas for insight in data["key_insights"]]
+        return {
+            "message": f"SQL analysis completed for {len(datas)}/{requested} sub-questions",
+            "markdown_response": "\n\n---\n\n".join(data["markdown_response"] for data in datas),
+            "summary": "; ".join(data["summary"] for data in datas),
+            "key_insights": insights[:5],
+            "query_type": datas[0]["query_type"],
+            "query_types": [data["query_type"] for data in datas],
+            "intent_confidence": min(data["intent_confidence"] for data in datas),
+            "slots": datas[0]["slots"],
+            "date_range": datas[0]["date_range"],
+            "sub_queries": [
+                {
+                    "question": part["question"],
+                    "query_type": data["query_type"],
+                    "date_range": data["date_range"],
+                    "row_count": data["row_count"]
+                }
+                for part, data in zip(parts, datas)
+            ],
+            "downsampled": any(data["downsampled"] for data in datas),
+            "row_count": sum(data["row_count"] for data in datas)
+        }
+
     def _detect_query_type(self, question: str) -> str:
         """Detect the type of financial query"""
-        question_lower = question.lower()
-        
-        if any(keyword in question_lower for keyword in ["chi tiêu", "danh mục", "category", "spending", "expense"]):
-            return "spending_analysis"
-        elif any(keyword in question_lower for keyword in ["thu nhập", "income", "earning"]):
-            return "income_analysis" 
-        elif any(keyword in question_lower for keyword in ["so sánh", "compare", "xu hướng", "trend"]):
-            return "comparison_analysis"
-        elif any(keyword in question_lower for keyword in ["tổng", "total", "summary", "overview"]):
-            return "financial_summary"
-        elif any(keyword in question_lower for keyword in ["tiết kiệm", "saving", "balance"]):
-            return "savings_analysis"
+        return detect_intent_by_keywords(question)
+
+    async def _route_question_parts(self, question: str, embedding: Optional[List[float]] = None) -> List[Dict[str, Any]]:
+        """Route each clause of a possibly compound question"""
+        try:
+            return await self.intent_router.route_many(question, embedding=embedding)
+        except Exception as e:
+            logger.warning(f"Question decomposition failed, routing as a whole: {e}")
+            return [{**await self._route_question(question, embedding), "question": question}]
+
+    async def _route_question(self, question: str, embedding: Optional[List[float]] = None) -> Dict[str, Any]:
+        """Route question to a canned intent; low confidence falls back to LLM SQL"""
+        try:
+            return await self.intent_router.route(question, embedding=embedding)
+        except Exception as e:
+            logger.warning(f"Intent routing failed, using keyword detection: {e}")
+            return {
+                "intent": self._detect_query_type(question),
+                "confidence": 0.0,
+                "candidate": None,
+                "slots": {},
+                "source": "keyword"
+            }
+
+    def _resolve_date_range(self, question: str, query_type: str, slots: Dict[str, Any]) -> Dict[str, Any]:
+        """Bound [start, end) of the question's period, falling back to the template default"""
+        window = (slots or {}).get("time_window") or extract_time_window(question)
+        explicit = window is not None
+        window = window or DEFAULT_WINDOWS.get(query_type)
+
+        today = date.today()
+        if window is None:
+            start, end = ALL_TIME_START, today + timedelta(days=1)
         else:
-            return "general_analysis"
+            start, end = time_window_range(window, today)
+            # "So sánh tháng này" needs the previous period as well
+            if query_type == "comparison_analysis" and window["kind"] == "calendar":
+                start = time_window_range({**window, "offset": window["offset"] + 1}, today)[0]
+
+        return {
+            "start": start,
+            "end": end,
+            "label": window.get("text") if explicit else None
+        }
+
+    async def _generate_sql_query(
+        self,
+        user_id: str,
+        question: str,
+        query_type: str,
+        date_range: Dict[str, Any],
+        slots: Optional[Dict[str, Any]] = None
+    ) -> Tuple[str, Dict[str, Any]]:
+        """Generate a bound SQL template for the question type"""
+        params = {
+            "user_id": user_id,
+            "start_date": date_range["start"],
+            "end_date": date_range["end"],
+            "category": _contains_pattern((slots or {}).get("category")),
+            "payee": _contains_pattern((slots or {}).get("payee"))
+        }
 
-    async def _generate_sql_query(self, user_id: str, question: str, query_type: str) -> str:
-        """Generate SQL query based on question type"""
-        
         # Use predefined queries for better reliability
         if query_type == "spending_analysis":
-            return self._get_spending_analysis_query(user_id)
+            return self._get_spending_analysis_query(), params
         elif query_type == "income_analysis":
-            return self._get_income_analysis_query(user_id)
+            return self._get_income_analysis_query(), params
         elif query_type == "financial_summary":
-            return self._get_financial_summary_query(user_id)
+            return self._get_financial_summary_query(), params
         elif query_type == "comparison_analysis":
-            return self._get_comparison_query(user_id)
+            return self._get_comparison_query(), params
         elif query_type == "savings_analysis":
-            return self._get_savings_analysis_query(user_id)
+            return self._get_savings_analysis_query(), params
         else:
             # Use LLM for complex queries
-            return await self._generate_custom_sql(user_id, question)
+            return await self._generate_custom_sql(user_id, question, date_range), {}
 
-    def _get_spending_analysis_query(self, user_id: str) -> str:
+    def _get_spending_analysis_query(self) -> str:
         """Get spending analysis SQL query"""
         return f"""
         SELECT
             COALESCE(c.name, 'Uncategorized') as category_name,
             COUNT(*) as transaction_count,
-            SUM(ABS(CAST(t.amount AS DECIMAL))) as total_amount,
-            ROUND(
-                SUM(ABS(CAST(t.amount AS DECIMAL))) * 100.0 / 
-                NULLIF((
-                    SELECT SUM(ABS(CAST(amount AS DECIMAL))) 
-                    FROM transactions t2 
-                    JOIN accounts a2 ON t2.account_id = a2.id 
-                    WHERE a2.user_id = '{user_id}' 
-                    AND CAST(t2.amount AS DECIMAL) < 0
-                ), 0), 2
-            ) as percentage,
-            AVG(ABS(CAST(t.amount AS DECIMAL))) as avg_amount
+            SUM(ABS(t.amount)) as total_amount,
+            ROUND(SUM(ABS(t.amount)) * 100.0 / NULLIF(SUM(SUM(ABS(t.amount))) OVER (), 0), 2) as percentage,
+            AVG(ABS(t.amount)) as avg_amount
         FROM transactions t
-        JOIN accounts a ON t.account_id = a.id
         LEFT JOIN categories c ON t.category_id = c.id
-        WHERE a.user_id = '{user_id}'
-            AND CAST(t.amount AS DECIMAL) < 0
+        WHERE t.user_id = :user_id
+            AND t.amount < 0
+            AND t.date >= :start_date AND t.date < :end_date{SLOT_FILTERS}
         GROUP BY c.name
         ORDER BY total_amount DESC
         LIMIT 15;
         """
 
-    def _get_income_analysis_query(self, user_id: str) -> str:
+    def _get_income_analysis_query(self) -> str:
         """Get income analysis SQL query"""
         return f"""
         SELECT
             COALESCE(c.name, 'Income') as category_name,
             COUNT(*) as transaction_count,
-            SUM(CAST(t.amount AS DECIMAL)) as total_amount,
-            AVG(CAST(t.amount AS DECIMAL)) as avg_amount,
+            SUM(t.amount) as total_amount,
+            AVG(t.amount) as avg_amount,
             DATE_TRUNC('month', t.date) as month
         FROM transactions t
-        JOIN accounts a ON t.account_id = a.id
         LEFT JOIN categories c ON t.category_id = c.id
-        WHERE a.user_id = '{user_id}'
-            AND CAST(t.amount AS DECIMAL) > 0
+        WHERE t.user_id = :user_id
+            AND t.amount > 0
+            AND t.date >= :start_date AND t.date < :end_date{SLOT_FILTERS}
         GROUP BY c.name, DATE_TRUNC('month', t.date)
         ORDER BY total_amount DESC;
         """
 
-    def _get_financial_summary_query(self, user_id: str) -> str:
+    def _get_financial_summary_query(self) -> str:
         """Get financial summary SQL query"""
         return f"""
         SELECT
             COUNT(*) as total_transactions,
-            SUM(CASE WHEN CAST(amount AS DECIMAL) > 0 THEN CAST(amount AS DECIMAL) ELSE 0 END) as total_income,
-            SUM(CASE WHEN CAST(amount AS DECIMAL) < 0 THEN ABS(CAST(amount AS DECIMAL)) ELSE 0 END) as total_expenses,
-            SUM(CAST(amount AS DECIMAL)) as net_amount,
-            AVG(CASE WHEN CAST(amount AS DECIMAL) > 0 THEN CAST(amount AS DECIMAL) END) as avg_income,
-            AVG(CASE WHEN CAST(amount AS DECIMAL) < 0 THEN ABS(CAST(amount AS DECIMAL)) END) as avg_expense,
-            COUNT(CASE WHEN CAST(amount AS DECIMAL) > 0 THEN 1 END) as income_transactions,
-            COUNT(CASE WHEN CAST(amount AS DECIMAL) < 0 THEN 1 END) as expense_transactions,
-            DATE_TRUNC('month', CURRENT_DATE) as analysis_period
+            SUM(CASE WHEN amount > 0 THEN amount ELSE 0 END) as total_income,
+            SUM(CASE WHEN amount < 0 THEN ABS(amount) ELSE 0 END) as total_expenses,
+            SUM(amount) as net_amount,
+            AVG(CASE WHEN amount > 0 THEN amount END) as avg_income,
+            AVG(CASE WHEN amount < 0 THEN ABS(amount) END) as avg_expense,
+            COUNT(CASE WHEN amount > 0 THEN 1 END) as income_transactions,
+            COUNT(CASE WHEN amount < 0 THEN 1 END) as expense_transactions,
+            CAST(:start_date AS DATE) as analysis_period
         FROM transactions t
-        JOIN accounts a ON t.account_id = a.id
-        WHERE a.user_id = '{user_id}'
-            AND t.date >= DATE_TRUNC('month', CURRENT_DATE);
+        WHERE t.user_id = :user_id
+            AND t.date >= :start_date AND t.date < :end_date{SLOT_FILTERS};
         """
 
-    def _get_comparison_query(self, user_id: str) -> str:
+    def _get_comparison_query(self) -> str:
         """Get comparison analysis query"""
         return f"""
         SELECT
             DATE_TRUNC('month', t.date) as month,
-            SUM(CASE WHEN CAST(amount AS DECIMAL) > 0 THEN CAST(amount AS DECIMAL) ELSE 0 END) as monthly_income,
-            SUM(CASE WHEN CAST(amount AS DECIMAL) < 0 THEN ABS(CAST(amount AS DECIMAL)) ELSE 0 END) as monthly_expenses,
-            SUM(CAST(amount AS DECIMAL)) as monthly_net,
+            SUM(CASE WHEN amount > 0 THEN amount ELSE 0 END) as monthly_income,
+            SUM(CASE WHEN amount < 0 THEN ABS(amount) ELSE 0 END) as monthly_expenses,
+            SUM(amount) as monthly_net,
             COUNT(*) as monthly_transactions
         FROM transactions t
-        JOIN accounts a ON t.account_id = a.id
-        WHERE a.user_id = '{user_id}'
-            AND t.date >= CURRENT_DATE - INTERVAL '6 months'
+        WHERE t.user_id = :user_id
+            AND t.date >= :start_date AND t.date < :end_date{SLOT_FILTERS}
         GROUP BY DATE_TRUNC('month', t.date)
         ORDER BY month DESC;
         """
 
-    def _get_savings_analysis_query(self, user_id: str) -> str:
+    def _get_savings_analysis_query(self) -> str:
         """Get savings analysis query"""
         return f"""
         SELECT
             DATE_TRUNC('month', t.date) as month,
-            SUM(CASE WHEN CAST(amount AS DECIMAL) > 0 THEN CAST(amount AS DECIMAL) ELSE 0 END) as income,
-            SUM(CASE WHEN CAST(amount AS DECIMAL) < 0 THEN ABS(CAST(amount AS DECIMAL)) ELSE 0 END) as expenses,
-            SUM(CAST(amount AS DECIMAL)) as savings,
+            SUM(CASE WHEN amount > 0 THEN amount ELSE 0 END) as income,
+            SUM(CASE WHEN amount < 0 THEN ABS(amount) ELSE 0 END) as expenses,
+            SUM(amount) as savings,
             ROUND(
                 CASE 
-                    WHEN SUM(CASE WHEN CAST(amount AS DECIMAL) > 0 THEN CAST(amount AS DECIMAL) ELSE 0 END) > 0 
-                    THEN SUM(CAST(amount AS DECIMAL)) * 100.0 / SUM(CASE WHEN CAST(amount AS DECIMAL) > 0 THEN CAST(amount AS DECIMAL) ELSE 0 END)
+                    WHEN SUM(CASE WHEN amount > 0 THEN amount ELSE 0 END) > 0 
+                    THEN SUM(amount) * 100.0 / SUM(CASE WHEN amount > 0 THEN amount ELSE 0 END)
                     ELSE 0 
                 END, 2
             ) as savings_rate
         FROM transactions t
-        JOIN accounts a ON t.account_id = a.id
-        WHERE a.user_id = '{user_id}'
+        WHERE t.user_id = :user_id
+            AND t.date >= :start_date AND t.date < :end_date{SLOT_FILTERS}
         GROUP BY DATE_TRUNC('month', t.date)
         ORDER BY month DESC
         LIMIT 6;
         """
 
-    async def _generate_custom_sql(self, user_id: str, question: str) -> str:
+    async def _generate_custom_sql(self, user_id: str, question: str, date_range: Dict[str, Any] = None) -> str:
         """Generate custom SQL using LLM for complex queries"""
+        period_rule = ""
+        if date_range and date_range.get("label"):
+            period_rule = (
+                f"6. The question is about \"{date_range['label']}\": filter "
+                f"t.date >= '{date_range['start'].isoformat()}' AND t.date < '{date_range['end'].isoformat()}'"
+            )
+
         prompt = f"""
         You are a PostgreSQL expert. Generate a SQL query for this financial question: "{question}"
         
         Database Schema:
         - accounts: id(TEXT), user_id(TEXT), name(TEXT)
-        - transactions: id(TEXT), account_id(TEXT), amount(TEXT), date(TIMESTAMP), category_id(TEXT)
+        - transactions: id(TEXT), user_id(TEXT), account_id(TEXT), amount(NUMERIC), date(TIMESTAMP), category_id(TEXT), payee(TEXT)
         - categories: id(TEXT), name(TEXT)
         
         Requirements:
-        1. MUST filter by user_id = '{user_id}' through accounts JOIN
-        2. Use CAST(amount AS DECIMAL) for calculations
+        1. MUST filter transactions by t.user_id = '{user_id}' (no accounts JOIN needed)
+        2. amount is already NUMERIC: never CAST it, compare it directly (amount < 0)
         3. Negative amount = expense, positive = income
         4. Return ONLY the SQL query, no explanations
         5. Use Vietnamese column aliases when appropriate
+        {period_rule}
         
         Query:
         """
@@ -250,26 +451,88 @@ class FinancialSQLAgent:
             
         return sql
 
-    async def _execute_sql_safely(self, sql_query: str, user_id: str) -> pd.DataFrame:
-        """Execute SQL with comprehensive safety checks"""
-        # Security validations
-        if user_id not in sql_query:
-            raise ValueError(f"Query must filter by user_id '{user_id}' for security")
-            
-        if not sql_query.strip().upper().startswith('SELECT'):
-            raise ValueError("Only SELECT queries are allowed")
-            
-        # Prevent dangerous operations
-        dangerous_keywords = ['DROP', 'DELETE', 'UPDATE', 'INSERT', 'ALTER', 'CREATE', 'TRUNCATE']
-        sql_upper = sql_query.upper()
-        for keyword in dangerous_keywords:
-            if keyword in sql_upper:
-                raise ValueError(f"Dangerous operation '{keyword}' not allowed")
-        
+    async def _execute_custom_query(
+        self,
+        user_id: str,
+        question: str,
+        date_range: Dict[str, Any] = None,
+        embedding: Optional[List[float]] = None
+    ) -> pd.DataFrame:
+        """Run LLM-generated SQL, reusing a cached template when one matches"""
+        cached = await self.template_cache.lookup(question, user_id, embedding)
+
+        if cached["hit"]:
+            logger.info(f"♻️ SQL template cache hit ({cached['entry_id']})")
+            try:
+                return await self._execute_sql_safely(
+                    cached["sql"], user_id, cached["params"],
+                    timeout_ms=self.custom_sql_timeout_ms, explain=True
+                )
+            except DBOverloadedError:
+                raise
+            except Exception as e:
+                logger.warning(f"Cached SQL template failed, regenerating: {e}")
+                self.template_cache.evict(cached["entry_id"])
+
+        sql_query = await self._generate_custom_sql(user_id, question, date_range)
+        logger.info(f"🔍 Generated SQL: {sql_query}")
+
+        results_df = await self._execute_sql_safely(
+            sql_query, user_id, timeout_ms=self.custom_sql_timeout_ms, explain=True
+        )
+
+        # Only queries that validated and executed are cached
+        await self.template_cache.store(question, sql_query, user_id, cached.get("embedding"))
+        return results_df
+
+    async def _execute_sql_safely(
+        self,
+        sql_query: str,
+        user_id: str,
+        params: Dict[str, Any] = None,
+        timeout_ms: Optional[int] = None,
+        explain: bool = False,
+        lane: Optional[str] = None
+    ) -> pd.DataFrame:
+        """Execute SQL with comprehensive safety checks off the event loop"""
+        return await run_in_executor(
+            partial(self._execute_sql_sync, sql_query, user_id, params or {}, timeout_ms, explain, lane)
+        )
+
+    def _execute_sql_sync(
+        self,
+        sql_query: str,
+        user_id: str,
+        params: Dict[str, Any],
+        timeout_ms: Optional[int],
+        explain: bool,
+        lane: Optional[str] = None
+    ) -> pd.DataFrame:
+        """Validate, admit and execute on a pooled connection (runs in a worker thread)"""
+        # Parse, prove user scoping and apply a LIMIT
+        sql_query = self.sql_validator.validate(sql_query, user_id, params)
+
+        downsampled = False
+        if explain:
+            admission = self.admission_controller.admit(sql_query, params, user_id)
+            sql_query = admission["sql"]
+            downsampled = admission["downsampled"]
+            logger.info(
+                f"🧮 EXPLAIN cost {admission['estimated_cost']:,.0f}, "
+                f"rows {admission['estimated_rows']:,.0f}"
+            )
+
         try:
-            df = self.db_service.execute_query(sql_query)
+            # LLM-generated SQL goes through the EXPLAIN check and queues in its own lane
+            df = self.db_service.execute_query(
+                sql_query, params, timeout_ms=timeout_ms, read_only=True, user_id=user_id,
+                lane=lane or (LANE_CUSTOM if explain else LANE_CANNED)
+            )
+            df.attrs["downsampled"] = downsampled
             logger.info(f"✅ SQL executed successfully: {len(df)} rows returned")
             return df
+        except DBOverloadedError:
+            raise
         except Exception as e:
             logger.error(f"❌ SQL execution failed: {e}")
             logger.error(f"Query: {sql_query}")
@@ -285,7 +548,7 @@ class FinancialSQLAgent:
         elif query_type == "income_analysis":
             return self._format_income_results(df)
         elif query_type == "financial_summary":
-            return self._format_summary_results(df)
+            return self._format_financial_summary_results(df)
         elif query_type == "comparison_analysis":
             return self._format_comparison_results(df)
         elif query_type == "savings_analysis":
@@ -337,6 +600,32 @@ class FinancialSQLAgent:
         
         return markdown
 
+    def _format_income_results(self, df: pd.DataFrame) -> str:
+        """Format income analysis results"""
+        if df.empty:
+            return "## ⚠️ Không có dữ liệu thu nhập"
+
+        total_income = df['total_amount'].sum()
+        total_transactions = df['transaction_count'].sum()
+        by_source = df.groupby('category_name')['total_amount'].sum().sort_values(ascending=False)
+
+        markdown = f"""## 💵 Phân tích Thu nhập
+
+### 🎯 Tổng quan
+- **Tổng thu nhập:** {total_income:,.0f} VND
+- **Tổng giao dịch:** {total_transactions:,} giao dịch
+- **Nguồn thu lớn nhất:** {by_source.index[0]} ({by_source.iloc[0]:,.0f} VND)
+
+| Tháng | Nguồn thu | Số tiền (VND) | Giao dịch | TB/giao dịch |
+|-------|-----------|---------------|-----------|--------------|"""
+
+        for _, row in df.head(15).iterrows():
+            month = row['month'].strftime('%m/%Y') if pd.notnull(row['month']) else 'N/A'
+            avg_amount = row.get('avg_amount', 0) or 0
+            markdown += f"\n| {month} | **{row['category_name']}** | {row['total_amount']:,.0f} | {row['transaction_count']} | {avg_amount:,.0f} |"
+
+        return markdown
+
     def _format_financial_summary_results(self, df: pd.DataFrame) -> str:
         """Format financial summary results"""
         if df.empty:
@@ -496,6 +785,28 @@ class FinancialSQLAgent:
                 
         return insights[:5]  # Return max 5 insights
 
+    def _find_anomalies(self, user_id: str, parts: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Flagged spikes within the period of any spending-related sub-query, strongest first"""
+        flags = {}
+        for part in parts:
+            if part["query_type"] not in ANOMALY_INTENTS:
+                continue
+            date_range = part["date_range"]
+            for flag in anomaly_engine.flags_for(user_id, date_range["start"], date_range["end"]):
+                flags[(flag["category_name"], flag["date"])] = flag
+        return [
+            {**flag, "date": flag["date"].isoformat()}
+            for flag in sorted(flags.values(), key=lambda f: f["z_score"], reverse=True)[:3]
+        ]
+
+    def _format_anomaly(self, anomaly: Dict[str, Any]) -> str:
+        """One-line insight for a flagged spike"""
+        day = date.fromisoformat(anomaly["date"])
+        return (
+            f"⚠️ Chi tiêu bất thường: {anomaly['category_name']} ngày {day:%d/%m} "
+            f"{anomaly['amount']:,.0f} VND (thường ~{anomaly['typical_amount']:,.0f} VND)"
+        )
+
     def _generate_summary(self, df: pd.DataFrame, query_type: str) -> str:
         """Generate concise summary of results"""
         if df.empty:
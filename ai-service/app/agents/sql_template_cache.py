@@ -0,0 +1,295 @@
+import os
+import re
+import time
+import logging
+from collections import OrderedDict
+from datetime import date, timedelta
+from typing import Dict, Any, List, Optional, Set, Tuple
+
+import numpy as np
+import sqlglot
+from sqlglot import exp
+
+from app.utils.slots import normalize_question, extract_time_window, time_window_range
+from app.services.answer_cache import question_signature, signatures_compatible
+
+logger = logging.getLogger(__name__)
+
+# 'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM[:SS]' string literals
+_DATE_LITERAL = re.compile(r"'(\d{4})-(\d{2})-(\d{2})(?:[ T](\d{2}):(\d{2})(?::(\d{2}))?)?'")
+
+# Opaque generated ids (cuid, uuid, nanoid): one long token mixing letters and digits
+_OPAQUE_ID = re.compile(r"^(?=.*\d)(?=.*[A-Za-z])[A-Za-z0-9_-]{16,}$")
+
+
+def _month_index(d: date) -> int:
+    return d.year * 12 + d.month - 1
+
+
+def _relative_date_spec(value: date, today: date) -> Dict[str, int]:
+    """Describe a literal date relative to today so it can be re-resolved later"""
+    if value.month == 1 and value.day == 1:
+        return {"unit": "year_start", "offset": value.year - today.year}
+    if value.day == 1:
+        return {"unit": "month_start", "offset": _month_index(value) - _month_index(today)}
+    return {"unit": "day", "offset": (value - today).days}
+
+
+def resolve_date_spec(spec: Dict[str, Any], today: date) -> date:
+    """Turn a date spec back into a concrete date"""
+    if spec["unit"] == "absolute":
+        return date.fromisoformat(spec["date"])
+    if spec["unit"] == "year_start":
+        return date(today.year + spec["offset"], 1, 1)
+    if spec["unit"] == "month_start":
+        index = _month_index(today) + spec["offset"]
+        return date(index // 12, index % 12 + 1, 1)
+    return date.fromordinal(today.toordinal() + spec["offset"])
+
+
+def relative_dates(question: str, today: date = None) -> Set[date]:
+    """Bounds of the question's relative time window ("tháng này", "3 tháng gần đây"), as the SQL may spell them"""
+    window = extract_time_window(question)
+    if window is None:
+        return set()
+    start, end = time_window_range(window, today or date.today())
+    # The LLM writes the end either exclusive (< end) or inclusive (<= end - 1 day)
+    return {start, end, end - timedelta(days=1)}
+
+
+def parameterize_sql(
+    sql: str,
+    user_id: str,
+    today: date = None,
+    relative: Optional[Set[date]] = None
+) -> Tuple[str, Dict[str, Dict[str, Any]]]:
+    """Replace the inlined user_id and literal dates with bind parameters"""
+    # Only dates in `relative` (bounds of a window the slot extractor found) move with today on
+    # replay; explicit dates such as "tháng 3/2024" stay fixed
+    today = today or date.today()
+    relative = relative or set()
+    template = sql.replace(f"'{user_id}'", ":user_id")
+
+    date_specs: Dict[str, Dict[str, Any]] = {}
+
+    def _replace(match: re.Match) -> str:
+        try:
+            value = date(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+        except ValueError:
+            return match.group(0)
+        if any(int(part or 0) for part in match.group(4, 5, 6)):
+            # A time of day other than midnight is a specific moment, not a period bound
+            return match.group(0)
+        name = f"date_{len(date_specs)}"
+        if value in relative:
+            date_specs[name] = _relative_date_spec(value, today)
+        else:
+            date_specs[name] = {"unit": "absolute", "date": value.isoformat()}
+        return f"CAST(:{name} AS DATE)"
+
+    template = _DATE_LITERAL.sub(_replace, template)
+    return template, date_specs
+
+
+def has_id_literals(template: str) -> bool:
+    """True if the SQL still holds a string literal that identifies one user's rows (an id)"""
+    try:
+        tree = sqlglot.parse_one(template, read="postgres")
+    except sqlglot.errors.ParseError:
+        return True
+    for literal in tree.find_all(exp.Literal):
+        if not literal.is_string:
+            continue
+        if _OPAQUE_ID.match(literal.this):
+            return True
+        compared = literal.parent.parent if isinstance(literal.parent, exp.Tuple) else literal.parent
+        if isinstance(compared, (exp.EQ, exp.NEQ, exp.In)):
+            columns = [node for node in compared.iter_expressions() if isinstance(node, exp.Column)]
+            if any(c.name.lower() == "id" or c.name.lower().endswith("_id") for c in columns):
+                return True
+    return False
+
+
+class SQLTemplateCache:
+    def __init__(
+        self,
+        embeddings=None,
+        similarity_threshold: float = None,
+        max_entries: int = None,
+        ttl_seconds: int = None
+    ):
+        """Cache of validated, parameterised SQL templates for LLM-generated queries"""
+        self.embeddings = embeddings
+        self.similarity_threshold = similarity_threshold if similarity_threshold is not None else float(
+            os.getenv("SQL_TEMPLATE_SIMILARITY", "0.93")
+        )
+        self.max_entries = max_entries or int(os.getenv("SQL_TEMPLATE_CACHE_SIZE", "500"))
+        self.ttl_seconds = ttl_seconds or int(os.getenv("SQL_TEMPLATE_TTL_SECONDS", "86400"))
+
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._by_text: Dict[str, str] = {}
+        self._matrix: Optional[np.ndarray] = None
+        self._matrix_ids: List[str] = []
+        self._next_id = 0
+
+        self._stats = {
+            "hits": 0,
+            "semantic_hits": 0,
+            "signature_mismatches": 0,
+            "misses": 0,
+            "stores": 0,
+            "skipped_id_literals": 0,
+            "evictions": 0
+        }
+
+    async def _embed(self, question: str) -> Optional[np.ndarray]:
+        if self.embeddings is None:
+            return None
+        try:
+            return np.asarray(await self.embeddings.embed_text(question), dtype=np.float32)
+        except Exception as e:
+            logger.warning(f"Template cache embedding failed: {e}")
+            return None
+
+    def _expired(self, entry: Dict[str, Any]) -> bool:
+        return time.time() - entry["created_at"] > self.ttl_seconds
+
+    def _nearest(self, embedding: np.ndarray) -> Optional[str]:
+        """Nearest cached question by cosine similarity above the threshold"""
+        if self._matrix is None:
+            ids = [entry_id for entry_id, entry in self._entries.items() if entry["embedding"] is not None]
+            if not ids:
+                return None
+            self._matrix = np.vstack([self._entries[entry_id]["embedding"] for entry_id in ids])
+            self._matrix_ids = ids
+
+        similarities = self._matrix @ embedding
+        best = int(np.argmax(similarities))
+        if similarities[best] >= self.similarity_threshold:
+            return self._matrix_ids[best]
+        return None
+
+    def _bind(self, entry: Dict[str, Any], user_id: str) -> Tuple[str, Dict[str, Any]]:
+        today = date.today()
+        params: Dict[str, Any] = {"user_id": user_id}
+        for name, spec in entry["date_specs"].items():
+            params[name] = resolve_date_spec(spec, today)
+        return entry["template"], params
+
+    async def lookup(self, question: str, user_id: str, embedding: Optional[List[float]] = None) -> Dict[str, Any]:
+        """Find a template by normalised text, then by embedding nearest neighbour"""
+        key = normalize_question(question)
+        entry_id = self._by_text.get(key)
+        semantic = False
+        if embedding is not None:
+            embedding = np.asarray(embedding, dtype=np.float32)
+
+        if entry_id is None:
+            if embedding is None:
+                embedding = await self._embed(question)
+            if embedding is not None:
+                entry_id = self._nearest(embedding)
+                # A paraphrase must ask about the same period, category and payee as the cached question
+                if entry_id is not None and not signatures_compatible(
+                    question_signature(question), self._entries[entry_id]["signature"]
+                ):
+                    self._stats["signature_mismatches"] += 1
+                    entry_id = None
+                semantic = entry_id is not None
+
+        entry = self._entries.get(entry_id) if entry_id else None
+        if entry is not None and self._expired(entry):
+            self.evict(entry_id, reason="expired")
+            entry = None
+
+        if entry is None:
+            self._stats["misses"] += 1
+            return {"hit": False, "embedding": embedding}
+
+        self._entries.move_to_end(entry_id)
+        entry["hits"] += 1
+        self._stats["hits"] += 1
+        if semantic:
+            self._stats["semantic_hits"] += 1
+
+        sql, params = self._bind(entry, user_id)
+        return {"hit": True, "entry_id": entry_id, "sql": sql, "params": params, "embedding": embedding}
+
+    async def store(self, question: str, sql: str, user_id: str, embedding: Optional[np.ndarray] = None):
+        """Store a successfully executed LLM query as a parameterised template"""
+        today = date.today()
+        template, date_specs = parameterize_sql(sql, user_id, today, relative_dates(question, today))
+        if user_id in template:
+            # user_id appears somewhere we could not abstract; never share it
+            logger.warning("Skipping template cache: user_id not fully parameterised")
+            return
+        if has_id_literals(template):
+            # Templates are shared by all users; another user's category or account id must not be replayed
+            self._stats["skipped_id_literals"] += 1
+            logger.info("Skipping template cache: SQL filters on a literal id")
+            return
+
+        if embedding is None:
+            embedding = await self._embed(question)
+
+        key = normalize_question(question)
+        entry_id = str(self._next_id)
+        self._next_id += 1
+
+        self._entries[entry_id] = {
+            "question": key,
+            "template": template,
+            "date_specs": date_specs,
+            "signature": question_signature(question),
+            "embedding": embedding,
+            "created_at": time.time(),
+            "hits": 0
+        }
+        old_id = self._by_text.get(key)
+        self._by_text[key] = entry_id
+        if old_id is not None:
+            self.evict(old_id, reason="replaced")
+        self._matrix = None
+        self._stats["stores"] += 1
+
+        while len(self._entries) > self.max_entries:
+            oldest_id = next(iter(self._entries))
+            self.evict(oldest_id, reason="capacity")
+
+    def evict(self, entry_id: str, reason: str = "error"):
+        """Drop a template, e.g. after it errored or timed out"""
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return
+        if self._by_text.get(entry["question"]) == entry_id:
+            del self._by_text[entry["question"]]
+        self._matrix = None
+        self._stats["evictions"] += 1
+        logger.info(f"Evicted SQL template {entry_id} ({reason})")
+
+    def clear(self):
+        """Clear all templates"""
+        self._entries.clear()
+        self._by_text.clear()
+        self._matrix = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get cache statistics"""
+        return {"templates": len(self._entries), **self._stats}
+
+
+# Global template cache instance
+sql_template_cache = None
+
+
+def get_sql_template_cache() -> SQLTemplateCache:
+    """Get template cache instance with lazy initialization"""
+    global sql_template_cache
+    if sql_template_cache is None:
+        try:
+            from app.embeddings import embeddings_service
+        except Exception as e:
+            logger.warning(f"Embeddings unavailable for SQL template cache: {e}")
+            embeddings_service = None
+        sql_template_cache = SQLTemplateCache(embeddings=embeddings_service)
+    return sql_template_cache
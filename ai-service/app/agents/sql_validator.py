@@ -0,0 +1,334 @@
+import os
+import json
+import logging
+from typing import Dict, Any, List, Optional, Set
+
+import sqlglot
+from sqlglot import exp
+
+logger = logging.getLogger(__name__)
+
+# Tables the financial agent may read
+ALLOWED_TABLES = {"transactions", "accounts", "categories"}
+
+# Functions the financial agent may call, by sqlglot name (anything else, e.g. pg_* or *_to_xml, is refused)
+ALLOWED_FUNCTIONS = {
+    # Aggregates
+    "count", "sum", "avg", "min", "max", "median", "stddev", "stddev_pop", "stddev_samp",
+    "variance", "variance_pop", "corr", "percentile_cont", "percentile_disc",
+    "array_agg", "group_concat", "logical_and", "logical_or",
+    # Window functions
+    "row_number", "rank", "dense_rank", "percent_rank", "cume_dist", "ntile",
+    "lag", "lead", "first_value", "last_value",
+    # Scalar
+    "abs", "round", "floor", "ceil", "trunc", "sign", "sqrt", "pow", "exp", "ln", "mod",
+    "greatest", "least", "coalesce", "nullif", "case", "if", "cast", "try_cast", "exists", "array",
+    "lower", "upper", "initcap", "length", "trim", "concat", "concat_ws", "replace", "substring",
+    "left", "right", "pad", "split_part", "str_position", "to_number",
+    # Dates
+    "current_date", "current_timestamp", "date", "extract", "timestamp_trunc", "date_trunc",
+    "time_to_str", "str_to_date", "str_to_time", "date_add", "date_sub", "datediff",
+    "age", "make_date", "date_part", "justify_days",
+}
+
+_WRITE_NODES = tuple(
+    getattr(exp, name) for name in (
+        "Insert", "Update", "Delete", "Merge", "Create", "Drop", "Alter", "AlterTable",
+        "TruncateTable", "Command", "Into", "Lock", "Grant", "Copy", "Set", "Transaction",
+        "Commit", "Rollback", "Use",
+    ) if hasattr(exp, name)
+)
+
+
+class SQLValidationError(ValueError):
+    """Raised when generated SQL is not a safe, user-scoped SELECT"""
+
+
+def _arg(node: exp.Expression, *names: str):
+    """Read an AST argument across sqlglot versions ("from" vs "from_")"""
+    for name in names:
+        value = node.args.get(name)
+        if value is not None:
+            return value
+    return None
+
+
+def _conjuncts(condition: Optional[exp.Expression]) -> List[exp.Expression]:
+    """Flatten an AND tree into its conjuncts"""
+    if condition is None:
+        return []
+    if isinstance(condition, exp.Where):
+        condition = condition.this
+    if isinstance(condition, exp.Paren):
+        return _conjuncts(condition.this)
+    if isinstance(condition, exp.And):
+        return _conjuncts(condition.left) + _conjuncts(condition.right)
+    return [condition]
+
+
+def _visible_ctes(select: exp.Select) -> Set[str]:
+    """CTE names a SELECT can reference: the WITHs of itself and its ancestors, not of other subqueries"""
+    names: Set[str] = set()
+    path: List[exp.Expression] = []
+    node = select
+    while node is not None:
+        with_clause = _arg(node, "with_", "with")
+        if with_clause is not None:
+            ctes = list(with_clause.expressions)
+            if path and path[-1] is with_clause:
+                # Inside a CTE body: only the earlier CTEs, and the CTE itself under RECURSIVE
+                own = path[-2]
+                index = next(i for i, cte in enumerate(ctes) if cte is own)
+                ctes = ctes[:index + 1] if with_clause.args.get("recursive") else ctes[:index]
+            names.update(cte.alias_or_name.lower() for cte in ctes)
+        path.append(node)
+        node = node.parent
+    return names
+
+
+def _is_outer(join: exp.Join) -> bool:
+    side = (join.side or "").upper()
+    kind = (join.kind or "").upper()
+    return side in ("LEFT", "RIGHT", "FULL") or kind in ("OUTER", "FULL")
+
+
+class _Scope:
+    """Tables and filtering predicates of a single SELECT"""
+
+    def __init__(self, select: exp.Select, cte_names: Set[str]):
+        self.select = select
+        self.tables: Dict[str, str] = {}          # alias -> base table name
+        self.own_on: Dict[str, List[exp.Expression]] = {}
+        self.filters: List[exp.Expression] = _conjuncts(_arg(select, "where"))
+
+        from_clause = _arg(select, "from_", "from")
+        if from_clause is not None:
+            self._add_source(from_clause.this, cte_names, [])
+
+        for join in _arg(select, "joins") or []:
+            on = _conjuncts(_arg(join, "on"))
+            source = join.this
+            if not on and not _arg(join, "using") and isinstance(source, exp.Table):
+                raise SQLValidationError("Cartesian joins are not allowed")
+            if (join.kind or "").upper() == "CROSS":
+                raise SQLValidationError("CROSS JOIN is not allowed")
+            self._add_source(source, cte_names, on)
+            if not _is_outer(join):
+                self.filters.extend(on)
+
+    def _add_source(self, source: exp.Expression, cte_names: Set[str], on: List[exp.Expression]):
+        if not isinstance(source, exp.Table):
+            # Derived tables are validated as their own scopes
+            return
+        name = source.name.lower()
+        if source.args.get("db") or source.args.get("catalog"):
+            raise SQLValidationError(f"Schema-qualified table '{source.sql()}' is not allowed")
+        if name in cte_names:
+            return
+        if name not in ALLOWED_TABLES:
+            raise SQLValidationError(f"Table '{name}' is not allowed")
+        alias = source.alias_or_name.lower()
+        self.tables[alias] = name
+        self.own_on[alias] = on
+
+    def column_alias(self, column: exp.Column) -> Optional[str]:
+        """Resolve the table alias of a column, allowing unqualified single-table scopes"""
+        if column.table:
+            return column.table.lower()
+        if len(self.tables) == 1:
+            return next(iter(self.tables))
+        return None
+
+
+class SQLValidator:
+    def __init__(self, default_limit: int = None, max_limit: int = None):
+        """Parse-based validator for agent SQL"""
+        self.default_limit = default_limit or int(os.getenv("SQL_DEFAULT_LIMIT", "200"))
+        self.max_limit = max_limit or int(os.getenv("SQL_MAX_LIMIT", "1000"))
+
+    def validate(self, sql: str, user_id: str, params: Dict[str, Any] = None) -> str:
+        """Validate SQL and return a normalised query with a LIMIT applied"""
+        params = params or {}
+
+        try:
+            statements = [s for s in sqlglot.parse(sql, read="postgres") if s is not None]
+        except sqlglot.errors.ParseError as e:
+            raise SQLValidationError(f"SQL could not be parsed: {e}")
+
+        if len(statements) != 1:
+            raise SQLValidationError("Exactly one SQL statement is allowed")
+        tree = statements[0]
+
+        if not isinstance(tree, exp.Query):
+            raise SQLValidationError("Only SELECT queries are allowed")
+
+        for node in tree.walk():
+            if isinstance(node, _WRITE_NODES):
+                raise SQLValidationError(f"Operation '{node.key.upper()}' not allowed")
+            if isinstance(node, exp.Dot) and isinstance(node.expression, exp.Func):
+                raise SQLValidationError(f"Schema-qualified function '{node.sql()}' is not allowed")
+            if isinstance(node, exp.Func) and not isinstance(node, exp.Connector):
+                name = (node.sql_name() if not isinstance(node, exp.Anonymous) else node.name).lower()
+                if name not in ALLOWED_FUNCTIONS:
+                    raise SQLValidationError(f"Function '{name}' not allowed")
+
+        scoped_tables = 0
+        for select in tree.find_all(exp.Select):
+            scope = _Scope(select, _visible_ctes(select))
+            self._check_scope(scope, user_id, params)
+            scoped_tables += len(scope.tables)
+
+        if scoped_tables == 0:
+            raise SQLValidationError(f"Query must filter by user_id '{user_id}' for security")
+
+        tree = self._apply_limit(tree)
+        return self._render(tree)
+
+    def _is_user_value(self, node: exp.Expression, user_id: str, params: Dict[str, Any]) -> bool:
+        if isinstance(node, exp.Literal) and node.is_string:
+            return node.this == user_id
+        if isinstance(node, exp.Placeholder):
+            return params.get(node.name) == user_id
+        return False
+
+    def _user_filtered(self, alias: str, predicates: List[exp.Expression], scope: _Scope, user_id: str, params: Dict[str, Any]) -> bool:
+        """True if predicates contain alias.user_id = <this user>"""
+        for predicate in predicates:
+            if not isinstance(predicate, exp.EQ):
+                continue
+            for column, value in ((predicate.left, predicate.right), (predicate.right, predicate.left)):
+                if (
+                    isinstance(column, exp.Column)
+                    and column.name.lower() == "user_id"
+                    and scope.column_alias(column) == alias
+                    and self._is_user_value(value, user_id, params)
+                ):
+                    return True
+        return False
+
+    def _joined_on(self, predicates: List[exp.Expression], scope: _Scope, left: tuple, right: tuple) -> bool:
+        """True if predicates contain an equality between (alias, column) pairs"""
+        for predicate in predicates:
+            if not isinstance(predicate, exp.EQ):
+                continue
+            columns = [predicate.left, predicate.right]
+            if not all(isinstance(c, exp.Column) for c in columns):
+                continue
+            pairs = {(scope.column_alias(c), c.name.lower()) for c in columns}
+            if pairs == {left, right}:
+                return True
+        return False
+
+    def _check_scope(self, scope: _Scope, user_id: str, params: Dict[str, Any]):
+        """Prove every base table in the scope only exposes this user's rows"""
+        scoped: Set[str] = set()
+
+        for alias, table in scope.tables.items():
+            predicates = scope.filters + scope.own_on[alias]
+            if table in ("accounts", "categories", "transactions") and self._user_filtered(alias, predicates, scope, user_id, params):
+                scoped.add(alias)
+
+        # Transactions are scoped through an inner join to a scoped account
+        for alias, table in scope.tables.items():
+            if table != "transactions" or alias in scoped:
+                continue
+            predicates = scope.filters + scope.own_on[alias]
+            if any(
+                scope.tables[a] == "accounts" and self._joined_on(predicates, scope, (alias, "account_id"), (a, "id"))
+                for a in scoped
+            ):
+                scoped.add(alias)
+
+        # Categories may hang off a scoped transaction
+        for alias, table in scope.tables.items():
+            if table != "categories" or alias in scoped:
+                continue
+            predicates = scope.filters + scope.own_on[alias]
+            if any(
+                scope.tables[t] == "transactions" and self._joined_on(predicates, scope, (alias, "id"), (t, "category_id"))
+                for t in scoped
+            ):
+                scoped.add(alias)
+
+        unscoped = [f"{scope.tables[a]} {a}" for a in scope.tables if a not in scoped]
+        if unscoped:
+            raise SQLValidationError(
+                f"Query must filter by user_id '{user_id}' on transactions or through the accounts join "
+                f"(unscoped: {', '.join(unscoped)})"
+            )
+
+    def _apply_limit(self, tree: exp.Query, limit: int = None) -> exp.Query:
+        """Inject a LIMIT or clamp an existing one"""
+        limit = min(limit or self.default_limit, self.max_limit)
+        existing = _arg(tree, "limit")
+        if existing is not None:
+            value = existing.expression
+            if isinstance(value, exp.Literal) and not value.is_string and int(value.this) <= limit:
+                return tree
+        return tree.limit(limit, copy=False)
+
+    def with_limit(self, sql: str, limit: int) -> str:
+        """Re-render an already validated query with a tighter LIMIT"""
+        tree = sqlglot.parse_one(sql, read="postgres")
+        existing = _arg(tree, "limit")
+        if existing is not None and isinstance(existing.expression, exp.Literal):
+            if int(existing.expression.this) <= limit:
+                return sql
+        return self._render(tree.limit(limit, copy=False))
+
+    def _render(self, tree: exp.Expression) -> str:
+        """Render back to SQL keeping :name binds for SQLAlchemy text()"""
+        tree = tree.transform(
+            lambda node: exp.var(f":{node.name}") if isinstance(node, exp.Placeholder) else node
+        )
+        return tree.sql(dialect="postgres")
+
+
+class SQLAdmissionController:
+    def __init__(self, db_service, max_cost: float = None, max_rows: int = None, validator: SQLValidator = None):
+        """EXPLAIN-based admission control for untrusted SQL"""
+        self.db_service = db_service
+        self.validator = validator or SQLValidator()
+        self.max_cost = max_cost or float(os.getenv("SQL_MAX_EXPLAIN_COST", "50000"))
+        self.max_rows = max_rows or int(os.getenv("SQL_MAX_EXPLAIN_ROWS", "100000"))
+
+    def _explain(self, sql: str, params: Dict[str, Any], user_id: str = None) -> Dict[str, Any]:
+        df = self.db_service.execute_query(f"EXPLAIN (FORMAT JSON) {sql}", params, read_only=True, user_id=user_id)
+        plan = df.iloc[0, 0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return plan[0]["Plan"]
+
+    def _max_scan_rows(self, plan: Dict[str, Any]) -> float:
+        """Largest row estimate of any node below the top-level LIMIT"""
+        rows = plan.get("Plan Rows", 0) if plan.get("Node Type") != "Limit" else 0
+        for child in plan.get("Plans", []):
+            rows = max(rows, self._max_scan_rows(child))
+        return rows
+
+    def admit(self, sql: str, params: Dict[str, Any] = None, user_id: str = None) -> Dict[str, Any]:
+        """Refuse queries over the cost budget, down-sample oversized results"""
+        params = params or {}
+        plan = self._explain(sql, params, user_id)
+
+        cost = float(plan.get("Total Cost", 0))
+        if cost > self.max_cost:
+            raise SQLValidationError(
+                f"Query refused: estimated cost {cost:,.0f} exceeds limit {self.max_cost:,.0f}"
+            )
+
+        scan_rows = self._max_scan_rows(plan)
+        downsampled = False
+        if scan_rows > self.max_rows:
+            # Keep the query but return only a bounded sample of its result
+            sample_limit = max(1, self.validator.default_limit // 4)
+            sql = self.validator.with_limit(sql, sample_limit)
+            downsampled = True
+            logger.warning(f"Query down-sampled: {scan_rows:,.0f} estimated rows > {self.max_rows:,}")
+
+        return {
+            "sql": sql,
+            "estimated_cost": cost,
+            "estimated_rows": scan_rows,
+            "downsampled": downsampled
+        }
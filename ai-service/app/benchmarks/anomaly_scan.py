@@ -0,0 +1,117 @@
+import sys
+import os
+import time
+import argparse
+import resource
+from datetime import date, timedelta
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from app.services.anomaly_detection import (
+    AnomalyEngine, ANOMALY_CHUNK_USERS, ANOMALY_MIN_AMOUNT, ANOMALY_MIN_ACTIVE_DAYS, ANOMALY_Z_THRESHOLD
+)
+
+CATEGORIES = ["Ăn uống", "Di chuyển", "Mua sắm", "Hóa đơn", "Giải trí", "Sức khỏe"]
+
+START = date(2025, 1, 6)
+
+
+def synthetic_chunk(rng: np.random.Generator, first_user: int, users: int, days: int, history_days: int) -> Tuple[pd.DataFrame, set]:
+    """Daily per-category spend rows as the bulk query returns them, plus the injected (user, category, day) spikes"""
+    n_categories = rng.integers(2, len(CATEGORIES) + 1, size=users)
+    user_idx = np.repeat(np.arange(users), n_categories)
+    category_idx = np.concatenate([rng.permutation(len(CATEGORIES))[:n] for n in n_categories])
+
+    # Typical spend per category with a weekend bump, on the days the user buys anything there
+    typical = rng.lognormal(11.5, 0.8, size=len(user_idx))
+    weekday = (np.arange(days) + START.weekday()) % 7
+    spend = typical[:, None] * np.where(weekday >= 5, 1.4, 1.0) * rng.lognormal(0, 0.35, size=(len(user_idx), days))
+    spend *= rng.random((len(user_idx), days)) < rng.uniform(0.2, 0.9, size=(len(user_idx), 1))
+
+    # One spike in the recent days for 2% of the series
+    spiked = np.flatnonzero(rng.random(len(user_idx)) < 0.02)
+    spike_days = rng.integers(history_days, days, size=len(spiked))
+    spend[spiked, spike_days] = np.maximum(typical[spiked] * rng.uniform(8, 15, size=len(spiked)), ANOMALY_MIN_AMOUNT * 2)
+
+    series, day = np.nonzero(spend)
+    df = pd.DataFrame({
+        "user_id": [f"user_{first_user + u}" for u in user_idx[series]],
+        "day": pd.to_datetime(START) + pd.to_timedelta(day, unit="D"),
+        "category_name": np.array(CATEGORIES)[category_idx[series]],
+        "spend": spend[series, day]
+    })
+    injected = {
+        (f"user_{first_user + user_idx[s]}", CATEGORIES[category_idx[s]], START + timedelta(days=int(d)))
+        for s, d in zip(spiked, spike_days)
+    }
+    return df, injected
+
+
+def per_user_loop(engine: AnomalyEngine, df: pd.DataFrame) -> int:
+    """The naive alternative: one Python pass per (user, category) series"""
+    flagged = 0
+    for _, group in df.groupby(["user_id", "category_name"]):
+        values = np.zeros(engine.days)
+        values[(group["day"] - pd.Timestamp(START)).dt.days.to_numpy()] = group["spend"].to_numpy()
+        weekly = values[:engine.history_days].reshape(-1, 7)
+        baseline = np.median(weekly, axis=0)
+        deviation = np.abs(weekly - baseline).ravel()
+        scale = np.median(deviation) * 1.4826 or deviation.mean() * 1.2533
+        if not scale or (weekly > 0).sum() < ANOMALY_MIN_ACTIVE_DAYS:
+            continue
+        for offset in range(engine.history_days, engine.days):
+            if (values[offset] - baseline[offset % 7]) / scale >= ANOMALY_Z_THRESHOLD and values[offset] >= ANOMALY_MIN_AMOUNT:
+                flagged += 1
+    return flagged
+
+
+def main(users: int, chunk_size: int, loop_sample: int, seed: int) -> int:
+    rng = np.random.default_rng(seed)
+    engine = AnomalyEngine()
+    print(f"🚨 Anomaly scan of {users:,} users x {engine.days} days, {chunk_size:,} users per chunk\n")
+
+    generated = detected = 0.0
+    rows = series = 0
+    injected, found = set(), set()
+    for first in range(0, users, chunk_size):
+        started = time.perf_counter()
+        df, spikes = synthetic_chunk(rng, first, min(chunk_size, users - first), engine.days, engine.history_days)
+        generated += time.perf_counter() - started
+        injected |= spikes
+        rows += len(df)
+
+        started = time.perf_counter()
+        flags = engine.detect(df, START)
+        detected += time.perf_counter() - started
+        series += len(df[["user_id", "category_name"]].drop_duplicates())
+        found |= {(u, f["category_name"], f["date"]) for u, user_flags in flags.items() for f in user_flags}
+
+    recall = len(injected & found) / len(injected) if injected else 0.0
+    precision = len(injected & found) / len(found) if found else 1.0
+    print(f"rows        {rows:,} daily category rows, {series:,} series (synthetic data {generated:.1f}s)")
+    print(f"vectorised  {detected:6.2f}s  ({users / detected:,.0f} users/s)")
+    print(f"flags       {len(found):,}, recall {recall:.1%}, precision {precision:.1%} against injected spikes")
+    print(f"peak RSS    {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:,.0f} MB\n")
+
+    sample, _ = synthetic_chunk(rng, 0, loop_sample, engine.days, engine.history_days)
+    started = time.perf_counter()
+    per_user_loop(engine, sample)
+    loop_seconds = (time.perf_counter() - started) / loop_sample * users
+    print(f"per-user Python loop, extrapolated from {loop_sample} users: {loop_seconds:,.0f}s "
+          f"({loop_seconds / detected:,.0f}x slower)")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Vectorised anomaly detection throughput on synthetic users")
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--chunk-size", type=int, default=ANOMALY_CHUNK_USERS)
+    parser.add_argument("--loop-sample", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    sys.exit(main(args.users, args.chunk_size, args.loop_sample, args.seed))
@@ -0,0 +1,89 @@
+import sys
+import os
+import json
+import asyncio
+import argparse
+from typing import Dict, Any, List
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from app.services.answer_cache import should_reuse, question_signature, signatures_compatible, SemanticAnswerCache
+
+EVAL_SET_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "paraphrase_eval.jsonl")
+
+THRESHOLDS = [0.80, 0.84, 0.86, 0.88, 0.90, 0.92, 0.94, 0.96, 0.98]
+
+
+def load_pairs(path: str = EVAL_SET_PATH) -> List[Dict[str, Any]]:
+    """Load labelled (a, b, same) question pairs"""
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def score_decisions(pairs: List[Dict[str, Any]], decisions: List[bool]) -> Dict[str, Any]:
+    """Precision of reuse decisions (wrong answers served) and recall (paraphrases caught)"""
+    reused = sum(decisions)
+    correct = sum(1 for pair, reuse in zip(pairs, decisions) if reuse and pair["same"])
+    positives = sum(1 for pair in pairs if pair["same"])
+    return {
+        "reused": reused,
+        "wrong_reuse": reused - correct,
+        "precision": correct / reused if reused else 1.0,
+        "recall": correct / positives if positives else 0.0,
+    }
+
+
+async def pair_similarities(embeddings, pairs: List[Dict[str, Any]]) -> np.ndarray:
+    """Cosine similarity of each pair from one batched encode"""
+    vectors = await embeddings.embed_texts([p["a"] for p in pairs] + [p["b"] for p in pairs])
+    a, b = vectors[:len(pairs)], vectors[len(pairs):]
+    return np.sum(a * b, axis=1)
+
+
+async def main(min_precision: float):
+    pairs = load_pairs()
+    signatures = [(question_signature(p["a"]), question_signature(p["b"])) for p in pairs]
+    negatives = [i for i, p in enumerate(pairs) if not p["same"]]
+    blocked = sum(1 for i in negatives if not signatures_compatible(*signatures[i]))
+    missed = sum(1 for i, p in enumerate(pairs) if p["same"] and not signatures_compatible(*signatures[i]))
+    print(f"📋 {len(pairs)} labelled pairs, {len(negatives)} non-paraphrases")
+    print(f"signature guard alone blocks {blocked}/{len(negatives)} non-paraphrases "
+          f"and {missed}/{len(pairs) - len(negatives)} paraphrases\n")
+
+    try:
+        from app.embeddings import embeddings_service
+    except Exception as e:
+        print(f"⚠️  Embeddings unavailable, skipping threshold sweep: {e}")
+        return 0
+
+    similarities = await pair_similarities(embeddings_service, pairs)
+    configured = SemanticAnswerCache().similarity_threshold
+
+    recommended = None
+    for threshold in sorted(set(THRESHOLDS + [configured])):
+        decisions = [should_reuse(sim, *signatures[i], threshold) for i, sim in enumerate(similarities)]
+        report = score_decisions(pairs, decisions)
+        marker = " <- configured" if threshold == configured else ""
+        print(f"threshold={threshold:.2f} precision={report['precision']:.1%} "
+              f"recall={report['recall']:.1%} wrong_reuse={report['wrong_reuse']}{marker}")
+        if recommended is None and report["precision"] >= min_precision:
+            recommended = threshold
+
+    decisions = [should_reuse(sim, *signatures[i], configured) for i, sim in enumerate(similarities)]
+    precision = score_decisions(pairs, decisions)["precision"]
+    print(f"\nlowest threshold with precision >= {min_precision:.0%}: {recommended}")
+    if precision < min_precision:
+        print(f"❌ ANSWER_CACHE_SIMILARITY={configured} serves wrong answers (precision {precision:.1%})")
+        return 1
+    print(f"✅ ANSWER_CACHE_SIMILARITY={configured} meets the precision target")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Answer cache paraphrase precision check")
+    parser.add_argument("--min-precision", type=float, default=1.0)
+    args = parser.parse_args()
+
+    sys.exit(asyncio.run(main(args.min_precision)))
@@ -0,0 +1,61 @@
+import sys
+import os
+import gc
+import time
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from app.workflows.checkpointer import create_checkpointer, get_checkpointer_stats
+from app.benchmarks.synthetic_workflow import build_synthetic_workflow, initial_state
+
+
+def rss_mb() -> float:
+    """Current resident set size in MB (Linux /proc, falls back to peak RSS)"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def soak(mode: str, questions: int, users: int, payload_bytes: int, samples: int):
+    """Ask many distinct questions and sample RSS as the checkpointer fills up"""
+    checkpointer = create_checkpointer(mode)
+    workflow = build_synthetic_workflow(checkpointer=checkpointer, payload_bytes=payload_bytes)
+    step = max(1, questions // samples)
+
+    print(f"🧪 mode={mode} questions={questions:,} payload={payload_bytes:,}B")
+    gc.collect()
+    baseline = rss_mb()
+    started = time.perf_counter()
+
+    for i in range(questions):
+        user_id = f"user_{i % users}"
+        question = f"Chi tiêu tháng này lần {i}"
+        # Same thread_id scheme as analyze_financial: every distinct question is a new thread
+        config = {"configurable": {"thread_id": f"user_{user_id}_{i}"}}
+        await workflow.app.ainvoke(initial_state(user_id, question), config)
+
+        if (i + 1) % step == 0:
+            gc.collect()
+            print(f"  {i + 1:>9,} questions  rss={rss_mb():8.1f} MB  (+{rss_mb() - baseline:7.1f})")
+
+    elapsed = time.perf_counter() - started
+    print(f"  {get_checkpointer_stats(checkpointer)}")
+    print(f"  {questions / elapsed:,.0f} questions/s\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Checkpointer memory soak test")
+    parser.add_argument("--mode", default="bounded", choices=["bounded", "none", "memory"])
+    parser.add_argument("--questions", type=int, default=100_000)
+    parser.add_argument("--users", type=int, default=1_000)
+    parser.add_argument("--payload-bytes", type=int, default=4_096)
+    parser.add_argument("--samples", type=int, default=10)
+    args = parser.parse_args()
+
+    asyncio.run(soak(args.mode, args.questions, args.users, args.payload_bytes, args.samples))
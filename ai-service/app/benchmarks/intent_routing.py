@@ -0,0 +1,73 @@
+import sys
+import os
+import json
+import asyncio
+from typing import Dict, Any, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from app.agents.intent_router import IntentRouter, detect_intent_by_keywords, FALLBACK_INTENT
+
+EVAL_SET_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "intent_eval.jsonl")
+
+
+def load_eval_set(path: str = EVAL_SET_PATH) -> List[Dict[str, str]]:
+    """Load labelled (question, intent) pairs"""
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def score_predictions(examples: List[Dict[str, str]], predictions: List[str]) -> Dict[str, Any]:
+    """Accuracy and LLM fallback rate for a list of predicted intents"""
+    total = len(examples)
+    correct = sum(1 for ex, pred in zip(examples, predictions) if ex["intent"] == pred)
+    fallbacks = sum(1 for pred in predictions if pred == FALLBACK_INTENT)
+    # Questions that a canned template could answer but were sent to the LLM anyway
+    avoidable = sum(
+        1 for ex, pred in zip(examples, predictions)
+        if pred == FALLBACK_INTENT and ex["intent"] != FALLBACK_INTENT
+    )
+    return {
+        "examples": total,
+        "accuracy": correct / total if total else 0.0,
+        "fallback_rate": fallbacks / total if total else 0.0,
+        "avoidable_fallbacks": avoidable,
+    }
+
+
+async def evaluate_router(router: IntentRouter, examples: List[Dict[str, str]]) -> List[str]:
+    """Route every example question"""
+    predictions = []
+    for ex in examples:
+        route = await router.route(ex["question"])
+        predictions.append(route["intent"])
+    return predictions
+
+
+def print_report(name: str, report: Dict[str, Any]):
+    print(f"{name:<18} accuracy={report['accuracy']:.1%} "
+          f"fallback_rate={report['fallback_rate']:.1%} "
+          f"avoidable_fallbacks={report['avoidable_fallbacks']}/{report['examples']}")
+
+
+async def main():
+    examples = load_eval_set()
+    expected_fallback = sum(1 for ex in examples if ex["intent"] == FALLBACK_INTENT) / len(examples)
+    print(f"📋 {len(examples)} labelled questions, {expected_fallback:.1%} genuinely need custom SQL\n")
+
+    keyword_predictions = [detect_intent_by_keywords(ex["question"]) for ex in examples]
+    print_report("keyword cascade", score_predictions(examples, keyword_predictions))
+
+    try:
+        from app.embeddings import embeddings_service
+    except Exception as e:
+        print(f"⚠️  Embeddings unavailable, skipping router evaluation: {e}")
+        return
+
+    router = IntentRouter(embeddings=embeddings_service)
+    router_predictions = await evaluate_router(router, examples)
+    print_report("intent router", score_predictions(examples, router_predictions))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
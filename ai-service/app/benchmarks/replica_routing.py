@@ -0,0 +1,58 @@
+import sys
+import os
+import time
+import argparse
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from sqlalchemy import text
+from app.database.database import db_service, READ_YOUR_WRITES_SECONDS
+
+# Identifies which server answered; works against any two local Postgres instances
+_WHO = text("SELECT COALESCE(inet_server_addr()::text, 'local') || ':' || inet_server_port(), pg_is_in_recovery()")
+
+
+def served_by(user_id: str) -> str:
+    with db_service.read_connection(user_id) as conn:
+        server, in_recovery = conn.execute(_WHO).one()
+    return f"{server}{' (replica)' if in_recovery else ''}"
+
+
+def main(reads: int, concurrency: int):
+    if db_service is None:
+        print("❌ DRIZZLE_DATABASE_URL is not set")
+        return 1
+    if not db_service.replica_engines:
+        print("⚠️  DRIZZLE_REPLICA_URLS is not set, every read goes to the primary")
+
+    with db_service.engine.connect() as conn:
+        primary = conn.execute(_WHO).one()[0]
+    print(f"primary: {primary}\n")
+
+    users = [f"bench_user_{i}" for i in range(reads)]
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        spread = Counter(pool.map(served_by, users))
+    print(f"📊 {reads} reads, {concurrency} concurrent:")
+    for server, count in spread.most_common():
+        print(f"  {server:<32} {count}")
+
+    db_service.mark_write("bench_writer")
+    sticky = served_by("bench_writer")
+    print(f"\nread right after a write: {sticky}")
+    if READ_YOUR_WRITES_SECONDS > 0:
+        time.sleep(READ_YOUR_WRITES_SECONDS)
+        print(f"read {READ_YOUR_WRITES_SECONDS:.0f}s later:    {served_by('bench_writer')}")
+
+    print(f"\n{db_service.get_routing_stats()}")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show how reads are spread over primary and replicas")
+    parser.add_argument("--reads", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    sys.exit(main(args.reads, args.concurrency))
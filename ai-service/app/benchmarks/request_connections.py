@@ -0,0 +1,61 @@
+import sys
+import os
+import time
+import asyncio
+import argparse
+from contextlib import nullcontext
+from typing import Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from app.database.database import db_service
+from app.database.unit_of_work import run_in_executor
+from app.services.data_version import UserDataVersions
+from app.agents.sql_agent import get_sql_agent
+
+# Keyword-routed questions: the canned templates run without LLM-generated SQL
+QUESTIONS = [
+    "Chi tiêu theo danh mục tháng này",
+    "Tổng quan tài chính tháng này",
+    "So sánh thu chi 3 tháng gần đây và chi tiêu theo danh mục",
+]
+
+
+def pool_checkouts() -> int:
+    return sum(shard.get_stats(db_service._mask_url)["pool_checkouts"] for shard in db_service.shards.values())
+
+
+async def one_request(user_id: str, question: str, scoped: bool) -> Tuple[int, float]:
+    """The database part of /analyze/optimized: data version check, then the SQL analysis"""
+    before = pool_checkouts()
+    started = time.perf_counter()
+    async with (db_service.unit_of_work(user_id) if scoped else nullcontext()):
+        await run_in_executor(UserDataVersions(db_service).get, user_id)
+        await get_sql_agent().execute_financial_query(user_id, question)
+    return pool_checkouts() - before, (time.perf_counter() - started) * 1000
+
+
+async def main(user_id: str, rounds: int):
+    if db_service is None:
+        print("❌ DRIZZLE_DATABASE_URL is not set")
+        return 1
+
+    print(f"🔌 Pool checkouts and latency per request (each checkout costs a pre-ping round trip), user {user_id}\n")
+    for question in QUESTIONS:
+        per_query = [await one_request(user_id, question, scoped=False) for _ in range(rounds)]
+        scoped = [await one_request(user_id, question, scoped=True) for _ in range(rounds)]
+        print(f"{question}")
+        for label, runs in (("per query   ", per_query), ("unit of work", scoped)):
+            checkouts = sum(r[0] for r in runs) / rounds
+            print(f"  {label} {checkouts:5.1f} checkouts {sum(r[1] for r in runs) / rounds:8.1f} ms")
+        print()
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Connection checkouts and latency per request with and without the unit of work")
+    parser.add_argument("user_id")
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    sys.exit(asyncio.run(main(args.user_id, args.rounds)))
@@ -0,0 +1,59 @@
+import asyncio
+from typing import Dict, Any
+
+from app.workflows.financial_analysis import FinancialWorkflow
+
+
+def initial_state(user_id: str, question: str) -> Dict[str, Any]:
+    """Same initial state analyze_financial builds"""
+    return {
+        "user_id": user_id,
+        "user_question": question,
+        "system_prompt": "",
+        "user_context": {},
+        "context_loaded": False,
+        "sql_analysis": {},
+        "similar_patterns": [],
+        "relevant_history": [],
+        "response_chunks": [],
+        "final_response": "",
+        "tokens_used": 0,
+        "cache_hits": 0,
+        "node_timings": {},
+        "error_message": None
+    }
+
+
+def build_synthetic_workflow(
+    context_s: float = 0.0,
+    sql_s: float = 0.0,
+    response_s: float = 0.0,
+    checkpointer=None,
+    payload_bytes: int = 0
+) -> FinancialWorkflow:
+    """Real graph topology with fixed-latency nodes (no DB, LLM or embeddings)"""
+    workflow = FinancialWorkflow.__new__(FinancialWorkflow)
+    markdown = "x" * payload_bytes
+
+    async def load_context(state):
+        await asyncio.sleep(context_s)
+        return {"user_context": {}, "system_prompt": "", "context_loaded": True}
+
+    async def retrieve_history(state):
+        return {"relevant_history": []}
+
+    async def sql_analysis(state):
+        await asyncio.sleep(sql_s)
+        return {"sql_analysis": {"success": True, "data": {"markdown_response": markdown}}}
+
+    async def generate_response(state):
+        await asyncio.sleep(response_s)
+        return {"final_response": markdown, "response_chunks": [markdown]}
+
+    workflow._load_context_cached = load_context
+    workflow._retrieve_history = retrieve_history
+    workflow._sql_analysis = sql_analysis
+    workflow._generate_response_streaming = generate_response
+    workflow.checkpointer = checkpointer
+    workflow.app = workflow._create_workflow().compile(checkpointer=checkpointer)
+    return workflow
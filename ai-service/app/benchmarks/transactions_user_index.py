@@ -0,0 +1,132 @@
+import sys
+import os
+import json
+import argparse
+import statistics
+from datetime import date
+from typing import Dict, Any, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from sqlalchemy import text
+from app.database.database import db_service
+from app.agents.sql_agent import FinancialSQLAgent
+
+# Templates as they were before transactions.user_id: accounts join and CAST(amount)
+LEGACY_QUERIES = {
+    "spending_analysis": """
+        SELECT
+            COALESCE(c.name, 'Uncategorized') as category_name,
+            COUNT(*) as transaction_count,
+            SUM(ABS(CAST(t.amount AS DECIMAL))) as total_amount,
+            ROUND(
+                SUM(ABS(CAST(t.amount AS DECIMAL))) * 100.0 /
+                NULLIF((
+                    SELECT SUM(ABS(CAST(amount AS DECIMAL)))
+                    FROM transactions t2
+                    JOIN accounts a2 ON t2.account_id = a2.id
+                    WHERE a2.user_id = :user_id
+                    AND CAST(t2.amount AS DECIMAL) < 0
+                    AND t2.date >= :start_date AND t2.date < :end_date
+                ), 0), 2
+            ) as percentage,
+            AVG(ABS(CAST(t.amount AS DECIMAL))) as avg_amount
+        FROM transactions t
+        JOIN accounts a ON t.account_id = a.id
+        LEFT JOIN categories c ON t.category_id = c.id
+        WHERE a.user_id = :user_id
+            AND CAST(t.amount AS DECIMAL) < 0
+            AND t.date >= :start_date AND t.date < :end_date
+        GROUP BY c.name
+        ORDER BY total_amount DESC
+        LIMIT 15
+    """,
+    "financial_summary": """
+        SELECT
+            COUNT(*) as total_transactions,
+            SUM(CASE WHEN CAST(amount AS DECIMAL) > 0 THEN CAST(amount AS DECIMAL) ELSE 0 END) as total_income,
+            SUM(CASE WHEN CAST(amount AS DECIMAL) < 0 THEN ABS(CAST(amount AS DECIMAL)) ELSE 0 END) as total_expenses,
+            SUM(CAST(amount AS DECIMAL)) as net_amount
+        FROM transactions t
+        JOIN accounts a ON t.account_id = a.id
+        WHERE a.user_id = :user_id
+            AND t.date >= :start_date AND t.date < :end_date
+    """,
+    "comparison_analysis": """
+        SELECT
+            DATE_TRUNC('month', t.date) as month,
+            SUM(CASE WHEN CAST(amount AS DECIMAL) > 0 THEN CAST(amount AS DECIMAL) ELSE 0 END) as monthly_income,
+            SUM(CASE WHEN CAST(amount AS DECIMAL) < 0 THEN ABS(CAST(amount AS DECIMAL)) ELSE 0 END) as monthly_expenses,
+            COUNT(*) as monthly_transactions
+        FROM transactions t
+        JOIN accounts a ON t.account_id = a.id
+        WHERE a.user_id = :user_id
+            AND t.date >= :start_date AND t.date < :end_date
+        GROUP BY DATE_TRUNC('month', t.date)
+        ORDER BY month DESC
+    """,
+}
+
+CURRENT_QUERIES = {
+    "spending_analysis": FinancialSQLAgent._get_spending_analysis_query,
+    "financial_summary": FinancialSQLAgent._get_financial_summary_query,
+    "comparison_analysis": FinancialSQLAgent._get_comparison_query,
+}
+
+
+def explain_analyze(conn, sql: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """Execution time, top plan node and buffer hits of one EXPLAIN ANALYZE run"""
+    row = conn.execute(text(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql.strip().rstrip(';')}"), params).scalar()
+    plan = (json.loads(row) if isinstance(row, str) else row)[0]
+    return {
+        "ms": plan["Execution Time"],
+        "node": plan["Plan"]["Node Type"],
+        "buffers": plan["Plan"].get("Shared Hit Blocks", 0) + plan["Plan"].get("Shared Read Blocks", 0),
+        "scans": sorted(_scan_nodes(plan["Plan"]))
+    }
+
+
+def _scan_nodes(plan: Dict[str, Any]) -> List[str]:
+    scans = []
+    if "Scan" in plan["Node Type"]:
+        scans.append(f"{plan['Node Type']} on {plan.get('Index Name') or plan.get('Relation Name')}")
+    for child in plan.get("Plans", []):
+        scans.extend(_scan_nodes(child))
+    return scans
+
+
+def measure(sql: str, params: Dict[str, Any], runs: int) -> Dict[str, Any]:
+    with db_service.engine_for(params["user_id"]).connect() as conn:
+        explain_analyze(conn, sql, params)  # warm the cache
+        results = [explain_analyze(conn, sql, params) for _ in range(runs)]
+    return {**results[-1], "ms": statistics.median(r["ms"] for r in results)}
+
+
+def main(user_id: str, start: date, end: date, runs: int):
+    if db_service is None:
+        print("❌ DRIZZLE_DATABASE_URL is not set; EXPLAIN timings need a live database")
+        return 1
+
+    params = {"user_id": user_id, "start_date": start, "end_date": end}
+    print(f"⏱️  EXPLAIN ANALYZE, median of {runs} runs, user {user_id}, {start} → {end}\n")
+
+    for name, legacy_sql in LEGACY_QUERIES.items():
+        before = measure(legacy_sql, params, runs)
+        after = measure(CURRENT_QUERIES[name](None), params, runs)
+        speedup = before["ms"] / after["ms"] if after["ms"] else float("inf")
+        print(f"{name}")
+        print(f"  before {before['ms']:8.2f} ms  {before['buffers']:6} buffers  {', '.join(before['scans'])}")
+        print(f"  after  {after['ms']:8.2f} ms  {after['buffers']:6} buffers  {', '.join(after['scans'])}")
+        print(f"  speedup {speedup:.1f}x\n")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Analytic templates before/after transactions.user_id")
+    parser.add_argument("user_id")
+    parser.add_argument("--start", type=date.fromisoformat, default=date(date.today().year - 1, date.today().month, 1))
+    parser.add_argument("--end", type=date.fromisoformat, default=date.today())
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    sys.exit(main(args.user_id, args.start, args.end, args.runs))
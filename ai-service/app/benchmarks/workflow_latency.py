@@ -0,0 +1,71 @@
+import sys
+import os
+import time
+import asyncio
+import argparse
+import statistics
+from typing import Dict, Any, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from app.workflows.financial_analysis import analyze_financial
+from app.benchmarks.synthetic_workflow import build_synthetic_workflow, initial_state
+
+
+def summarize(runs: List[Dict[str, Any]]):
+    """Print mean per-node timings, measured critical path and the serial equivalent"""
+    nodes = sorted({name for run in runs for name in run["node_timings"]})
+    for name in nodes:
+        values = [run["node_timings"].get(name, 0.0) for run in runs]
+        print(f"  {name:<24} {statistics.mean(values):8.1f} ms")
+
+    serial = [sum(run["node_timings"].values()) for run in runs]
+    measured = [run["total_ms"] for run in runs]
+    print(f"\n  serial chain (sum)       {statistics.mean(serial):8.1f} ms")
+    print(f"  measured critical path   {statistics.mean(measured):8.1f} ms")
+    saved = statistics.mean(serial) - statistics.mean(measured)
+    print(f"  saved per request        {saved:8.1f} ms ({saved / statistics.mean(serial):.0%})")
+
+
+async def run_synthetic(runs: int, context_s: float, sql_s: float, response_s: float):
+    workflow = build_synthetic_workflow(context_s, sql_s, response_s)
+    results = []
+    for i in range(runs):
+        started = time.perf_counter()
+        state = await workflow.app.ainvoke(initial_state("bench_user", f"question {i}"))
+        results.append({
+            "node_timings": state["node_timings"],
+            "total_ms": (time.perf_counter() - started) * 1000
+        })
+    print(f"⏱️  Synthetic workflow ({runs} runs)")
+    summarize(results)
+
+
+async def run_live(runs: int, user_id: str, question: str):
+    results = []
+    for _ in range(runs):
+        result = await analyze_financial(user_id, question)
+        stats = result.get("optimization_stats", {})
+        results.append({
+            "node_timings": stats.get("node_timings_ms", {}),
+            "total_ms": stats.get("total_ms", 0.0)
+        })
+    print(f"⏱️  Live workflow ({runs} runs) for {user_id}")
+    summarize(results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="FinancialWorkflow critical-path latency")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--live", nargs=2, metavar=("USER_ID", "QUESTION"))
+    parser.add_argument("--context-ms", type=float, default=150)
+    parser.add_argument("--sql-ms", type=float, default=400)
+    parser.add_argument("--response-ms", type=float, default=800)
+    args = parser.parse_args()
+
+    if args.live:
+        asyncio.run(run_live(args.runs, *args.live))
+    else:
+        asyncio.run(run_synthetic(
+            args.runs, args.context_ms / 1000, args.sql_ms / 1000, args.response_ms / 1000
+        ))
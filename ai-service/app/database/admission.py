@@ -0,0 +1,153 @@
+import os
+import time
+import bisect
+import threading
+import logging
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Canned templates and LLM-generated SQL queue separately so expensive queries never starve cheap ones
+LANE_CANNED = "canned"
+LANE_CUSTOM = "custom"
+
+# Precomputation ahead of user requests; small so it never takes connections live traffic needs
+LANE_BACKGROUND = "background"
+
+# Concurrent queries per lane and shard; together they stay below pool_size + max_overflow
+LANE_SLOTS = {
+    LANE_CANNED: int(os.getenv("DB_CANNED_LANE_SLOTS", "20")),
+    LANE_CUSTOM: int(os.getenv("DB_CUSTOM_LANE_SLOTS", "6")),
+    LANE_BACKGROUND: int(os.getenv("DB_BACKGROUND_LANE_SLOTS", "2")),
+}
+
+# Concurrent queries of one user per lane
+USER_SLOTS = {
+    LANE_CANNED: int(os.getenv("DB_USER_CANNED_SLOTS", "4")),
+    LANE_CUSTOM: int(os.getenv("DB_USER_CUSTOM_SLOTS", "1")),
+    LANE_BACKGROUND: 1,
+}
+
+# How long a query may wait for a slot before it is refused
+ADMISSION_WAIT_SECONDS = float(os.getenv("DB_ADMISSION_WAIT_SECONDS", "2"))
+
+# Upper bounds (ms) of the wait-time histogram buckets
+WAIT_BUCKETS_MS = [1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+
+
+class DBOverloadedError(RuntimeError):
+    """Raised when a query cannot get a database slot in time"""
+
+
+class _Histogram:
+    def __init__(self, bounds: List[float]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += value
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Cumulative counts per upper bound, Prometheus style"""
+        buckets, running = {}, 0
+        for bound, count in zip([*map(str, self.bounds), "+Inf"], self.counts):
+            running += count
+            buckets[bound] = running
+        return {"buckets": buckets, "count": running, "sum": round(self.total, 2)}
+
+
+class DBAdmissionController:
+    def __init__(self, lane_slots: Dict[str, int] = None, user_slots: Dict[str, int] = None, wait_seconds: float = None):
+        """Per-lane and per-user concurrency caps in front of the connection pools"""
+        self.lane_slots = lane_slots or dict(LANE_SLOTS)
+        self.user_slots = user_slots or dict(USER_SLOTS)
+        self.wait_seconds = ADMISSION_WAIT_SECONDS if wait_seconds is None else wait_seconds
+
+        self._cond = threading.Condition()
+        self._in_flight: Dict[tuple, int] = defaultdict(int)       # (shard, lane)
+        self._user_in_flight: Dict[tuple, int] = defaultdict(int)  # (lane, user_id)
+        self._waits = {lane: _Histogram(WAIT_BUCKETS_MS) for lane in self.lane_slots}
+        self._stats = {
+            lane: {"admitted": 0, "rejected_lane_full": 0, "rejected_user_cap": 0, "pool_timeouts": 0}
+            for lane in self.lane_slots
+        }
+
+    def _blocked_by(self, shard: str, lane: str, user_id: Optional[str]) -> Optional[str]:
+        if user_id is not None and self._user_in_flight[(lane, user_id)] >= self.user_slots[lane]:
+            return "user_cap"
+        if self._in_flight[(shard, lane)] >= self.lane_slots[lane]:
+            return "lane_full"
+        return None
+
+    @contextmanager
+    def slot(self, shard: str, lane: str, user_id: Optional[str] = None):
+        """Hold a lane slot on the shard for the duration of one query; fail fast when none frees up"""
+        lane = lane if lane in self.lane_slots else LANE_CANNED
+        started = time.monotonic()
+        deadline = started + self.wait_seconds
+
+        with self._cond:
+            while True:
+                reason = self._blocked_by(shard, lane, user_id)
+                remaining = deadline - time.monotonic()
+                if reason is None or remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            if reason is not None:
+                self._stats[lane][f"rejected_{reason}"] += 1
+                logger.warning(f"🚦 {lane} query refused for {user_id} on {shard}: {reason.replace('_', ' ')}")
+                raise DBOverloadedError(
+                    f"Database busy ({lane} lane, {reason.replace('_', ' ')}), try again shortly"
+                )
+
+            self._in_flight[(shard, lane)] += 1
+            if user_id is not None:
+                self._user_in_flight[(lane, user_id)] += 1
+            self._stats[lane]["admitted"] += 1
+            self._waits[lane].observe((time.monotonic() - started) * 1000)
+
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._in_flight[(shard, lane)] -= 1
+                if user_id is not None:
+                    self._user_in_flight[(lane, user_id)] -= 1
+                    if not self._user_in_flight[(lane, user_id)]:
+                        del self._user_in_flight[(lane, user_id)]
+                self._cond.notify_all()
+
+    def load(self, shard: str, lanes: List[str]) -> float:
+        """Share of the given lanes' slots on a shard that are in use right now"""
+        with self._cond:
+            used = sum(self._in_flight[(shard, lane)] for lane in lanes)
+            return used / max(sum(self.lane_slots[lane] for lane in lanes), 1)
+
+    def record_pool_timeout(self, lane: str):
+        with self._cond:
+            self._stats.get(lane, self._stats[LANE_CANNED])["pool_timeouts"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Admissions, rejections, in-flight counts and wait-time histograms per lane"""
+        with self._cond:
+            return {
+                "wait_seconds": self.wait_seconds,
+                "lanes": {
+                    lane: {
+                        **self._stats[lane],
+                        "slots": self.lane_slots[lane],
+                        "user_slots": self.user_slots[lane],
+                        "in_flight": {
+                            shard: count for (shard, name), count in self._in_flight.items()
+                            if name == lane and count
+                        },
+                        "wait_ms": self._waits[lane].snapshot()
+                    }
+                    for lane in self.lane_slots
+                }
+            }
@@ -1,35 +1,110 @@
-from sqlalchemy import create_engine, MetaData, text, inspect
+from sqlalchemy import create_engine, MetaData, text
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import QueuePool
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 import os
 from dotenv import load_dotenv
 from textwrap import dedent
+import asyncio
 import logging
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, AsyncIterator, Tuple
 import pandas as pd
 import re
 
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from app.database.schema_snapshot import SchemaSnapshot
+from app.database.admission import DBAdmissionController, DBOverloadedError, LANE_CANNED
+from app.database.unit_of_work import UnitOfWork, current_unit_of_work, run_in_executor, REQUEST_SCOPED_CONNECTION
+from app.database.sharding import (
+    ShardRing, ShardPool, parse_shard_map, DEFAULT_SHARD, REPLICA_SELECTION, READ_YOUR_WRITES_SECONDS
+)
+
 load_dotenv()
 
+# Pool checkout gives up after this instead of SQLAlchemy's 30 s default
+POOL_TIMEOUT_SECONDS = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "3"))
+
 logger = logging.getLogger(__name__)
 
+# Users per set-based summary query and summary queries in flight at once
+SUMMARY_CHUNK_SIZE = int(os.getenv("DB_SUMMARY_CHUNK_SIZE", "500"))
+SUMMARY_CONCURRENCY = int(os.getenv("DB_SUMMARY_CONCURRENCY", "2"))
+
+FINANCIAL_SUMMARIES_QUERY = """
+WITH recent_transactions AS (
+    SELECT t.user_id, t.amount, t.category_id FROM transactions t
+    WHERE t.user_id = ANY(:user_ids)
+    AND t.date >= CURRENT_DATE - make_interval(days => :period_days)
+),
+summary_stats AS (
+    SELECT
+        user_id,
+        COUNT(*) as total_transactions,
+        SUM(CASE WHEN amount > 0 THEN amount ELSE 0 END) as total_income,
+        SUM(CASE WHEN amount < 0 THEN ABS(amount) ELSE 0 END) as total_expenses,
+        SUM(amount) as net_amount,
+        AVG(CASE WHEN amount < 0 THEN ABS(amount) END) as avg_expense
+    FROM recent_transactions
+    GROUP BY user_id
+),
+category_breakdown AS (
+    SELECT
+        t.user_id,
+        COALESCE(c.name, 'Uncategorized') as category_name,
+        COUNT(*) as transaction_count,
+        SUM(ABS(t.amount)) as total_amount,
+        ROW_NUMBER() OVER (PARTITION BY t.user_id ORDER BY SUM(ABS(t.amount)) DESC) as rank
+    FROM recent_transactions t
+    LEFT JOIN categories c ON t.category_id = c.id
+    WHERE t.amount < 0
+    GROUP BY t.user_id, c.name
+)
+SELECT
+    s.user_id,
+    s.total_transactions,
+    s.total_income,
+    s.total_expenses,
+    s.net_amount,
+    s.avg_expense,
+    COALESCE(
+        json_agg(
+            json_build_object(
+                'category', cb.category_name,
+                'amount', cb.total_amount,
+                'count', cb.transaction_count
+            ) ORDER BY cb.rank
+        ) FILTER (WHERE cb.category_name IS NOT NULL),
+        '[]'::json
+    ) as top_categories
+FROM summary_stats s
+LEFT JOIN category_breakdown cb ON cb.user_id = s.user_id AND cb.rank <= 10
+GROUP BY s.user_id, s.total_transactions, s.total_income, s.total_expenses, s.net_amount, s.avg_expense
+"""
+
+EMPTY_FINANCIAL_SUMMARY = {
+    "total_transactions": 0,
+    "total_income": 0,
+    "total_expenses": 0,
+    "net_amount": 0,
+    "avg_expense": 0,
+    "top_categories": []
+}
+
 class DatabaseService:
     def __init__(self):
         self.database_url = self._get_database_url()
         
-        self.engine = create_engine(
-            self.database_url,
-            poolclass=QueuePool,  # Changed from StaticPool for better performance
-            pool_size=10,
-            max_overflow=20,
-            pool_pre_ping=True,
-            pool_recycle=3600,  # 1 hour
-            echo=False,
-            connect_args={
-                "connect_timeout": 10,
-                "application_name": "ai_financial_service"
-            }
-        )
+        # One primary pool per shard, each with its own replica pools for analytic reads
+        self.shards = self._create_shards()
+        self.ring = ShardRing(list(self.shards))
+        self.engine = self.shards[DEFAULT_SHARD].engine
+        if len(self.shards) > 1:
+            logger.info(f"✅ Sharding users across {len(self.shards)} databases: {', '.join(self.shards)}")
+
+        # Per-user and per-lane caps so one user's burst cannot drain a pool
+        self.admission = DBAdmissionController()
 
         self.SessionLocal = sessionmaker(
             autocommit=False, 
@@ -38,8 +113,12 @@ class DatabaseService:
         )
         self.metadata = MetaData()
 
-        # Load schema info with error handling
-        self._schema_info = self._load_schema_info()
+        # Two bulk catalog queries on a schema change, one fingerprint read otherwise
+        self.schema = SchemaSnapshot(
+            self.engine, self.database_url, self._build_schema_description,
+            shard_engines={name: shard.engine for name, shard in self.shards.items() if name != DEFAULT_SHARD}
+        )
+        self.schema.refresh()
 
     def _get_database_url(self) -> str:
         """Get and fix database URL for SQLAlchemy compatibility"""
@@ -55,6 +134,65 @@ class DatabaseService:
         logger.info(f"Database URL: {self._mask_url(url)}")
         return url
     
+    def _normalize_url(self, url: str) -> str:
+        if url.startswith("postgres://"):
+            url = url.replace("postgres://", "postgresql://", 1)
+        return url
+
+    def _create_shards(self) -> "OrderedDict[str, ShardPool]":
+        """Default shard from DRIZZLE_DATABASE_URL/DRIZZLE_REPLICA_URLS plus any DB_SHARDS entries"""
+        shard_map = OrderedDict([(DEFAULT_SHARD, [
+            self.database_url,
+            *[url.strip() for url in os.getenv("DRIZZLE_REPLICA_URLS", "").split(",") if url.strip()]
+        ])])
+        for name, urls in parse_shard_map(os.getenv("DB_SHARDS", "")).items():
+            if name in shard_map:
+                raise ValueError(f"Shard '{name}' is configured twice")
+            shard_map[name] = urls
+
+        shards: "OrderedDict[str, ShardPool]" = OrderedDict()
+        for name, urls in shard_map.items():
+            primary_url, *replica_urls = [self._normalize_url(url) for url in urls]
+            for url in replica_urls:
+                logger.info(f"Replica URL ({name}): {self._mask_url(url)}")
+            shards[name] = ShardPool(
+                name,
+                self._create_engine(
+                    primary_url,
+                    pool_size=int(os.getenv("DB_POOL_SIZE", "10")),
+                    max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "20")),
+                    application_name="ai_financial_service"
+                ),
+                # Analytic reads get their own pools so they never queue behind primary writes
+                [
+                    self._create_engine(
+                        url,
+                        pool_size=int(os.getenv("DB_REPLICA_POOL_SIZE", "10")),
+                        max_overflow=int(os.getenv("DB_REPLICA_MAX_OVERFLOW", "20")),
+                        application_name="ai_financial_service_reader"
+                    )
+                    for url in replica_urls
+                ],
+                replica_urls
+            )
+        return shards
+
+    def _create_engine(self, url: str, pool_size: int, max_overflow: int, application_name: str):
+        return create_engine(
+            url,
+            poolclass=QueuePool,  # Changed from StaticPool for better performance
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_timeout=POOL_TIMEOUT_SECONDS,
+            pool_pre_ping=True,
+            pool_recycle=3600,  # 1 hour
+            echo=False,
+            connect_args={
+                "connect_timeout": 10,
+                "application_name": application_name
+            }
+        )
+
     def _mask_url(self, url: str) -> str:
         """Mask sensitive information in URL for logging"""
         return re.sub(r'://([^:]+):([^@]+)@', r'://\1:***@', url)
@@ -82,197 +220,247 @@ class DatabaseService:
             logger.error(f"❌ Database connection failed: {e}")
             return False
 
-    def _load_schema_info(self) -> Dict[str, Any]:
-        """Load database schema information for AI agent"""
+    @property
+    def _schema_info(self) -> Dict[str, Any]:
+        return self.schema.info
+
+    @property
+    def replica_engines(self) -> List:
+        return self.shards[DEFAULT_SHARD].replica_engines
+
+    def shard_for(self, user_id: Optional[str]) -> ShardPool:
+        """Shard owning this user; the default shard when there is no user"""
+        if user_id is None or len(self.shards) == 1:
+            return self.shards[DEFAULT_SHARD]
+        return self.shards[self.ring.shard_for(user_id)]
+
+    def engine_for(self, user_id: Optional[str]):
+        """Primary engine of the user's shard, for writes and read-after-write checks"""
+        return self.shard_for(user_id).engine
+
+    def mark_write(self, user_id: str):
+        """Remember a write so this user's reads stay on the primary until replicas catch up"""
+        self.shard_for(user_id).mark_write(user_id)
+
+    def _scoped(self, user_id: Optional[str]) -> Optional[UnitOfWork]:
+        unit = current_unit_of_work.get()
+        return unit if unit is not None and user_id is not None and unit.user_id == user_id else None
+
+    def read_connection(self, user_id: Optional[str] = None):
+        """Connection for a read-only query on the user's shard, from a replica when possible"""
+        unit = self._scoped(user_id)
+        if unit is not None:
+            return unit.connection()
+        return self.shard_for(user_id).read_connection(user_id)
+
+    def user_connection(self, user_id: str):
+        """Connection for a freshness check: the request's shared snapshot if one is open, else the primary"""
+        unit = self._scoped(user_id)
+        if unit is not None:
+            return unit.connection()
+        return self.engine_for(user_id).connect()
+
+    @asynccontextmanager
+    async def unit_of_work(self, user_id: str):
+        """Request scope: this user's reads share one connection and snapshot until the block exits"""
+        if not REQUEST_SCOPED_CONNECTION or current_unit_of_work.get() is not None:
+            yield current_unit_of_work.get()
+            return
+
+        unit = UnitOfWork(self.shard_for(user_id), user_id)
+        token = current_unit_of_work.set(unit)
         try:
-            # Test connection first
-            if not self.test_connection():
-                logger.warning("Cannot load schema info - database connection failed")
-                return {"tables": {}, "relationships": [], "indexes": {}}
-
-            inspector = inspect(self.engine)
-            tables = inspector.get_table_names()
-
-            schema_info = {
-                "tables": {},
-                "relationships": [],
-                "indexes": {}
-            }
+            yield unit
+        finally:
+            current_unit_of_work.reset(token)
+            await run_in_executor(unit.close)
 
-            for table_name in tables:
-                try:
-                    columns = inspector.get_columns(table_name)
-                    foreign_keys = inspector.get_foreign_keys(table_name)
-                    indexes = inspector.get_indexes(table_name)
-
-                    schema_info["tables"][table_name] = {
-                        "columns": [
-                            {
-                                "name": col["name"],
-                                "type": str(col["type"]),
-                                "nullable": col["nullable"],
-                                "primary_key": col.get("primary_key", False)
-                            }
-                            for col in columns
-                        ],
-                        "foreign_keys": foreign_keys
-                    }
-
-                    schema_info["indexes"][table_name] = indexes
-
-                    # Build relationships
-                    for fk in foreign_keys:
-                        if fk.get("constrained_columns") and fk.get("referred_columns"):
-                            schema_info["relationships"].append({
-                                "from_table": table_name,
-                                "from_column": fk["constrained_columns"][0],
-                                "to_table": fk["referred_table"],
-                                "to_column": fk["referred_columns"][0]
-                            })
-
-                except Exception as e:
-                    logger.warning(f"Error loading info for table {table_name}: {e}")
-                    continue
-
-            logger.info(f"✅ Loaded schema info for {len(schema_info['tables'])} tables")
-            return schema_info
+    def get_routing_stats(self) -> Dict[str, Any]:
+        """Read routing counters and per-pool checked-out connections, per shard"""
+        return {
+            "selection": REPLICA_SELECTION,
+            "read_your_writes_seconds": READ_YOUR_WRITES_SECONDS,
+            "shards": {name: shard.get_stats(self._mask_url) for name, shard in self.shards.items()}
+        }
 
-        except Exception as e:
-            logger.error(f"Error loading schema info: {e}")
-            return {"tables": {}, "relationships": [], "indexes": {}}
+    def get_admission_stats(self) -> Dict[str, Any]:
+        """Lane admissions and waits plus how saturated each shard's pools are"""
+        return {
+            **self.admission.get_stats(),
+            "pool_timeout_seconds": POOL_TIMEOUT_SECONDS,
+            "pools": {name: shard.get_pool_stats() for name, shard in self.shards.items()}
+        }
 
-    def execute_query(self, query: str, params: Dict = None) -> pd.DataFrame:
-        """Execute SQL query and return results as DataFrame"""
+    def execute_query(
+        self,
+        query: str,
+        params: Dict = None,
+        timeout_ms: Optional[int] = None,
+        read_only: bool = False,
+        user_id: Optional[str] = None,
+        lane: str = LANE_CANNED,
+        shard_name: Optional[str] = None
+    ) -> pd.DataFrame:
+        """Execute SQL query on the shard of user_id (or params["user_id"]); read_only queries may use a replica"""
+        user_id = user_id or (params or {}).get("user_id")
+        # Multi-user queries name their shard explicitly
+        shard = self.shards[shard_name] if shard_name else self.shard_for(user_id)
+        unit = self._scoped(user_id) if read_only else None
+        scoped = unit is not None
+        if scoped:
+            shared = unit.lookup(query, params)
+            if shared is not None:
+                return shared.copy()
         try:
-            with self.engine.connect() as conn:
+            with self.admission.slot(shard.name, lane, user_id), \
+                    ((unit.connection() if scoped else shard.read_connection(user_id))
+                     if read_only else shard.engine.connect()) as conn:
+                if timeout_ms:
+                    # Transaction-local, reset when the connection returns to the pool
+                    conn.execute(
+                        text("SELECT set_config('statement_timeout', :timeout, true)"),
+                        {"timeout": str(int(timeout_ms))}
+                    )
                 result = conn.execute(text(query), params or {})
                 df = pd.DataFrame(result.fetchall(), columns=result.keys())
+                if scoped:
+                    if timeout_ms:
+                        # The shared transaction stays open for the request's later reads
+                        conn.execute(text("RESET statement_timeout"))
+                    unit.remember(query, params, df.copy())
                 logger.debug(f"Query executed successfully, returned {len(df)} rows")
                 return df
+        except DBOverloadedError:
+            raise
+        except PoolTimeoutError as e:
+            self.admission.record_pool_timeout(lane)
+            logger.warning(f"🚦 Pool checkout timed out on shard {shard.name}: {e}")
+            raise DBOverloadedError(f"Database busy (no free connection on {shard.name}), try again shortly") from e
         except Exception as e:
             logger.error(f"Query execution error: {e}")
             logger.error(f"Query: {query}")
             logger.error(f"Params: {params}")
             raise
 
-    def execute_query_safe(self, query: str, params: Dict = None) -> Optional[pd.DataFrame]:
+    def execute_query_safe(self, query: str, params: Dict = None, **kwargs) -> Optional[pd.DataFrame]:
         """Execute query with error handling, return None on failure"""
         try:
-            return self.execute_query(query, params)
+            return self.execute_query(query, params, **kwargs)
         except Exception as e:
             logger.error(f"Safe query execution failed: {e}")
             return None
 
-    def get_user_financial_summary(self, user_id: str, period_days: int = 30) -> Dict[str, Any]:
-        """Get comprehensive financial summary for user"""
-        # Fixed SQL query with proper interval syntax
-        query = """
-        WITH user_accounts AS (
-            SELECT id FROM accounts WHERE user_id = :user_id
-        ),
-        recent_transactions AS (
-            SELECT t.* FROM transactions t
-            JOIN user_accounts ua ON t.account_id = ua.id
-            WHERE t.date >= CURRENT_DATE - INTERVAL '%s days'
-        ),
-        summary_stats AS (
-            SELECT 
-                COUNT(*) as total_transactions,
-                SUM(CASE WHEN CAST(amount AS DECIMAL) > 0 THEN CAST(amount AS DECIMAL) ELSE 0 END) as total_income,
-                SUM(CASE WHEN CAST(amount AS DECIMAL) < 0 THEN ABS(CAST(amount AS DECIMAL)) ELSE 0 END) as total_expenses,
-                SUM(CAST(amount AS DECIMAL)) as net_amount,
-                AVG(CASE WHEN CAST(amount AS DECIMAL) < 0 THEN ABS(CAST(amount AS DECIMAL)) END) as avg_expense
-            FROM recent_transactions
-        ),
-        category_breakdown AS (
-            SELECT 
-                COALESCE(c.name, 'Uncategorized') as category_name,
-                COUNT(*) as transaction_count,
-                SUM(ABS(CAST(t.amount AS DECIMAL))) as total_amount
-            FROM recent_transactions t
-            LEFT JOIN categories c ON t.category_id = c.id
-            WHERE CAST(t.amount AS DECIMAL) < 0
-            GROUP BY c.name
-            ORDER BY total_amount DESC
-            LIMIT 10
+    def _summary_chunks(self, user_ids: List[str], chunk_size: int) -> List[tuple]:
+        """(shard name, user ids) chunks; a chunk never spans two shards"""
+        by_shard: "OrderedDict[str, List[str]]" = OrderedDict()
+        for user_id in dict.fromkeys(user_ids):
+            by_shard.setdefault(self.shard_for(user_id).name, []).append(user_id)
+        return [
+            (name, shard_users[i:i + chunk_size])
+            for name, shard_users in by_shard.items()
+            for i in range(0, len(shard_users), chunk_size)
+        ]
+
+    def _fetch_financial_summaries(self, user_ids: List[str], period_days: int, shard_name: str) -> Dict[str, Dict[str, Any]]:
+        """Summaries of users on one shard in a single set-based query; users without transactions get zeros"""
+        df = self.execute_query(
+            FINANCIAL_SUMMARIES_QUERY,
+            {"user_ids": list(user_ids), "period_days": period_days},
+            read_only=True,
+            user_id=user_ids[0] if len(user_ids) == 1 else None,
+            shard_name=shard_name
         )
-        SELECT 
-            s.total_transactions,
-            s.total_income,
-            s.total_expenses,
-            s.net_amount,
-            s.avg_expense,
-            COALESCE(
-                json_agg(
-                    json_build_object(
-                        'category', cb.category_name,
-                        'amount', cb.total_amount,
-                        'count', cb.transaction_count
-                    )
-                ) FILTER (WHERE cb.category_name IS NOT NULL),
-                '[]'::json
-            ) as top_categories
-        FROM summary_stats s
-        LEFT JOIN category_breakdown cb ON true
-        GROUP BY s.total_transactions, s.total_income, s.total_expenses, s.net_amount, s.avg_expense
-        """ % period_days
+        summaries = {}
+        for row in df.to_dict("records"):
+            summaries[row.pop("user_id")] = row
+        return {user_id: summaries.get(user_id, dict(EMPTY_FINANCIAL_SUMMARY, top_categories=[])) for user_id in user_ids}
 
+    def get_user_financial_summary(self, user_id: str, period_days: int = 30) -> Dict[str, Any]:
+        """Get comprehensive financial summary for user"""
         try:
-            result = self.execute_query_safe(query, {"user_id": user_id})
-            if result is not None and not result.empty:
-                return result.iloc[0].to_dict()
-            return {
-                "total_transactions": 0,
-                "total_income": 0,
-                "total_expenses": 0,
-                "net_amount": 0,
-                "avg_expense": 0,
-                "top_categories": []
-            }
+            return self._fetch_financial_summaries([user_id], period_days, self.shard_for(user_id).name)[user_id]
         except Exception as e:
             logger.error(f"Error getting financial summary: {e}")
             return {}
 
+    async def iter_financial_summaries(
+        self,
+        user_ids: List[str],
+        period_days: int = 30,
+        chunk_size: int = None,
+        concurrency: int = None
+    ) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """Yield (user_id, summary) for many users, chunk by chunk as each query completes; {} for a failed chunk"""
+        chunks = self._summary_chunks(user_ids, chunk_size or SUMMARY_CHUNK_SIZE)
+        concurrency = concurrency or SUMMARY_CONCURRENCY
+        pending: Dict[asyncio.Future, List[str]] = {}
+        try:
+            while chunks or pending:
+                while chunks and len(pending) < concurrency:
+                    shard_name, chunk = chunks.pop(0)
+                    task = asyncio.ensure_future(
+                        run_in_executor(self._fetch_financial_summaries, chunk, period_days, shard_name)
+                    )
+                    pending[task] = chunk
+
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    chunk = pending.pop(task)
+                    try:
+                        summaries = task.result()
+                    except Exception as e:
+                        logger.error(f"Financial summaries failed for {len(chunk)} users: {e}")
+                        summaries = {}
+                    for user_id in chunk:
+                        yield user_id, summaries.get(user_id, {})
+        finally:
+            # The consumer stopped early (client gone): don't leave chunks running
+            for task in pending:
+                task.cancel()
+
     def get_schema_description(self) -> str:
-        """Get detailed schema description for AI agent"""
+        """Get detailed schema description for AI agent, precomputed per schema snapshot"""
+        return self.schema.description
+
+    def _build_schema_description(self, schema_info: Dict[str, Any]) -> str:
         return dedent(f"""\
         Database Schema Information for Financial Analysis:
         
         TABLES:
-        {self._format_tables_info()}
+        {self._format_tables_info(schema_info)}
         
         RELATIONSHIPS:
-        {self._format_relationships_info()}
+        {self._format_relationships_info(schema_info)}
         
         IMPORTANT NOTES:
         - Currency: Vietnamese Dong (VND)
         - Amount convention: Positive = Income, Negative = Expense
         - All tables are filtered by user_id for data isolation
-        - Use CAST(amount AS DECIMAL) for numerical operations on amount column
+        - amount is NUMERIC(15,2): use it directly, never CAST it (casts defeat the amount index)
         - Dates are stored as timestamps, use date functions for filtering
         - Category can be NULL (uncategorized transactions)
-        - Always JOIN with accounts table to filter by user_id for security
+        - transactions.user_id mirrors the owning account's user_id; filter on it instead of joining accounts
         
         COMMON QUERY PATTERNS:
-        - Total income: SUM(CASE WHEN CAST(amount AS DECIMAL) > 0 THEN CAST(amount AS DECIMAL) ELSE 0 END)
-        - Total expenses: SUM(CASE WHEN CAST(amount AS DECIMAL) < 0 THEN ABS(CAST(amount AS DECIMAL)) ELSE 0 END)
+        - Total income: SUM(CASE WHEN amount > 0 THEN amount ELSE 0 END)
+        - Total expenses: SUM(CASE WHEN amount < 0 THEN ABS(amount) ELSE 0 END)
         - Monthly filter: WHERE date >= DATE_TRUNC('month', CURRENT_DATE)
-        - User filter: JOIN accounts a ON t.account_id = a.id WHERE a.user_id = :user_id
+        - User filter: WHERE t.user_id = :user_id
         - Period filter: WHERE date >= CURRENT_DATE - INTERVAL '30 days'
         
         SECURITY REQUIREMENTS:
-        - ALWAYS filter by user_id through accounts table
+        - ALWAYS filter transactions by t.user_id
         - Use parameterized queries to prevent SQL injection
         - Never expose data from other users
         """)
 
-    def _format_tables_info(self) -> str:
+    def _format_tables_info(self, schema_info: Dict[str, Any]) -> str:
         """Format table information for schema description"""
-        if not self._schema_info.get("tables"):
+        if not schema_info.get("tables"):
             return "No table information available"
         
         info_parts = []
-        for table_name, table_info in self._schema_info["tables"].items():
+        for table_name, table_info in schema_info["tables"].items():
             columns_info = []
             for col in table_info["columns"]:
                 col_desc = f"  - {col['name']} ({col['type']})"
@@ -286,13 +474,13 @@ class DatabaseService:
         
         return "\n\n".join(info_parts)
 
-    def _format_relationships_info(self) -> str:
+    def _format_relationships_info(self, schema_info: Dict[str, Any]) -> str:
         """Format relationship information"""
-        if not self._schema_info.get("relationships"):
+        if not schema_info.get("relationships"):
             return "No relationship information available"
         
         relationships = []
-        for rel in self._schema_info["relationships"]:
+        for rel in schema_info["relationships"]:
             relationships.append(
                 f"- {rel['from_table']}.{rel['from_column']} -> {rel['to_table']}.{rel['to_column']}"
             )
@@ -305,7 +493,8 @@ class DatabaseService:
     def close(self):
         """Close database connections"""
         try:
-            self.engine.dispose()
+            for shard in self.shards.values():
+                shard.dispose()
             logger.info("Database connections closed")
         except Exception as e:
             logger.error(f"Error closing database connections: {e}")
@@ -1,28 +1,160 @@
 from sqlalchemy import text
+from sqlalchemy.exc import ProgrammingError
 from app.database.database import db_service
+from contextlib import contextmanager
+from datetime import date, datetime
+from typing import Optional, List
 import logging
+import time
+import os
+import re
 
 logger = logging.getLogger(__name__)
 
-def create_conversation_history_table():
-    """Create conversation_history table"""
-    try:
-        create_table_sql = text("""
-            CREATE TABLE IF NOT EXISTS conversation_history (
-                id SERIAL PRIMARY KEY,
-                user_id TEXT NOT NULL,
-                question TEXT NOT NULL,
-                response TEXT NOT NULL,
-                analysis_data JSONB,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-            CREATE INDEX IF NOT EXISTS idx_conversation_user_created
-            ON conversation_history (user_id, created_at DESC);
-        """)
-
-        with db_service.engine.connect() as conn:
-            conn.execute(create_table_sql)
-            conn.commit()
+# Monthly partitions are created this many months ahead of the current month
+PARTITION_MONTHS_AHEAD = int(os.getenv("CONVERSATION_PARTITION_MONTHS_AHEAD", "2"))
+
+# Partitions whose whole range is older than this are dropped
+CONVERSATION_RETENTION_MONTHS = int(os.getenv("CONVERSATION_RETENTION_MONTHS", "12"))
+
+# Rows per transaction while backfilling transactions.user_id
+TRANSACTIONS_BACKFILL_BATCH_SIZE = int(os.getenv("TRANSACTIONS_BACKFILL_BATCH_SIZE", "5000"))
+
+# Workers that lose the migration lock wait this long for the winner, then start without it
+MIGRATION_LOCK_WAIT_SECONDS = float(os.getenv("MIGRATION_LOCK_WAIT_SECONDS", "60"))
+
+# pg advisory lock keys, arbitrary but fixed across releases
+MIGRATION_LOCK_KEY = 734_951_001
+MAINTENANCE_LOCK_KEY = 734_951_002
+
+# NOTIFY channel carrying the user id whose transactions or categories changed
+USER_DATA_CHANNEL = "user_data_changed"
+
+# Separator of the fields of an inserted transaction in a USER_DATA_CHANNEL payload
+USER_DATA_PAYLOAD_SEPARATOR = "\t"
+
+# Statements inserting more transactions than this notify each user once, without the rows
+USER_DATA_INSERT_PAYLOAD_MAX_ROWS = int(os.getenv("USER_DATA_INSERT_PAYLOAD_MAX_ROWS", "20"))
+
+_PARTITION_NAME = re.compile(r"^conversation_history_y(\d{4})m(\d{2})$")
+
+
+def _add_months(d: date, months: int) -> date:
+    index = d.year * 12 + d.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _partition_name(month_start: date) -> str:
+    return f"conversation_history_y{month_start.year}m{month_start.month:02d}"
+
+
+def _table_kind(conn, table_name: str) -> Optional[str]:
+    """'p' for partitioned, 'r' for a plain table, None if missing"""
+    return conn.execute(text("""
+        SELECT c.relkind FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE c.relname = :name AND n.nspname = current_schema()
+    """), {"name": table_name}).scalar()
+
+
+def _create_partitioned_parent(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS conversation_history (
+            id BIGSERIAL,
+            user_id TEXT NOT NULL,
+            question TEXT NOT NULL,
+            response TEXT NOT NULL,
+            analysis_data JSONB,
+            payload_hash TEXT,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at);
+        CREATE TABLE IF NOT EXISTS conversation_history_default
+        PARTITION OF conversation_history DEFAULT;
+        CREATE INDEX IF NOT EXISTS idx_conversation_user_created
+        ON conversation_history (user_id, created_at DESC);
+        CREATE INDEX IF NOT EXISTS idx_conversation_payload_hash
+        ON conversation_history (payload_hash);
+    """))
+
+
+def _create_month_partitions(conn, first_month: date, last_month: date):
+    month = first_month
+    while month <= last_month:
+        try:
+            # Savepoint: a clash with rows already in the default partition skips one month only
+            with conn.begin_nested():
+                conn.execute(text(f"""
+                    CREATE TABLE IF NOT EXISTS {_partition_name(month)}
+                    PARTITION OF conversation_history
+                    FOR VALUES FROM ('{month.isoformat()}') TO ('{_add_months(month, 1).isoformat()}')
+                """))
+        except Exception as e:
+            logger.warning(f"Could not create partition {_partition_name(month)}: {e}")
+        month = _add_months(month, 1)
+
+
+def create_conversation_payloads_table(engine=None):
+    """Create the content-addressed store for analysis_data payloads"""
+    engine = engine or db_service.engine
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS conversation_payloads (
+                    hash TEXT PRIMARY KEY,
+                    analysis_data JSONB NOT NULL,
+                    markdown BYTEA,
+                    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+                )
+            """))
+
+        logger.info("✅ conversation_payloads table created successfully")
+        return True
+    except Exception as e:
+        logger.error(f"❌ Error creating conversation_payloads table: {e}")
+        return False
+
+
+def create_conversation_history_table(engine=None):
+    """Create conversation_history as a monthly range-partitioned table"""
+    engine = engine or db_service.engine
+    try:
+        current_month = date.today().replace(day=1)
+
+        with engine.begin() as conn:
+            kind = _table_kind(conn, "conversation_history")
+
+            if kind == "p":
+                _create_month_partitions(conn, current_month, _add_months(current_month, PARTITION_MONTHS_AHEAD))
+            elif kind is None:
+                _create_partitioned_parent(conn)
+                _create_month_partitions(conn, current_month, _add_months(current_month, PARTITION_MONTHS_AHEAD))
+            else:
+                # Convert the original unpartitioned table in one transaction
+                logger.info("🔄 Converting conversation_history to a partitioned table...")
+                conn.execute(text("""
+                    ALTER TABLE conversation_history RENAME TO conversation_history_legacy;
+                    ALTER INDEX IF EXISTS idx_conversation_user_created
+                    RENAME TO idx_conversation_user_created_legacy;
+                """))
+                _create_partitioned_parent(conn)
+
+                oldest = conn.execute(text(
+                    "SELECT MIN(created_at) FROM conversation_history_legacy"
+                )).scalar()
+                first_month = (oldest.date() if oldest else current_month).replace(day=1)
+                _create_month_partitions(conn, min(first_month, current_month), _add_months(current_month, PARTITION_MONTHS_AHEAD))
+
+                conn.execute(text("""
+                    INSERT INTO conversation_history (id, user_id, question, response, analysis_data, created_at)
+                    SELECT id, user_id, question, response, analysis_data, COALESCE(created_at, CURRENT_TIMESTAMP)
+                    FROM conversation_history_legacy;
+                    SELECT setval(
+                        pg_get_serial_sequence('conversation_history', 'id'),
+                        GREATEST((SELECT MAX(id) FROM conversation_history), 1)
+                    );
+                    DROP TABLE conversation_history_legacy;
+                """))
 
         logger.info("✅ conversation_history table created successfully")
         return True
@@ -30,28 +162,538 @@ def create_conversation_history_table():
         logger.error(f"❌ Error creating conversation_history table: {e}")
         return False
 
-def run_migrations():
-    """Run all database migrations"""
+
+def create_user_topic_stats_table(engine=None):
+    """Create per-user daily topic counters, seeding them from recent history"""
+    from app.services.topic_stats import count_topic_terms, upsert_topic_stats, TOPIC_STATS_RETENTION_DAYS
+
+    engine = engine or db_service.engine
+
+    try:
+        with engine.begin() as conn:
+            existed = _table_kind(conn, "user_topic_stats") is not None
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS user_topic_stats (
+                    user_id TEXT NOT NULL,
+                    bucket_start DATE NOT NULL,
+                    term TEXT NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (user_id, bucket_start, term)
+                )
+            """))
+
+            if not existed:
+                rows = conn.execute(text("""
+                    SELECT user_id, question, created_at FROM conversation_history
+                    WHERE created_at >= CURRENT_DATE - :days
+                """), {"days": TOPIC_STATS_RETENTION_DAYS}).fetchall()
+                records = [
+                    {"user_id": user_id, "question": question, "created_at": created_at}
+                    for user_id, question, created_at in rows
+                ]
+                for i in range(0, len(records), 1000):
+                    upsert_topic_stats(conn, count_topic_terms(records[i:i + 1000]))
+                if records:
+                    logger.info(f"🔄 Seeded topic stats from {len(records)} conversations")
+
+        logger.info("✅ user_topic_stats table created successfully")
+        return True
+    except Exception as e:
+        logger.error(f"❌ Error creating user_topic_stats table: {e}")
+        return False
+
+
+def _create_transactions_user_id_triggers(conn):
+    """Keep transactions.user_id equal to the owning account's user_id"""
+    conn.execute(text("""
+        CREATE OR REPLACE FUNCTION transactions_set_user_id() RETURNS trigger AS $$
+        BEGIN
+            SELECT user_id INTO NEW.user_id FROM accounts WHERE id = NEW.account_id;
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS transactions_set_user_id ON transactions;
+        CREATE TRIGGER transactions_set_user_id
+        BEFORE INSERT OR UPDATE OF account_id, user_id ON transactions
+        FOR EACH ROW EXECUTE FUNCTION transactions_set_user_id();
+
+        CREATE OR REPLACE FUNCTION accounts_propagate_user_id() RETURNS trigger AS $$
+        BEGIN
+            UPDATE transactions SET user_id = NEW.user_id WHERE account_id = NEW.id;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS accounts_propagate_user_id ON accounts;
+        CREATE TRIGGER accounts_propagate_user_id
+        AFTER UPDATE OF user_id ON accounts
+        FOR EACH ROW WHEN (OLD.user_id IS DISTINCT FROM NEW.user_id)
+        EXECUTE FUNCTION accounts_propagate_user_id();
+    """))
+
+
+def backfill_transactions_user_id(batch_size: int = TRANSACTIONS_BACKFILL_BATCH_SIZE, engine=None) -> int:
+    """Fill transactions.user_id in short batches so writers are never blocked for long"""
+    engine = engine or db_service.engine
+    filled = 0
+    # Walk the primary key in keyset ranges: each batch is one index range read instead of a
+    # rescan for "user_id IS NULL" rows; rows inserted meanwhile are filled by the trigger
+    after = ""
+    while True:
+        with engine.begin() as conn:
+            ids = conn.execute(text("""
+                SELECT id FROM transactions
+                WHERE id > :after
+                ORDER BY id
+                LIMIT :batch_size
+            """), {"after": after, "batch_size": batch_size}).scalars().all()
+            if not ids:
+                break
+            result = conn.execute(text("""
+                UPDATE transactions t SET user_id = a.user_id
+                FROM accounts a
+                WHERE a.id = t.account_id
+                AND t.id >= :first AND t.id <= :last
+                AND t.user_id IS NULL
+            """), {"first": ids[0], "last": ids[-1]})
+        filled += result.rowcount
+        after = ids[-1]
+
+    if filled:
+        logger.info(f"🔄 Backfilled user_id on {filled} transactions")
+    return filled
+
+
+def _create_index_concurrently(name: str, definition: str, engine=None):
+    """CREATE INDEX CONCURRENTLY, rebuilding an invalid leftover from an interrupted run"""
+    engine = engine or db_service.engine
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        valid = conn.execute(text("""
+            SELECT i.indisvalid FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE c.relname = :name AND n.nspname = current_schema()
+        """), {"name": name}).scalar()
+        if valid is False:
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+        conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} {definition}"))
+
+
+def add_transactions_user_id(engine=None):
+    """Denormalise accounts.user_id onto transactions with a covering (user_id, date) index"""
+    engine = engine or db_service.engine
     try:
-        logger.info("🔄 Running database migrations...")
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE transactions ADD COLUMN IF NOT EXISTS user_id TEXT"))
+            # Triggers first so rows written during the backfill are already maintained
+            _create_transactions_user_id_triggers(conn)
 
-        # Test connection first
-        if not db_service.test_connection():
-            logger.error("❌ Database connection failed, skipping migrations")
-            return False
+        backfill_transactions_user_id(engine=engine)
+        _create_index_concurrently(
+            "transactions_user_date_idx",
+            "ON transactions (user_id, date DESC) INCLUDE (amount, category_id)",
+            engine
+        )
+
+        logger.info("✅ transactions.user_id added successfully")
+        return True
+    except Exception as e:
+        logger.error(f"❌ Error adding transactions.user_id: {e}")
+        return False
+
+
+def create_user_data_notify_triggers(engine=None):
+    """NOTIFY USER_DATA_CHANNEL with the user id whenever a user's transactions or categories change"""
+    engine = engine or db_service.engine
+    try:
+        with engine.begin() as conn:
+            # Row-level, but Postgres folds identical payloads within a transaction into one notification
+            conn.execute(text(f"""
+                CREATE OR REPLACE FUNCTION notify_user_data_changed() RETURNS trigger AS $$
+                BEGIN
+                    IF TG_OP <> 'DELETE' AND NEW.user_id IS NOT NULL THEN
+                        PERFORM pg_notify('{USER_DATA_CHANNEL}', NEW.user_id::text);
+                    END IF;
+                    IF TG_OP = 'DELETE' OR (TG_OP = 'UPDATE' AND OLD.user_id IS DISTINCT FROM NEW.user_id) THEN
+                        IF OLD.user_id IS NOT NULL THEN
+                            PERFORM pg_notify('{USER_DATA_CHANNEL}', OLD.user_id::text);
+                        END IF;
+                    END IF;
+                    RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql;
+
+                DROP TRIGGER IF EXISTS transactions_notify_user_data ON transactions;
+                CREATE TRIGGER transactions_notify_user_data
+                AFTER INSERT OR UPDATE OR DELETE ON transactions
+                FOR EACH ROW EXECUTE FUNCTION notify_user_data_changed();
+
+                DROP TRIGGER IF EXISTS categories_notify_user_data ON categories;
+                CREATE TRIGGER categories_notify_user_data
+                AFTER INSERT OR UPDATE OR DELETE ON categories
+                FOR EACH ROW EXECUTE FUNCTION notify_user_data_changed();
+            """))
+
+        logger.info("✅ User data change notifications created successfully")
+        return True
+    except Exception as e:
+        logger.error(f"❌ Error creating user data notify triggers: {e}")
+        return False
+
+
+def add_transaction_insert_payloads(engine=None):
+    """Send the inserted row (user, id, day, amount, category) instead of just the user id on transaction INSERT"""
+    engine = engine or db_service.engine
+    sep = USER_DATA_PAYLOAD_SEPARATOR
+    try:
+        with engine.begin() as conn:
+            # The row id keeps two identical purchases in one transaction from being folded into one payload
+            conn.execute(text(f"""
+                CREATE OR REPLACE FUNCTION notify_user_data_changed() RETURNS trigger AS $$
+                BEGIN
+                    IF TG_TABLE_NAME = 'transactions' AND TG_OP = 'INSERT' AND NEW.user_id IS NOT NULL THEN
+                        PERFORM pg_notify('{USER_DATA_CHANNEL}', concat_ws(E'{sep}',
+                            NEW.user_id::text, NEW.id::text, NEW.date::date::text,
+                            NEW.amount::text, COALESCE(NEW.category_id::text, '')));
+                        RETURN NULL;
+                    END IF;
+                    IF TG_OP <> 'DELETE' AND NEW.user_id IS NOT NULL THEN
+                        PERFORM pg_notify('{USER_DATA_CHANNEL}', NEW.user_id::text);
+                    END IF;
+                    IF TG_OP = 'DELETE' OR (TG_OP = 'UPDATE' AND OLD.user_id IS DISTINCT FROM NEW.user_id) THEN
+                        IF OLD.user_id IS NOT NULL THEN
+                            PERFORM pg_notify('{USER_DATA_CHANNEL}', OLD.user_id::text);
+                        END IF;
+                    END IF;
+                    RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql;
+            """))
 
-        # Create tables
-        success = create_conversation_history_table()
+        logger.info("✅ Transaction insert payloads enabled successfully")
+        return True
+    except Exception as e:
+        logger.error(f"❌ Error enabling transaction insert payloads: {e}")
+        return False
+
+
+def notify_transactions_per_statement(engine=None):
+    """Replace the row-level transactions NOTIFY trigger with statement-level ones over transition tables"""
+    engine = engine or db_service.engine
+    sep = USER_DATA_PAYLOAD_SEPARATOR
+    try:
+        with engine.begin() as conn:
+            # Row payloads are unique, so Postgres cannot fold them: a bulk import would send one
+            # notification per row, each evicting caches and pinning reads to the primary
+            conn.execute(text(f"""
+                CREATE OR REPLACE FUNCTION notify_transactions_inserted() RETURNS trigger AS $$
+                BEGIN
+                    IF (SELECT COUNT(*) FROM (SELECT 1 FROM inserted_rows LIMIT {USER_DATA_INSERT_PAYLOAD_MAX_ROWS + 1}) s)
+                            <= {USER_DATA_INSERT_PAYLOAD_MAX_ROWS} THEN
+                        PERFORM pg_notify('{USER_DATA_CHANNEL}', concat_ws(E'{sep}',
+                            r.user_id::text, r.id::text, r.date::date::text,
+                            r.amount::text, COALESCE(r.category_id::text, '')))
+                        FROM inserted_rows r
+                        WHERE r.user_id IS NOT NULL;
+                    ELSE
+                        PERFORM pg_notify('{USER_DATA_CHANNEL}', u.user_id::text)
+                        FROM (SELECT DISTINCT user_id FROM inserted_rows WHERE user_id IS NOT NULL) u;
+                    END IF;
+                    RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql;
+
+                CREATE OR REPLACE FUNCTION notify_transactions_changed() RETURNS trigger AS $$
+                BEGIN
+                    IF TG_OP = 'UPDATE' THEN
+                        PERFORM pg_notify('{USER_DATA_CHANNEL}', u.user_id::text)
+                        FROM (SELECT user_id FROM old_rows UNION SELECT user_id FROM new_rows) u
+                        WHERE u.user_id IS NOT NULL;
+                    ELSE
+                        PERFORM pg_notify('{USER_DATA_CHANNEL}', u.user_id::text)
+                        FROM (SELECT DISTINCT user_id FROM old_rows WHERE user_id IS NOT NULL) u;
+                    END IF;
+                    RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql;
+
+                DROP TRIGGER IF EXISTS transactions_notify_user_data ON transactions;
+
+                -- A trigger with transition tables fires on a single event
+                DROP TRIGGER IF EXISTS transactions_notify_inserted ON transactions;
+                CREATE TRIGGER transactions_notify_inserted
+                AFTER INSERT ON transactions
+                REFERENCING NEW TABLE AS inserted_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION notify_transactions_inserted();
+
+                DROP TRIGGER IF EXISTS transactions_notify_updated ON transactions;
+                CREATE TRIGGER transactions_notify_updated
+                AFTER UPDATE ON transactions
+                REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION notify_transactions_changed();
+
+                DROP TRIGGER IF EXISTS transactions_notify_deleted ON transactions;
+                CREATE TRIGGER transactions_notify_deleted
+                AFTER DELETE ON transactions
+                REFERENCING OLD TABLE AS old_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION notify_transactions_changed();
+            """))
+
+        logger.info("✅ Statement-level transaction notifications created successfully")
+        return True
+    except Exception as e:
+        logger.error(f"❌ Error creating statement-level transaction notifications: {e}")
+        return False
+
+
+def ensure_conversation_partitions(months_ahead: int = PARTITION_MONTHS_AHEAD, engine=None) -> bool:
+    """Create partitions for the current month and the next few"""
+    engine = engine or db_service.engine
+    try:
+        current_month = date.today().replace(day=1)
+        with engine.begin() as conn:
+            _create_month_partitions(conn, current_month, _add_months(current_month, months_ahead))
+        return True
+    except Exception as e:
+        logger.error(f"❌ Error creating conversation partitions: {e}")
+        return False
+
+
+def list_conversation_partitions(engine=None) -> List[str]:
+    """Names of the monthly conversation_history partitions"""
+    engine = engine or db_service.engine
+    with engine.connect() as conn:
+        result = conn.execute(text("""
+            SELECT child.relname FROM pg_inherits i
+            JOIN pg_class parent ON parent.oid = i.inhparent
+            JOIN pg_class child ON child.oid = i.inhrelid
+            WHERE parent.relname = 'conversation_history'
+            ORDER BY child.relname
+        """))
+        return [row[0] for row in result if _PARTITION_NAME.match(row[0])]
+
+
+def drop_expired_conversation_partitions(retention_months: int = CONVERSATION_RETENTION_MONTHS, engine=None) -> List[str]:
+    """Drop monthly partitions that lie entirely before the retention cutoff"""
+    engine = engine or db_service.engine
+    cutoff = _add_months(date.today().replace(day=1), -retention_months)
+    dropped = []
+
+    try:
+        for name in list_conversation_partitions(engine):
+            match = _PARTITION_NAME.match(name)
+            partition_end = _add_months(date(int(match.group(1)), int(match.group(2)), 1), 1)
+            if partition_end <= cutoff:
+                with engine.begin() as conn:
+                    conn.execute(text(f"DROP TABLE IF EXISTS {name}"))
+                dropped.append(name)
+
+        if dropped:
+            logger.info(f"🗑️ Dropped expired conversation partitions: {', '.join(dropped)}")
+    except Exception as e:
+        logger.error(f"❌ Error dropping expired partitions: {e}")
+
+    return dropped
+
+
+def compact_conversation_payloads(batch_size: int = 500, max_batches: int = 20, engine=None) -> int:
+    """Move inline analysis_data of older rows into deduplicated, compressed payloads"""
+    engine = engine or db_service.engine
+    from app.services.conversation_payloads import pack_analysis_data
+
+    compacted = 0
+    try:
+        for _ in range(max_batches):
+            with engine.begin() as conn:
+                rows = conn.execute(text("""
+                    SELECT id, created_at, analysis_data FROM conversation_history
+                    WHERE analysis_data IS NOT NULL AND payload_hash IS NULL
+                    LIMIT :batch_size
+                """), {"batch_size": batch_size}).fetchall()
+                if not rows:
+                    break
+
+                for row_id, created_at, analysis_data in rows:
+                    packed = pack_analysis_data(analysis_data)
+                    if packed is None:
+                        continue
+                    content_hash, data_json, markdown = packed
+                    conn.execute(text("""
+                        INSERT INTO conversation_payloads (hash, analysis_data, markdown)
+                        VALUES (:hash, :analysis_data, :markdown)
+                        ON CONFLICT (hash) DO NOTHING
+                    """), {"hash": content_hash, "analysis_data": data_json, "markdown": markdown})
+                    conn.execute(text("""
+                        UPDATE conversation_history
+                        SET payload_hash = :hash, analysis_data = NULL
+                        WHERE id = :id AND created_at = :created_at
+                    """), {"hash": content_hash, "id": row_id, "created_at": created_at})
+                compacted += len(rows)
+
+        if compacted:
+            logger.info(f"🗜️ Compacted {compacted} conversation payloads")
+    except Exception as e:
+        logger.error(f"❌ Error compacting conversation payloads: {e}")
+
+    return compacted
 
-        if success:
-            logger.info("✅ All migrations completed successfully")
-        else:
-            logger.error("❌ Some migrations failed")
 
-        return success
+def delete_orphaned_payloads(grace_days: int = 7, engine=None) -> int:
+    """Delete payloads no longer referenced after partitions were dropped"""
+    engine = engine or db_service.engine
+    try:
+        with engine.begin() as conn:
+            result = conn.execute(text("""
+                DELETE FROM conversation_payloads p
+                WHERE p.created_at < CURRENT_TIMESTAMP - make_interval(days => :grace_days)
+                AND NOT EXISTS (
+                    SELECT 1 FROM conversation_history h WHERE h.payload_hash = p.hash
+                )
+            """), {"grace_days": grace_days})
+            return result.rowcount
     except Exception as e:
-        logger.error(f"❌ Migration error: {e}")
+        logger.error(f"❌ Error deleting orphaned payloads: {e}")
+        return 0
+
+
+def _maintain_shard(name: str, engine) -> bool:
+    from app.services.topic_stats import prune_topic_stats
+
+    with _advisory_lock(MAINTENANCE_LOCK_KEY, wait_seconds=0, engine=engine) as acquired:
+        if not acquired:
+            logger.info(f"⏭️ Conversation maintenance of shard {name} already running in another worker, skipping")
+            return True
+
+        ok = ensure_conversation_partitions(engine=engine)
+        dropped = drop_expired_conversation_partitions(engine=engine)
+        compact_conversation_payloads(engine=engine)
+        if dropped:
+            delete_orphaned_payloads(engine=engine)
+        prune_topic_stats(engine=engine)
+        return ok
+
+
+def maintain_conversation_storage() -> bool:
+    """Periodic maintenance on every shard: future partitions, retention, payload compaction"""
+    started = datetime.now()
+    ok = True
+    for name, shard in db_service.shards.items():
+        ok = _maintain_shard(name, shard.engine) and ok
+    logger.info(f"✅ Conversation storage maintenance finished in {(datetime.now() - started).total_seconds():.1f}s")
+    return ok
+
+
+# Ordered schema migrations; a version is never renumbered or reused once released
+MIGRATIONS = [
+    (1, "conversation_payloads", create_conversation_payloads_table),
+    (2, "conversation_history", create_conversation_history_table),
+    (3, "user_topic_stats", create_user_topic_stats_table),
+    (4, "transactions_user_id", add_transactions_user_id),
+    (5, "user_data_notify", create_user_data_notify_triggers),
+    (6, "transaction_insert_payloads", add_transaction_insert_payloads),
+    (7, "transactions_statement_notify", notify_transactions_per_statement),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+@contextmanager
+def _advisory_lock(key: int, wait_seconds: float = 0, engine=None):
+    """Hold a session-level advisory lock on a dedicated connection; yields False if not acquired"""
+    engine = engine or db_service.engine
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        deadline = time.monotonic() + wait_seconds
+        while not conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": key}).scalar():
+            if time.monotonic() >= deadline:
+                yield False
+                return
+            time.sleep(0.5)
+        try:
+            yield True
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": key})
+
+
+def current_schema_version(engine=None) -> int:
+    """Highest applied migration version, 0 before the runner first ran"""
+    engine = engine or db_service.engine
+    try:
+        with engine.connect() as conn:
+            return conn.execute(text(
+                "SELECT version FROM schema_migrations ORDER BY version DESC LIMIT 1"
+            )).scalar() or 0
+    except ProgrammingError:
+        return 0
+
+
+def _applied_versions(conn) -> set:
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            duration_ms INTEGER,
+            applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """))
+    return {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+
+def _apply_pending_migrations(engine=None) -> bool:
+    engine = engine or db_service.engine
+    with engine.begin() as conn:
+        applied = _applied_versions(conn)
+
+    pending = [m for m in MIGRATIONS if m[0] not in applied]
+    if not pending:
+        logger.info(f"✅ Schema already at version {LATEST_VERSION}")
+        return True
+
+    for version, name, migrate in pending:
+        started = time.perf_counter()
+        logger.info(f"🔄 Applying migration {version} ({name})...")
+        if not migrate(engine):
+            # Later migrations may depend on this one
+            logger.error(f"❌ Migration {version} ({name}) failed, stopping")
+            return False
+        with engine.begin() as conn:
+            conn.execute(text("""
+                INSERT INTO schema_migrations (version, name, duration_ms)
+                VALUES (:version, :name, :duration_ms)
+                ON CONFLICT (version) DO NOTHING
+            """), {"version": version, "name": name, "duration_ms": int((time.perf_counter() - started) * 1000)})
+
+    logger.info(f"✅ Schema migrated to version {LATEST_VERSION}")
+    return True
+
+
+def _migrate_shard(name: str, engine, wait_seconds: float) -> bool:
+    if current_schema_version(engine) >= LATEST_VERSION:
+        return True
+
+    logger.info(f"🔄 Running database migrations on shard {name}...")
+    with _advisory_lock(MIGRATION_LOCK_KEY, wait_seconds, engine) as acquired:
+        if not acquired:
+            logger.warning(f"⚠️ Migrations of shard {name} still running in another worker after {wait_seconds}s, continuing without them")
+            return False
+        # Another worker may have finished while this one waited
+        return _apply_pending_migrations(engine)
+
+
+def run_migrations(wait_seconds: float = MIGRATION_LOCK_WAIT_SECONDS):
+    """Apply pending migrations on every shard in one worker; an up-to-date shard costs one indexed read"""
+    if db_service is None:
+        logger.error("❌ Database service unavailable, skipping migrations")
         return False
 
+    success = True
+    for name, shard in db_service.shards.items():
+        try:
+            success = _migrate_shard(name, shard.engine, wait_seconds) and success
+        except Exception as e:
+            logger.error(f"❌ Migration error on shard {name}: {e}")
+            success = False
+    return success
+
 if __name__ == "__main__":
-    run_migrations()
\ No newline at end of file
+    run_migrations()
@@ -0,0 +1,154 @@
+import sys
+import os
+import argparse
+import logging
+from typing import Dict, List, Set, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from sqlalchemy import text
+from app.database.database import db_service
+
+logger = logging.getLogger(__name__)
+
+# Per-user tables in copy order (parents first); pruning runs in reverse
+USER_TABLES = ["categories", "accounts", "transactions", "user_topic_stats"]
+
+# Rows must match on these before a user's copy on the new shard counts as complete
+VERIFY_TABLES = ["accounts", "transactions"]
+
+
+def shard_users(engine) -> Set[str]:
+    """Every user with rows on this shard"""
+    with engine.connect() as conn:
+        return {row[0] for row in conn.execute(text("""
+            SELECT user_id FROM accounts
+            UNION SELECT user_id FROM categories
+            UNION SELECT user_id FROM conversation_history
+            UNION SELECT user_id FROM user_topic_stats
+        """))}
+
+
+def plan_moves() -> Dict[Tuple[str, str], List[str]]:
+    """(source shard, owner shard) -> users stored on a shard the ring no longer maps them to"""
+    moves: Dict[Tuple[str, str], List[str]] = {}
+    for name, shard in db_service.shards.items():
+        for user_id in sorted(shard_users(shard.engine)):
+            owner = db_service.shard_for(user_id).name
+            if owner != name:
+                moves.setdefault((name, owner), []).append(user_id)
+    return moves
+
+
+def _copy_rows(source, target, table: str, where: str, params: Dict, conflict: str = "ON CONFLICT DO NOTHING") -> int:
+    result = source.execute(text(f"SELECT * FROM {table} WHERE {where}"), params)
+    columns = list(result.keys())
+    rows = [dict(zip(columns, row)) for row in result]
+    if not rows:
+        return 0
+    target.execute(text(
+        f"INSERT INTO {table} ({', '.join(columns)}) "
+        f"VALUES ({', '.join(':' + c for c in columns)}) {conflict}"
+    ), rows)
+    return len(rows)
+
+
+def copy_user(user_id: str, source_engine, target_engine) -> int:
+    """Copy one user's rows to the owner shard; idempotent, safe to re-run"""
+    params = {"user_id": user_id}
+    copied = 0
+    with source_engine.connect() as source, target_engine.begin() as target:
+        for table in USER_TABLES:
+            copied += _copy_rows(source, target, table, "user_id = :user_id", params)
+
+        copied += _copy_rows(source, target, "conversation_payloads", """
+            hash IN (SELECT payload_hash FROM conversation_history WHERE user_id = :user_id)
+        """, params)
+
+        # History ids are per-shard sequences: let the target assign new ones, dedupe on content
+        history = source.execute(text("""
+            SELECT user_id, question, response, analysis_data, payload_hash, created_at
+            FROM conversation_history WHERE user_id = :user_id
+        """), params)
+        rows = [dict(zip(history.keys(), row)) for row in history]
+        if rows:
+            target.execute(text("""
+                INSERT INTO conversation_history (user_id, question, response, analysis_data, payload_hash, created_at)
+                SELECT :user_id, :question, :response, :analysis_data, :payload_hash, :created_at
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM conversation_history
+                    WHERE user_id = :user_id AND created_at = :created_at AND question = :question
+                )
+            """), rows)
+            copied += len(rows)
+    return copied
+
+
+def _row_counts(engine, user_id: str) -> Dict[str, int]:
+    with engine.connect() as conn:
+        return {
+            table: conn.execute(text(f"SELECT COUNT(*) FROM {table} WHERE user_id = :user_id"), {"user_id": user_id}).scalar()
+            for table in VERIFY_TABLES
+        }
+
+
+def prune_user(user_id: str, source_engine, target_engine) -> bool:
+    """Delete a moved user's rows from the old shard once the owner shard holds all of them"""
+    source_counts = _row_counts(source_engine, user_id)
+    target_counts = _row_counts(target_engine, user_id)
+    if any(target_counts[t] < source_counts[t] for t in VERIFY_TABLES):
+        logger.warning(f"⚠️ Not pruning {user_id}: owner shard has {target_counts}, old shard has {source_counts}")
+        return False
+
+    with source_engine.begin() as conn:
+        conn.execute(text("DELETE FROM conversation_history WHERE user_id = :user_id"), {"user_id": user_id})
+        for table in reversed(USER_TABLES):
+            conn.execute(text(f"DELETE FROM {table} WHERE user_id = :user_id"), {"user_id": user_id})
+    return True
+
+
+def main(action: str, limit: int = None) -> int:
+    if db_service is None:
+        print("❌ DRIZZLE_DATABASE_URL is not set")
+        return 1
+
+    moves = plan_moves()
+    total = sum(len(users) for users in moves.values())
+    print(f"📋 {total} users stored off their owner shard across {len(db_service.shards)} shards")
+    for (source, owner), users in moves.items():
+        print(f"  {source} -> {owner}: {len(users)} users")
+    if action == "plan" or not total:
+        return 0
+
+    done = failed = 0
+    for (source, owner), users in moves.items():
+        source_engine = db_service.shards[source].engine
+        target_engine = db_service.shards[owner].engine
+        for user_id in users[:limit]:
+            try:
+                if action == "copy":
+                    copy_user(user_id, source_engine, target_engine)
+                    done += 1
+                elif prune_user(user_id, source_engine, target_engine):
+                    done += 1
+                else:
+                    failed += 1
+            except Exception as e:
+                failed += 1
+                logger.error(f"❌ {action} failed for {user_id} ({source} -> {owner}): {e}")
+
+    print(f"{'✅' if not failed else '⚠️'} {action}: {done} users done, {failed} failed")
+    return 0 if not failed else 1
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(
+        description="Move users to the shard the ring maps them to. Run 'copy' with the new DB_SHARDS, "
+                    "switch the service to it, run 'copy' again for late writes, then 'prune'."
+    )
+    parser.add_argument("action", choices=["plan", "copy", "prune"])
+    parser.add_argument("--limit", type=int, default=None, help="users per shard pair in this run")
+    args = parser.parse_args()
+
+    sys.exit(main(args.action, args.limit))
@@ -0,0 +1,257 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import tempfile
+from typing import Dict, Any, Callable, List, Optional
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_SNAPSHOT_DIR = os.getenv("SCHEMA_SNAPSHOT_DIR", tempfile.gettempdir())
+
+SCHEMA_REFRESH_INTERVAL_SECONDS = float(os.getenv("SCHEMA_REFRESH_INTERVAL_SECONDS", "300"))
+
+EMPTY_SCHEMA = {"tables": {}, "relationships": [], "indexes": {}}
+
+# Base tables of the current schema; partitions are described through their parent
+_TABLE_FILTER = """
+    n.nspname = current_schema() AND c.relkind IN ('r', 'p') AND NOT c.relispartition
+"""
+
+# Changes whenever a column, constraint or index of any table changes
+_FINGERPRINT_QUERY = f"""
+    SELECT md5(COALESCE(string_agg(item, '|' ORDER BY item), '')) FROM (
+        SELECT c.relname || '.' || a.attname || ':' || format_type(a.atttypid, a.atttypmod)
+               || ':' || a.attnotnull AS item
+        FROM pg_attribute a
+        JOIN pg_class c ON c.oid = a.attrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE {_TABLE_FILTER} AND a.attnum > 0 AND NOT a.attisdropped
+        UNION ALL
+        SELECT c.relname || '#' || con.conname || ':' || pg_get_constraintdef(con.oid)
+        FROM pg_constraint con
+        JOIN pg_class c ON c.oid = con.conrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE {_TABLE_FILTER}
+        UNION ALL
+        SELECT pg_get_indexdef(i.indexrelid)
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE {_TABLE_FILTER}
+    ) items
+"""
+
+_COLUMNS_QUERY = f"""
+    SELECT c.relname, a.attname, format_type(a.atttypid, a.atttypmod), NOT a.attnotnull,
+           EXISTS (
+               SELECT 1 FROM pg_index pk
+               WHERE pk.indrelid = c.oid AND pk.indisprimary AND a.attnum = ANY(pk.indkey)
+           )
+    FROM pg_attribute a
+    JOIN pg_class c ON c.oid = a.attrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE {_TABLE_FILTER} AND a.attnum > 0 AND NOT a.attisdropped
+    ORDER BY c.relname, a.attnum
+"""
+
+# Foreign keys and indexes in one pass, columns resolved to names in key order
+_KEYS_QUERY = f"""
+    SELECT 'fk', c.relname, con.conname,
+           ARRAY(SELECT a.attname FROM unnest(con.conkey) WITH ORDINALITY k(attnum, ord)
+                 JOIN pg_attribute a ON a.attrelid = con.conrelid AND a.attnum = k.attnum ORDER BY k.ord),
+           ref.relname,
+           ARRAY(SELECT a.attname FROM unnest(con.confkey) WITH ORDINALITY k(attnum, ord)
+                 JOIN pg_attribute a ON a.attrelid = con.confrelid AND a.attnum = k.attnum ORDER BY k.ord),
+           false
+    FROM pg_constraint con
+    JOIN pg_class c ON c.oid = con.conrelid
+    JOIN pg_class ref ON ref.oid = con.confrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE {_TABLE_FILTER} AND con.contype = 'f'
+    UNION ALL
+    SELECT 'index', c.relname, ic.relname,
+           ARRAY(SELECT a.attname FROM unnest(i.indkey) WITH ORDINALITY k(attnum, ord)
+                 JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+                 WHERE k.ord <= i.indnkeyatts ORDER BY k.ord),
+           NULL, NULL, i.indisunique
+    FROM pg_index i
+    JOIN pg_class c ON c.oid = i.indrelid
+    JOIN pg_class ic ON ic.oid = i.indexrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE {_TABLE_FILTER} AND NOT i.indisprimary
+"""
+
+
+def schema_fingerprint(conn) -> str:
+    """Hash of every column, constraint and index definition in the current schema"""
+    return conn.execute(text(_FINGERPRINT_QUERY)).scalar()
+
+
+def load_schema_catalog(conn) -> Dict[str, Any]:
+    """Tables, relationships and indexes from two bulk catalog queries"""
+    schema_info = {"tables": {}, "relationships": [], "indexes": {}}
+
+    for table, column, type_name, nullable, primary_key in conn.execute(text(_COLUMNS_QUERY)):
+        entry = schema_info["tables"].setdefault(table, {"columns": [], "foreign_keys": []})
+        schema_info["indexes"].setdefault(table, [])
+        entry["columns"].append({
+            "name": column,
+            "type": type_name,
+            "nullable": nullable,
+            "primary_key": primary_key
+        })
+
+    for kind, table, name, columns, referred_table, referred_columns, unique in conn.execute(text(_KEYS_QUERY)):
+        if table not in schema_info["tables"]:
+            continue
+        if kind == "index":
+            schema_info["indexes"][table].append({"name": name, "column_names": list(columns), "unique": unique})
+            continue
+        schema_info["tables"][table]["foreign_keys"].append({
+            "name": name,
+            "constrained_columns": list(columns),
+            "referred_table": referred_table,
+            "referred_columns": list(referred_columns)
+        })
+        if columns and referred_columns:
+            schema_info["relationships"].append({
+                "from_table": table,
+                "from_column": columns[0],
+                "to_table": referred_table,
+                "to_column": referred_columns[0]
+            })
+
+    return schema_info
+
+
+class SchemaSnapshot:
+    def __init__(
+        self,
+        engine,
+        database_url: str,
+        describe: Callable[[Dict[str, Any]], str],
+        snapshot_dir: str = None,
+        shard_engines: Dict[str, Any] = None
+    ):
+        """Catalog snapshot cached on disk by fingerprint, with a description precomputed per snapshot"""
+        self.engine = engine
+        self.shard_engines = shard_engines or {}
+        self.drifted_shards: List[str] = []
+        self.describe = describe
+        url_key = hashlib.sha1(database_url.encode("utf-8")).hexdigest()[:12]
+        self.path = os.path.join(snapshot_dir or SCHEMA_SNAPSHOT_DIR, f"schema_snapshot_{url_key}.json")
+
+        self.fingerprint: Optional[str] = None
+        self.info: Dict[str, Any] = EMPTY_SCHEMA
+        self.description: str = describe(EMPTY_SCHEMA)
+        self.loaded_at: Optional[float] = None
+
+        self._task: Optional[asyncio.Task] = None
+        self._stats = {"file_hits": 0, "catalog_loads": 0, "refreshes": 0, "changes": 0, "errors": 0}
+
+    def _check_shards(self, fingerprint: str):
+        """Warn about shards whose schema differs from the default shard's (e.g. a failed migration)"""
+        drifted = []
+        for name, engine in self.shard_engines.items():
+            try:
+                with engine.connect() as conn:
+                    if schema_fingerprint(conn) != fingerprint:
+                        drifted.append(name)
+            except Exception as e:
+                logger.warning(f"Could not fingerprint schema of shard {name}: {e}")
+                drifted.append(name)
+        if drifted and drifted != self.drifted_shards:
+            logger.warning(f"⚠️ Schema differs from the default shard on: {', '.join(drifted)}")
+        self.drifted_shards = drifted
+
+    def _read_file(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_file(self, fingerprint: str, info: Dict[str, Any]):
+        # Write-then-rename so concurrently booting workers never read a partial file
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"fingerprint": fingerprint, "schema_info": info, "saved_at": time.time()}, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Could not write schema snapshot {self.path}: {e}")
+
+    def _install(self, fingerprint: str, info: Dict[str, Any]):
+        self.info = info
+        self.description = self.describe(info)
+        self.fingerprint = fingerprint
+        self.loaded_at = time.time()
+
+    def refresh(self) -> bool:
+        """Reload when the catalog fingerprint changed; True if a new snapshot was installed"""
+        try:
+            with self.engine.connect() as conn:
+                fingerprint = schema_fingerprint(conn)
+                if self.shard_engines:
+                    self._check_shards(fingerprint)
+                if fingerprint == self.fingerprint:
+                    return False
+
+                cached = self._read_file()
+                if cached and cached.get("fingerprint") == fingerprint:
+                    info = cached["schema_info"]
+                    self._stats["file_hits"] += 1
+                else:
+                    info = load_schema_catalog(conn)
+                    self._stats["catalog_loads"] += 1
+                    self._write_file(fingerprint, info)
+        except Exception as e:
+            self._stats["errors"] += 1
+            logger.error(f"Error loading schema info: {e}")
+            return False
+
+        if self.fingerprint is not None:
+            self._stats["changes"] += 1
+            logger.info("🔄 Database schema changed, snapshot reloaded")
+        self._install(fingerprint, info)
+        logger.info(f"✅ Loaded schema info for {len(info['tables'])} tables")
+        return True
+
+    async def start(self, interval_seconds: float = None):
+        """Start background fingerprint checks (call from lifespan startup)"""
+        if self._task is not None and not self._task.done():
+            return
+        self._task = asyncio.create_task(self._run(interval_seconds or SCHEMA_REFRESH_INTERVAL_SECONDS))
+
+    async def stop(self):
+        """Stop background refreshes (call from lifespan shutdown)"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self, interval_seconds: float):
+        loop = asyncio.get_event_loop()
+        while True:
+            await asyncio.sleep(interval_seconds)
+            await loop.run_in_executor(None, self.refresh)
+            self._stats["refreshes"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Snapshot age and load counters"""
+        return {
+            **self._stats,
+            "fingerprint": self.fingerprint,
+            "drifted_shards": self.drifted_shards,
+            "tables": len(self.info["tables"]),
+            "age_seconds": round(time.time() - self.loaded_at, 1) if self.loaded_at else None
+        }
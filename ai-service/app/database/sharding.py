@@ -0,0 +1,177 @@
+import os
+import time
+import bisect
+import hashlib
+import itertools
+import threading
+import logging
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+
+logger = logging.getLogger(__name__)
+
+# Shard that holds DRIZZLE_DATABASE_URL; also serves calls without a user_id
+DEFAULT_SHARD = "default"
+
+# Points per shard on the hash ring; more points spread users more evenly
+SHARD_VNODES = int(os.getenv("DB_SHARD_VNODES", "128"))
+
+# "round_robin" or "least_connections"
+REPLICA_SELECTION = os.getenv("DB_REPLICA_SELECTION", "round_robin")
+
+# Reads of a user who wrote within this window stay on the primary; 0 disables stickiness
+READ_YOUR_WRITES_SECONDS = float(os.getenv("DB_READ_YOUR_WRITES_SECONDS", "5"))
+
+# A replica that failed a connection is skipped for this long
+REPLICA_RETRY_SECONDS = float(os.getenv("DB_REPLICA_RETRY_SECONDS", "30"))
+
+MAX_TRACKED_WRITERS = 10000
+
+
+def _hash(key: str) -> int:
+    return int(hashlib.md5(key.encode("utf-8")).hexdigest()[:16], 16)
+
+
+def parse_shard_map(value: str) -> "OrderedDict[str, List[str]]":
+    """Parse DB_SHARDS: "name=primary_url|replica_url|...,name=..." into name -> [primary, *replicas]"""
+    shards: "OrderedDict[str, List[str]]" = OrderedDict()
+    for item in (value or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, urls = item.partition("=")
+        urls = [url.strip() for url in urls.split("|") if url.strip()]
+        if not name.strip() or not urls:
+            raise ValueError(f"Invalid shard entry '{item}', expected name=url[|replica_url...]")
+        shards[name.strip()] = urls
+    return shards
+
+
+class ShardRing:
+    def __init__(self, shard_names: List[str], vnodes: int = None):
+        """Consistent hash ring; adding a shard only moves the users it takes over"""
+        vnodes = vnodes or SHARD_VNODES
+        points = sorted(
+            (_hash(f"{name}#{i}"), name)
+            for name in shard_names
+            for i in range(vnodes)
+        )
+        self._hashes = [point for point, _ in points]
+        self._names = [name for _, name in points]
+        self.shard_names = list(shard_names)
+
+    def shard_for(self, user_id: str) -> str:
+        """Name of the shard owning this user"""
+        index = bisect.bisect(self._hashes, _hash(user_id)) % len(self._hashes)
+        return self._names[index]
+
+
+class ShardPool:
+    def __init__(self, name: str, engine, replica_engines: List = None, replica_urls: List[str] = None):
+        """Primary engine of one shard plus its read replicas and read-your-writes tracking"""
+        self.name = name
+        self.engine = engine
+        self.replica_engines = replica_engines or []
+        self.replica_urls = replica_urls or []
+
+        self._replica_down_until = [0.0] * len(self.replica_engines)
+        self._replica_cursor = itertools.count()
+        self._recent_writes: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            "primary_reads": 0, "replica_reads": 0, "sticky_reads": 0, "replica_failovers": 0,
+            "pool_checkouts": 0  # each one also costs a pre-ping round trip
+        }
+        for pool_engine in [engine, *self.replica_engines]:
+            event.listen(pool_engine, "checkout", self._on_checkout)
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        self._stats["pool_checkouts"] += 1
+
+    def mark_write(self, user_id: str):
+        """Remember a write so this user's reads stay on the primary until replicas catch up"""
+        if READ_YOUR_WRITES_SECONDS <= 0 or not self.replica_engines:
+            return
+        with self._lock:
+            self._recent_writes[user_id] = time.monotonic()
+            self._recent_writes.move_to_end(user_id)
+            while len(self._recent_writes) > MAX_TRACKED_WRITERS:
+                self._recent_writes.popitem(last=False)
+
+    def _recently_wrote(self, user_id: Optional[str]) -> bool:
+        if user_id is None:
+            return False
+        with self._lock:
+            written_at = self._recent_writes.get(user_id)
+        return written_at is not None and time.monotonic() - written_at < READ_YOUR_WRITES_SECONDS
+
+    def _select_replica(self) -> Optional[int]:
+        """Index of a healthy replica by the configured policy, None if none is usable"""
+        now = time.monotonic()
+        healthy = [i for i, down_until in enumerate(self._replica_down_until) if down_until <= now]
+        if not healthy:
+            return None
+        if REPLICA_SELECTION == "least_connections":
+            return min(healthy, key=lambda i: self.replica_engines[i].pool.checkedout())
+        return healthy[next(self._replica_cursor) % len(healthy)]
+
+    def read_connection(self, user_id: Optional[str] = None):
+        """Connection for a read-only query: a replica unless the user just wrote or none is healthy"""
+        if self.replica_engines:
+            if self._recently_wrote(user_id):
+                self._stats["sticky_reads"] += 1
+            else:
+                index = self._select_replica()
+                if index is not None:
+                    try:
+                        conn = self.replica_engines[index].connect()
+                        self._stats["replica_reads"] += 1
+                        return conn
+                    except OperationalError as e:
+                        self._replica_down_until[index] = time.monotonic() + REPLICA_RETRY_SECONDS
+                        self._stats["replica_failovers"] += 1
+                        logger.warning(f"⚠️ Replica {index} of shard {self.name} unavailable, reading from primary: {e}")
+
+        self._stats["primary_reads"] += 1
+        return self.engine.connect()
+
+    def get_stats(self, mask_url) -> Dict[str, Any]:
+        """Read routing counters and per-pool checked-out connections"""
+        now = time.monotonic()
+        return {
+            **self._stats,
+            "primary_pool_checked_out": self.engine.pool.checkedout(),
+            "replicas": [
+                {
+                    "url": mask_url(url),
+                    "checked_out": engine.pool.checkedout(),
+                    "healthy": self._replica_down_until[i] <= now
+                }
+                for i, (url, engine) in enumerate(zip(self.replica_urls, self.replica_engines))
+            ]
+        }
+
+    def get_pool_stats(self) -> Dict[str, Any]:
+        """Checked-out connections against capacity for the primary and each replica pool"""
+        def usage(engine) -> Dict[str, Any]:
+            pool = engine.pool
+            if not hasattr(pool, "size"):
+                return {"checked_out": pool.checkedout()}
+            capacity = pool.size() + max(pool._max_overflow, 0)
+            return {
+                "checked_out": pool.checkedout(),
+                "capacity": capacity,
+                "saturation": round(pool.checkedout() / capacity, 3) if capacity else 0.0
+            }
+        return {
+            "primary": usage(self.engine),
+            "replicas": [usage(engine) for engine in self.replica_engines]
+        }
+
+    def dispose(self):
+        self.engine.dispose()
+        for engine in self.replica_engines:
+            engine.dispose()
@@ -0,0 +1,203 @@
+import os
+import asyncio
+import threading
+import contextvars
+import logging
+from contextlib import contextmanager
+from functools import partial
+from typing import Dict, Any, List, Optional
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# Share one snapshot (and one connection, unless intents run concurrently) across all reads of a request;
+# false restores per-query checkouts
+REQUEST_SCOPED_CONNECTION = os.getenv("DB_REQUEST_SCOPED_CONNECTION", "true").lower() == "true"
+
+# Unit of work of the request being served; copied into worker threads by run_in_executor below
+current_unit_of_work: "contextvars.ContextVar[Optional[UnitOfWork]]" = contextvars.ContextVar(
+    "current_unit_of_work", default=None
+)
+
+# Connections a unit of work may hold at once: concurrent intents beyond the first borrow extra
+# connections that import the first one's snapshot, so they run in parallel yet read the same data
+MAX_CONNECTIONS_PER_UNIT = int(os.getenv("DB_UNIT_OF_WORK_MAX_CONNECTIONS", "4"))
+
+# Results remembered per unit of work, so repeated reads of one user in a batch run once
+MAX_SHARED_RESULTS = 256
+
+_totals = {"units": 0, "units_used": 0, "checkouts": 0, "statements": 0, "shared_results": 0, "reopened_after_error": 0, "snapshot_imports": 0}
+_totals_lock = threading.Lock()
+
+
+def _count(key: str, amount: int = 1):
+    with _totals_lock:
+        _totals[key] += amount
+
+
+async def run_in_executor(func, *args):
+    """Run a blocking call in the default executor, keeping the request's unit of work"""
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, partial(contextvars.copy_context().run, func, *args))
+
+
+class UnitOfWork:
+    def __init__(self, shard, user_id: str, max_connections: int = None):
+        """Lazily checked-out connections on the user's shard, sharing one snapshot across every read of a request"""
+        self.shard = shard
+        self.user_id = user_id
+        self.max_connections = max_connections or MAX_CONNECTIONS_PER_UNIT
+        self._conn = None
+        self._snapshot: Optional[str] = None
+        self._idle: List[Any] = []
+        self._open_count = 0
+        self._generation = 0
+        self._cond = threading.Condition()
+        self._results: Dict[tuple, Any] = {}
+        self.checkouts = 0
+        self.statements = 0
+        self.concurrent = 0
+
+    def _open(self):
+        """The first connection: its read-only transaction fixes the snapshot every later read sees"""
+        conn = self.shard.read_connection(self.user_id)
+        snapshot = None
+        if conn.dialect.name == "postgresql":
+            conn.execute(text("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY"))
+            # Exported so concurrent borrows can run on their own connections in the same snapshot
+            snapshot = conn.execute(text("SELECT pg_export_snapshot()")).scalar()
+        _count("checkouts")
+        return conn, snapshot
+
+    def _open_follower(self, engine, snapshot: str):
+        """An extra connection to the same server, importing the first connection's snapshot"""
+        conn = engine.connect()
+        try:
+            conn.execute(text("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY"))
+            conn.execute(text(f"SET TRANSACTION SNAPSHOT '{snapshot}'"))
+        except Exception:
+            conn.close()
+            raise
+        _count("checkouts")
+        _count("snapshot_imports")
+        return conn
+
+    def _close(self, conn):
+        try:
+            conn.rollback()
+            conn.close()
+        except Exception as e:
+            logger.debug(f"Discarding unit of work connection failed: {e}")
+
+    def _acquire(self):
+        """(connection, generation) for one borrow, opening or joining the snapshot as needed"""
+        with self._cond:
+            while True:
+                if self._idle:
+                    return self._idle.pop(), self._generation
+                if self._conn is None and self._open_count == 0:
+                    follower = False
+                    break
+                # Without an exported snapshot (non-Postgres) or at the cap, concurrent borrows take turns
+                if self._snapshot is not None and self._open_count < self.max_connections:
+                    follower = True
+                    engine, snapshot = self._conn.engine, self._snapshot
+                    self.concurrent += 1
+                    break
+                self._cond.wait()
+            self._open_count += 1
+            self.checkouts += 1
+            generation = self._generation
+
+        try:
+            if follower:
+                return self._open_follower(engine, snapshot), generation
+            conn, snapshot = self._open()
+        except Exception:
+            with self._cond:
+                self._open_count -= 1
+                self._cond.notify_all()
+            raise
+
+        with self._cond:
+            if generation == self._generation:
+                self._conn, self._snapshot = conn, snapshot
+            self._cond.notify_all()
+        return conn, generation
+
+    def _give_back(self, conn, generation: int, failed: bool):
+        with self._cond:
+            if failed and conn is self._conn:
+                # The first connection's transaction is aborted: start over with a fresh snapshot
+                self._discard_all()
+            if failed or generation != self._generation:
+                # Failed, or opened for a snapshot that has since been discarded
+                self._open_count -= 1
+                self._close(conn)
+            else:
+                self._idle.append(conn)
+            self._cond.notify_all()
+
+    def _discard_all(self):
+        """Close idle connections and start a new snapshot on the next borrow; borrowed ones close when given back"""
+        idle, self._idle = self._idle, []
+        self._open_count -= len(idle)
+        self._conn, self._snapshot = None, None
+        self._generation += 1
+        for conn in idle:
+            self._close(conn)
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection in the request's snapshot; concurrent intents each get their own"""
+        conn, generation = self._acquire()
+        with self._cond:
+            self.statements += 1
+        _count("statements")
+        try:
+            yield conn
+        except Exception:
+            # A failed statement aborts the transaction; the next borrow starts a fresh one
+            self._give_back(conn, generation, failed=True)
+            _count("reopened_after_error")
+            raise
+        self._give_back(conn, generation, failed=False)
+
+    def _result_key(self, query: str, params: Optional[Dict[str, Any]]) -> tuple:
+        return query, tuple(sorted((key, repr(value)) for key, value in (params or {}).items()))
+
+    def lookup(self, query: str, params: Optional[Dict[str, Any]]):
+        """Result of an identical read already run in this unit of work, None if there is none"""
+        result = self._results.get(self._result_key(query, params))
+        if result is not None:
+            _count("shared_results")
+        return result
+
+    def remember(self, query: str, params: Optional[Dict[str, Any]], result):
+        if len(self._results) < MAX_SHARED_RESULTS:
+            self._results[self._result_key(query, params)] = result
+
+    def release(self):
+        """Return the connections to the pool early; a later read checks out a new one"""
+        with self._cond:
+            self._discard_all()
+
+    def close(self):
+        """End the read-only transaction and return the connection to the pool"""
+        self.release()
+        _count("units")
+        if self.checkouts:
+            _count("units_used")
+
+    def get_stats(self) -> Dict[str, int]:
+        return {"checkouts": self.checkouts, "statements": self.statements, "concurrent_borrows": self.concurrent}
+
+
+def get_unit_of_work_stats() -> Dict[str, Any]:
+    """Checkouts and statements across all request units of work"""
+    with _totals_lock:
+        stats = dict(_totals)
+    stats["enabled"] = REQUEST_SCOPED_CONNECTION
+    stats["statements_per_checkout"] = round(stats["statements"] / stats["checkouts"], 2) if stats["checkouts"] else 0.0
+    return stats
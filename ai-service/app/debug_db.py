@@ -37,9 +37,8 @@ def check_database():
         transactions_query = """
         SELECT t.id, t.amount, t.date, t.category_id, c.name as category_name
         FROM transactions t
-        JOIN accounts a ON t.account_id = a.id
         LEFT JOIN categories c ON t.category_id = c.id
-        WHERE a.user_id = :user_id 
+        WHERE t.user_id = :user_id 
         ORDER BY t.date DESC LIMIT 10
         """
         transactions_df = db_service.execute_query(transactions_query, {"user_id": test_user_id})
@@ -56,11 +55,10 @@ def check_database():
         summary_query = """
         SELECT 
             COUNT(*) as total_transactions,
-            SUM(CASE WHEN CAST(amount AS DECIMAL) > 0 THEN CAST(amount AS DECIMAL) ELSE 0 END) as total_income,
-            SUM(CASE WHEN CAST(amount AS DECIMAL) < 0 THEN ABS(CAST(amount AS DECIMAL)) ELSE 0 END) as total_expenses
+            SUM(CASE WHEN amount > 0 THEN amount ELSE 0 END) as total_income,
+            SUM(CASE WHEN amount < 0 THEN ABS(amount) ELSE 0 END) as total_expenses
         FROM transactions t
-        JOIN accounts a ON t.account_id = a.id
-        WHERE a.user_id = :user_id
+        WHERE t.user_id = :user_id
         """
         summary_df = db_service.execute_query(summary_query, {"user_id": test_user_id})
         print(f"\n📊 Financial summary for user {test_user_id}:")
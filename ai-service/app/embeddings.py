@@ -6,6 +6,8 @@ import numpy as np
 from typing import List, Dict, Any
 import asyncio
 
+from app.utils.vietnamese_text import preprocess_vietnamese_text, tokenize_vietnamese_text
+
 os.environ["ANONYMIZED_TELEMETRY"] = "False"
 os.environ["CHROMA_TELEMETRY_ANONYMOUS"] = "False"
 os.environ["CHROMA_TELEMETRY"] = "False"
@@ -86,6 +88,32 @@ class VietnameseEmbeddings:
 
         return embedding.tolist()
 
+    async def embed_texts(self, texts: List[str]) -> np.ndarray:
+        """Generate normalized embeddings for a batch of texts in one encode call"""
+        loop = asyncio.get_event_loop()
+
+        tokenized_texts = [
+            self._tokenize_vietnamese_text(self._preprocess_vietnamese_text(text))
+            for text in texts
+        ]
+
+        return await loop.run_in_executor(
+            None,
+            self._encode_batch_sync,
+            tokenized_texts
+        )
+
+    def _encode_batch_sync(self, texts: List[str]) -> np.ndarray:
+        """Synchronous batch encoding, one row per input text"""
+        return self.model.encode(
+            texts,
+            batch_size=32,
+            convert_to_tensor=False,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        )
+
     def _encode_text_sync(self, text: str) -> np.ndarray:
         """Synchronous encoding with proper parameters"""
         return self.model.encode(
@@ -98,30 +126,11 @@ class VietnameseEmbeddings:
 
     def _preprocess_vietnamese_text(self, text: str) -> str:
         """Preprocess Vietnamese text for better embedding"""
-        import unicodedata
-
-        # Normalize unicode
-        text = unicodedata.normalize('NFC', text)
-
-        # Clean and normalize
-        text = text.strip().lower()
-
-        # Remove extra whitespace
-        text = ' '.join(text.split())
-
-        return text
+        return preprocess_vietnamese_text(text)
 
     def _tokenize_vietnamese_text(self, text: str) -> str:
         """Tokenize Vietnamese text for better embedding"""
-        try:
-            from pyvi.ViTokenizer import tokenize
-            return tokenize(text)
-        except ImportError:
-            print("⚠️  pyvi not installed, skipping Vietnamese tokenization")
-            return text
-        except Exception as e:
-            print(f"⚠️  Error tokenizing text: {e}")
-            return text
+        return tokenize_vietnamese_text(text)
 
     async def store_user_context(self, user_id: str, context: Dict[str, Any]):
         """Store user context with embedding"""
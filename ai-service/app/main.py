@@ -14,32 +14,65 @@ os.environ["CHROMA_NO_TELEMETRY"] = "1"
 from fastapi import FastAPI, HTTPException
 from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from typing import List
+from decimal import Decimal
 import asyncio
 import json
 import logging
 from contextlib import asynccontextmanager
 
-from app.workflows.financial_analysis import analyze_financial
+from app.workflows import financial_analysis
+from app.workflows.financial_analysis import analyze_financial, analyze_financial_batch
 from app.services.grok_service import grok_service
 from app.services.context_service import ContextService
+from app.services.conversation_writer import conversation_writer
+from app.services.conversation_memory import conversation_memory
+from app.services.cache_invalidation import cache_invalidation
+from app.services.precompute import precompute_worker
+from app.services.anomaly_detection import anomaly_engine
+from app.agents.sql_template_cache import get_sql_template_cache
+from app.services.answer_cache import get_answer_cache
+from app.agents.aggregate_cube import get_aggregate_cube_cache
+from app.database.database import db_service
+from app.database.unit_of_work import get_unit_of_work_stats
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+CONVERSATION_MAINTENANCE_INTERVAL_HOURS = float(os.getenv("CONVERSATION_MAINTENANCE_INTERVAL_HOURS", "24"))
+SUMMARY_BATCH_MAX_USERS = int(os.getenv("SUMMARY_BATCH_MAX_USERS", "20000"))
+ANALYZE_BATCH_MAX_ITEMS = int(os.getenv("ANALYZE_BATCH_MAX_ITEMS", "1000"))
+
+async def _conversation_maintenance_loop():
+    """Create upcoming partitions, drop expired ones and compact payloads periodically"""
+    from app.database.migrations import maintain_conversation_storage
+    loop = asyncio.get_event_loop()
+    while True:
+        try:
+            await loop.run_in_executor(None, maintain_conversation_storage)
+        except Exception as e:
+            logger.warning(f"Conversation maintenance failed: {e}")
+        await asyncio.sleep(CONVERSATION_MAINTENANCE_INTERVAL_HOURS * 3600)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Startup and shutdown with migrations"""
     logger.info("🚀 Starting AI Financial Service")
 
-    # Run database migrations
+    # Apply pending migrations; only one worker runs them, the rest wait on the advisory lock
     try:
         from app.database.migrations import run_migrations
-        run_migrations()
-        logger.info("✅ Database migrations completed")
+        if run_migrations():
+            logger.info("✅ Database schema up to date")
     except Exception as e:
         logger.warning(f"⚠️ Migration warning: {e}")
 
+    # Pick up columns the migrations just added, then watch for later schema changes
+    if db_service:
+        db_service.schema.refresh()
+        await db_service.schema.start()
+
     # Warmup services
     try:
         from app.embeddings import embeddings_service
@@ -49,8 +82,38 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         logger.warning(f"Embeddings warmup failed: {e}")
 
+    # Start write-behind conversation persistence and semantic indexing
+    await conversation_writer.start()
+    await conversation_memory.start()
+
+    # Evict a user's cached answers and context as soon as the app changes their data
+    await cache_invalidation.start()
+
+    # Rerun active users' canned analyses after their data changes, off the live lanes
+    await precompute_worker.start()
+
+    # Periodically flag spending spikes across all users for the SQL agent's insights
+    await anomaly_engine.start()
+
+    maintenance_task = asyncio.create_task(_conversation_maintenance_loop())
+
     yield
 
+    maintenance_task.cancel()
+    await anomaly_engine.stop()
+    await precompute_worker.stop()
+    await cache_invalidation.stop()
+    if db_service:
+        await db_service.schema.stop()
+
+    # Flush buffered conversations before exit
+    await conversation_writer.stop()
+    await conversation_memory.stop()
+
+    # Close the SQLite/Postgres checkpointer connections
+    if financial_analysis.workflow:
+        await financial_analysis.workflow.close()
+
     grok_service.clear_cache()
     logger.info("🛑 AI Service shutdown complete")
 
@@ -78,6 +141,26 @@ class AnalysisRequest(BaseModel):
     stream: bool = True
     use_cache: bool = True
 
+class BatchAnalysisItem(BaseModel):
+    user_id: str
+    question: str
+
+class BatchAnalysisRequest(BaseModel):
+    items: List[BatchAnalysisItem]
+    use_cache: bool = True
+
+class SummaryBatchRequest(BaseModel):
+    user_ids: List[str]
+    period_days: int = Field(30, ge=1, le=3660)
+
+def _json_default(value):
+    """Numpy scalars and Decimals from query results"""
+    if isinstance(value, Decimal):
+        return float(value)
+    if hasattr(value, "item"):
+        return value.item()
+    return str(value)
+
 @app.get("/health")
 async def health_check():
     """Health check with optimization stats"""
@@ -100,14 +183,14 @@ async def analyze_optimized_endpoint(request: AnalysisRequest):
     try:
         if not request.stream:
             # Non-streaming optimized analysis
-            result = await analyze_financial(request.user_id, request.question)
+            result = await analyze_financial(request.user_id, request.question, request.use_cache)
             return result
 
         # Streaming optimized analysis
         async def generate_optimized_stream():
             try:
                 # Get analysis first (cached)
-                result = await analyze_financial(request.user_id, request.question)
+                result = await analyze_financial(request.user_id, request.question, request.use_cache)
 
                 if not result["success"]:
                     yield f"data: {json.dumps({'type': 'error', 'error': 'Analysis failed'})}\n\n"
@@ -162,11 +245,46 @@ async def analyze_optimized_endpoint(request: AnalysisRequest):
         logger.error(f"Optimized endpoint error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/analyze/batch")
+async def analyze_batch_endpoint(request: BatchAnalysisRequest):
+    """Analyze many (user, question) pairs as NDJSON; each line carries the index of its item"""
+    if len(request.items) > ANALYZE_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {ANALYZE_BATCH_MAX_ITEMS} items per request"
+        )
+
+    async def generate_results():
+        pairs = [(item.user_id, item.question) for item in request.items]
+        async for result in analyze_financial_batch(pairs, request.use_cache):
+            yield json.dumps(result, default=_json_default) + "\n"
+
+    return StreamingResponse(generate_results(), media_type="application/x-ndjson")
+
+@app.post("/summaries/batch")
+async def summaries_batch_endpoint(request: SummaryBatchRequest):
+    """Financial summaries for many users as NDJSON, streamed chunk by chunk"""
+    if db_service is None:
+        raise HTTPException(status_code=503, detail="Database is not configured")
+    if len(request.user_ids) > SUMMARY_BATCH_MAX_USERS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {SUMMARY_BATCH_MAX_USERS} user_ids per request"
+        )
+
+    async def generate_summaries():
+        async for user_id, summary in db_service.iter_financial_summaries(request.user_ids, request.period_days):
+            yield json.dumps({"user_id": user_id, "summary": summary}, default=_json_default) + "\n"
+
+    return StreamingResponse(generate_summaries(), media_type="application/x-ndjson")
+
 @app.post("/cache/clear")
 async def clear_cache():
     """Clear all caches for optimization"""
     try:
         grok_service.clear_cache()
+        get_sql_template_cache().clear()
+        get_answer_cache().clear()
         return {"success": True, "message": "All caches cleared"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -176,13 +294,33 @@ async def get_optimization_stats():
     """Get optimization statistics"""
     try:
         cache_stats = grok_service.get_cache_stats()
+        checkpointer_stats = (
+            financial_analysis.workflow.get_checkpointer_stats()
+            if financial_analysis.workflow else {}
+        )
 
         return {
             "cache_stats": cache_stats,
+            "checkpointer": checkpointer_stats,
+            "conversation_writer": conversation_writer.get_stats(),
+            "conversation_memory": conversation_memory.get_stats(),
+            "sql_template_cache": get_sql_template_cache().get_stats(),
+            "answer_cache": get_answer_cache().get_stats(),
+            "schema_snapshot": db_service.schema.get_stats() if db_service else {},
+            "read_routing": db_service.get_routing_stats() if db_service else {},
+            "db_admission": db_service.get_admission_stats() if db_service else {},
+            "unit_of_work": get_unit_of_work_stats(),
+            "cache_invalidation": cache_invalidation.get_stats(),
+            "precompute": precompute_worker.get_stats(),
+            "aggregate_cube": get_aggregate_cube_cache().get_stats(),
+            "anomaly_detection": anomaly_engine.get_stats(),
             "features": {
                 "system_prompt_caching": True,
                 "message_deduplication": True,
                 "optimized_sql_agent": True,
+                "sql_template_cache": True,
+                "conversation_memory": True,
+                "semantic_answer_cache": True,
                 "reduced_token_usage": True,
                 "langchain_openai": True
             },
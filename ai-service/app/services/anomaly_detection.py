@@ -0,0 +1,254 @@
+import os
+import time
+import asyncio
+import logging
+from datetime import date, datetime, timedelta
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.database.database import db_service
+from app.database.admission import LANE_BACKGROUND
+from app.database.unit_of_work import run_in_executor
+
+logger = logging.getLogger(__name__)
+
+ANOMALY_DETECTION_ENABLED = os.getenv("ANOMALY_DETECTION_ENABLED", "true").lower() == "true"
+ANOMALY_SCAN_INTERVAL_HOURS = float(os.getenv("ANOMALY_SCAN_INTERVAL_HOURS", "6"))
+
+# Whole weeks of history form the weekday baseline; the days after them are checked for spikes
+ANOMALY_HISTORY_WEEKS = int(os.getenv("ANOMALY_HISTORY_WEEKS", "12"))
+ANOMALY_RECENT_DAYS = int(os.getenv("ANOMALY_RECENT_DAYS", "7"))
+
+# Modified z-score above which a day is a spike (Iglewicz & Hoaglin recommend 3.5)
+ANOMALY_Z_THRESHOLD = float(os.getenv("ANOMALY_Z_THRESHOLD", "3.5"))
+
+# Spikes below this amount (VND) are noise, and a category needs some history to have a baseline
+ANOMALY_MIN_AMOUNT = float(os.getenv("ANOMALY_MIN_AMOUNT", "200000"))
+ANOMALY_MIN_ACTIVE_DAYS = int(os.getenv("ANOMALY_MIN_ACTIVE_DAYS", "4"))
+
+# Users per bulk query and matrix
+ANOMALY_CHUNK_USERS = int(os.getenv("ANOMALY_CHUNK_USERS", "2000"))
+
+MAX_FLAGS_PER_USER = 5
+
+ACTIVE_USERS_QUERY = """
+    SELECT DISTINCT t.user_id
+    FROM transactions t
+    WHERE t.amount < 0
+        AND t.date >= :start_date AND t.date < :end_date
+"""
+
+DAILY_CATEGORY_SPEND_QUERY = """
+    SELECT
+        t.user_id,
+        CAST(t.date AS DATE) as day,
+        COALESCE(c.name, 'Uncategorized') as category_name,
+        SUM(ABS(t.amount)) as spend
+    FROM transactions t
+    LEFT JOIN categories c ON t.category_id = c.id
+    WHERE t.user_id = ANY(:user_ids)
+        AND t.amount < 0
+        AND t.date >= :start_date AND t.date < :end_date
+    GROUP BY t.user_id, CAST(t.date AS DATE), COALESCE(c.name, 'Uncategorized')
+"""
+
+
+def spend_matrix(df: pd.DataFrame, start: date, days: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """User and category of every (user, category) series, and their (series x day) spend matrix"""
+    user_codes, users = pd.factorize(df["user_id"])
+    category_codes, categories = pd.factorize(df["category_name"])
+    keys, rows = np.unique(user_codes * len(categories) + category_codes, return_inverse=True)
+    offsets = (pd.to_datetime(df["day"]) - pd.Timestamp(start)).dt.days.to_numpy()
+
+    matrix = np.zeros((len(keys), days), dtype=np.float32)
+    matrix[rows, offsets] = df["spend"].to_numpy(dtype=np.float32)
+    return np.asarray(users)[keys // len(categories)], np.asarray(categories)[keys % len(categories)], matrix
+
+
+def _row_medians(values: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """Median of each row over the entries where mask is set, by one sort of the whole matrix"""
+    counts = mask.sum(axis=1)
+    ordered = np.sort(np.where(mask, values, np.inf), axis=1)
+    lower = np.take_along_axis(ordered, np.maximum(counts - 1, 0)[:, None] // 2, axis=1)[:, 0]
+    upper = np.take_along_axis(ordered, np.minimum(counts // 2, values.shape[1] - 1)[:, None], axis=1)[:, 0]
+    return (lower + upper) / 2
+
+
+def _robust_scale(deviations: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """MAD scaled to sigma; where it is 0 (mostly identical values), the mean absolute deviation instead"""
+    mad = _row_medians(deviations, mask) * 1.4826
+    mean_deviation = np.where(mask, deviations, 0).sum(axis=1) / np.maximum(mask.sum(axis=1), 1) * 1.2533
+    return np.where(mad > 0, mad, mean_deviation)
+
+
+def robust_spikes(
+    matrix: np.ndarray,
+    history_days: int,
+    threshold: float = ANOMALY_Z_THRESHOLD,
+    min_amount: float = ANOMALY_MIN_AMOUNT,
+    min_active_days: int = ANOMALY_MIN_ACTIVE_DAYS
+) -> Dict[str, np.ndarray]:
+    """Spikes in the recent days of every series at once; history_days is a multiple of 7"""
+    # A spike must stand out from the weekday baseline and from the user's usual purchase in the
+    # category, so an ordinary purchase in a category bought only now and then is not flagged
+    n_series = matrix.shape[0]
+    history, recent = matrix[:, :history_days], matrix[:, history_days:]
+    everywhere = np.ones_like(history, dtype=bool)
+
+    # Column j is weekday slot j % 7 in both the history and the recent days
+    weekly = history.reshape(n_series, history_days // 7, 7)
+    baseline = np.median(weekly, axis=1)
+    seasonal_scale = _robust_scale(np.abs(weekly - baseline[:, None, :]).reshape(n_series, history_days), everywhere)
+    expected = baseline[:, np.arange(history_days, matrix.shape[1]) % 7]
+
+    # Purchase sizes vary multiplicatively, so they are compared on a log scale
+    active = history > 0
+    log_history, log_recent = np.log1p(history), np.log1p(recent)
+    typical = _row_medians(log_history, active)
+    active_scale = _robust_scale(np.abs(log_history - typical[:, None]), active)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = (recent - expected) / seasonal_scale[:, None]
+        z_active = (log_recent - typical[:, None]) / active_scale[:, None]
+
+    eligible = active.sum(axis=1) >= min_active_days
+    flags = eligible[:, None] & (z >= threshold) & (z_active >= threshold) & (recent >= min_amount)
+    return {"flags": flags, "z": z, "expected": expected, "typical": np.expm1(typical)}
+
+
+class AnomalyEngine:
+    def __init__(self):
+        """Periodic bulk scan of every user's daily category spend for unusual spikes"""
+        self.db_service = db_service
+        self.history_days = ANOMALY_HISTORY_WEEKS * 7
+        self.days = self.history_days + ANOMALY_RECENT_DAYS
+
+        self._flags: Dict[str, List[Dict[str, Any]]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._stats = {
+            "scans": 0,
+            "users_scanned": 0,
+            "series_scanned": 0,
+            "flagged_users": 0,
+            "failed_chunks": 0,
+            "last_scan_seconds": None,
+            "last_scan_at": None
+        }
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        """Scan now and every ANOMALY_SCAN_INTERVAL_HOURS (call from lifespan startup)"""
+        if self.running or not ANOMALY_DETECTION_ENABLED or self.db_service is None:
+            return
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"✅ Anomaly detection started (every {ANOMALY_SCAN_INTERVAL_HOURS:g}h)")
+
+    async def stop(self):
+        """Stop scanning (call from lifespan shutdown)"""
+        if not self.running:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        logger.info("🛑 Anomaly detection stopped")
+
+    async def _run(self):
+        while True:
+            try:
+                await self.scan()
+            except Exception as e:
+                logger.warning(f"Anomaly scan failed: {e}")
+            await asyncio.sleep(ANOMALY_SCAN_INTERVAL_HOURS * 3600)
+
+    def _window(self) -> Tuple[date, date]:
+        end = date.today() + timedelta(days=1)
+        return end - timedelta(days=self.days), end
+
+    def _active_users(self, shard_name: str, start: date, end: date) -> List[str]:
+        df = self.db_service.execute_query(
+            ACTIVE_USERS_QUERY, {"start_date": start, "end_date": end},
+            read_only=True, lane=LANE_BACKGROUND, shard_name=shard_name
+        )
+        # Users still being copied off this shard by a rebalance are scanned on their owner only
+        return sorted(u for u in df["user_id"] if self.db_service.shard_for(u).name == shard_name)
+
+    def _fetch(self, shard_name: str, user_ids: List[str], start: date, end: date) -> pd.DataFrame:
+        return self.db_service.execute_query(
+            DAILY_CATEGORY_SPEND_QUERY, {"user_ids": user_ids, "start_date": start, "end_date": end},
+            read_only=True, lane=LANE_BACKGROUND, shard_name=shard_name
+        )
+
+    def detect(self, df: pd.DataFrame, start: date) -> Dict[str, List[Dict[str, Any]]]:
+        """Flagged spikes per user from daily per-category spend rows covering [start, start + days)"""
+        if df.empty:
+            return {}
+        users, categories, matrix = spend_matrix(df, start, self.days)
+        result = robust_spikes(matrix, self.history_days)
+        self._stats["series_scanned"] += len(users)
+
+        flags: Dict[str, List[Dict[str, Any]]] = {}
+        for s, r in zip(*np.nonzero(result["flags"])):
+            flags.setdefault(users[s], []).append({
+                "category_name": categories[s],
+                "date": start + timedelta(days=self.history_days + int(r)),
+                "amount": float(matrix[s, self.history_days + r]),
+                "expected": float(result["expected"][s, r]),
+                "typical_amount": float(result["typical"][s]),
+                "z_score": round(float(result["z"][s, r]), 2)
+            })
+        return {
+            user_id: sorted(user_flags, key=lambda f: f["z_score"], reverse=True)[:MAX_FLAGS_PER_USER]
+            for user_id, user_flags in flags.items()
+        }
+
+    async def scan(self) -> int:
+        """Rescan every shard in bulk chunks; returns the number of flagged users"""
+        started = time.perf_counter()
+        start, end = self._window()
+        flags: Dict[str, List[Dict[str, Any]]] = {}
+        users = 0
+        self._stats["series_scanned"] = 0
+
+        for shard_name in self.db_service.shards:
+            user_ids = await run_in_executor(self._active_users, shard_name, start, end)
+            users += len(user_ids)
+            for i in range(0, len(user_ids), ANOMALY_CHUNK_USERS):
+                chunk = user_ids[i:i + ANOMALY_CHUNK_USERS]
+                try:
+                    df = await run_in_executor(self._fetch, shard_name, chunk, start, end)
+                    flags.update(await run_in_executor(self.detect, df, start))
+                except Exception as e:
+                    self._stats["failed_chunks"] += 1
+                    logger.warning(f"Anomaly scan of {len(chunk)} users on shard {shard_name} failed: {e}")
+
+        # Swap in one go so readers never see a half-finished scan
+        self._flags = flags
+        elapsed = time.perf_counter() - started
+        self._stats.update({
+            "scans": self._stats["scans"] + 1,
+            "users_scanned": users,
+            "flagged_users": len(flags),
+            "last_scan_seconds": round(elapsed, 2),
+            "last_scan_at": datetime.now().isoformat(timespec="seconds")
+        })
+        logger.info(f"🚨 Anomaly scan: {len(flags)}/{users} users flagged in {elapsed:.1f}s")
+        return len(flags)
+
+    def flags_for(self, user_id: str, start: Optional[date] = None, end: Optional[date] = None) -> List[Dict[str, Any]]:
+        """The user's flagged spikes from the last scan, optionally within [start, end)"""
+        return [
+            flag for flag in self._flags.get(user_id, [])
+            if (start is None or flag["date"] >= start) and (end is None or flag["date"] < end)
+        ]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self._stats, "running": self.running}
+
+
+# Global instance
+anomaly_engine = AnomalyEngine()
@@ -0,0 +1,237 @@
+import os
+import time
+import logging
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+from app.utils.slots import extract_slots, normalize_question
+from app.agents.intent_router import detect_intents_by_keywords
+from app.database.unit_of_work import run_in_executor
+
+logger = logging.getLogger(__name__)
+
+
+# Intents that name what is being measured; paraphrases never switch between them
+_SUBJECT_INTENTS = ("spending_analysis", "income_analysis", "savings_analysis")
+
+# Words that flip the meaning of otherwise near-identical questions
+_CONTRAST_MARKERS = {
+    "max": ("lớn nhất", "nhiều nhất", "cao nhất", "largest", "biggest", "most", "highest"),
+    "min": ("nhỏ nhất", "ít nhất", "thấp nhất", "smallest", "least", "lowest"),
+    "per_day": ("mỗi ngày", "hàng ngày", "daily", "per day"),
+    "per_week": ("mỗi tuần", "hàng tuần", "weekly", "per week"),
+    "per_month": ("mỗi tháng", "hàng tháng", "monthly", "per month"),
+    "unusual": ("bất thường", "unusual", "anomal"),
+}
+
+
+def question_signature(question: str) -> Dict[str, Any]:
+    """Slots, measured subject and contrast markers that a reused answer must agree on"""
+    slots = extract_slots(question)
+    window = slots.get("time_window") or {}
+    text = normalize_question(question)
+    return {
+        "window": (window.get("kind"), window.get("unit"), window.get("offset", window.get("count"))),
+        "category": (slots.get("category") or "").lower() or None,
+        "payee": (slots.get("payee") or "").lower() or None,
+        "subjects": frozenset(i for i in detect_intents_by_keywords(question) if i in _SUBJECT_INTENTS),
+        "markers": frozenset(
+            marker for marker, words in _CONTRAST_MARKERS.items()
+            if any(word in text for word in words)
+        ),
+    }
+
+
+def signatures_compatible(a: Dict[str, Any], b: Dict[str, Any]) -> bool:
+    """Same period, category, payee and markers; subjects may only differ when one is unstated"""
+    if (a["window"], a["category"], a["payee"], a["markers"]) != (b["window"], b["category"], b["payee"], b["markers"]):
+        return False
+    if a["subjects"] and b["subjects"] and not (a["subjects"] & b["subjects"]):
+        return False
+    return True
+
+
+def should_reuse(similarity: float, signature_a: Dict[str, Any], signature_b: Dict[str, Any], threshold: float) -> bool:
+    """The reuse rule SemanticAnswerCache.lookup applies, for offline precision checks"""
+    return similarity >= threshold and signatures_compatible(signature_a, signature_b)
+
+
+class SemanticAnswerCache:
+    def __init__(
+        self,
+        embeddings=None,
+        data_versions=None,
+        similarity_threshold: float = None,
+        max_users: int = None,
+        max_entries_per_user: int = None,
+        ttl_seconds: int = None
+    ):
+        """Per-user cache of final answers, keyed by question embedding and data version"""
+        self.embeddings = embeddings
+        self.data_versions = data_versions
+        self.similarity_threshold = similarity_threshold if similarity_threshold is not None else float(
+            os.getenv("ANSWER_CACHE_SIMILARITY", "0.92")
+        )
+        self.max_users = max_users or int(os.getenv("ANSWER_CACHE_MAX_USERS", "2000"))
+        self.max_entries_per_user = max_entries_per_user or int(os.getenv("ANSWER_CACHE_ENTRIES_PER_USER", "50"))
+        self.ttl_seconds = ttl_seconds or int(os.getenv("ANSWER_CACHE_TTL_SECONDS", "86400"))
+
+        self._users: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._stats = {
+            "hits": 0,
+            "semantic_hits": 0,
+            "misses": 0,
+            "stale": 0,
+            "signature_mismatches": 0,
+            "stores": 0
+        }
+
+    async def _embed(self, question: str) -> Optional[np.ndarray]:
+        if self.embeddings is None:
+            return None
+        try:
+            return np.asarray(await self.embeddings.embed_text(question), dtype=np.float32)
+        except Exception as e:
+            logger.warning(f"Answer cache embedding failed: {e}")
+            return None
+
+    async def _version(self, user_id: str) -> Optional[str]:
+        if self.data_versions is None:
+            return None
+        return await run_in_executor(self.data_versions.get, user_id)
+
+    def _nearest(self, bucket: Dict[str, Any], embedding: np.ndarray) -> Tuple[Optional[int], float]:
+        """Index and similarity of the most similar cached question of this user"""
+        entries = bucket["entries"]
+        if not entries or embedding is None:
+            return None, 0.0
+        if bucket["matrix"] is None:
+            bucket["matrix"] = np.vstack([entry["embedding"] for entry in entries])
+        similarities = bucket["matrix"] @ embedding
+        best = int(np.argmax(similarities))
+        return best, float(similarities[best])
+
+    async def lookup(self, user_id: str, question: str, embedding: Optional[List[float]] = None) -> Dict[str, Any]:
+        """Return a stored answer when a compatible paraphrase was answered on the current data version"""
+        key = normalize_question(question)
+        signature = question_signature(question)
+        version = await self._version(user_id)
+        if embedding is not None:
+            embedding = np.asarray(embedding, dtype=np.float32)
+
+        bucket = self._users.get(user_id)
+        match = None
+        similarity = 1.0
+
+        if bucket is not None and version is not None:
+            match = next((i for i, entry in enumerate(bucket["entries"]) if entry["question"] == key), None)
+            if match is None:
+                if embedding is None:
+                    embedding = await self._embed(question)
+                candidate, similarity = self._nearest(bucket, embedding)
+                if candidate is not None and similarity >= self.similarity_threshold:
+                    if signatures_compatible(signature, bucket["entries"][candidate]["signature"]):
+                        match = candidate
+                    else:
+                        self._stats["signature_mismatches"] += 1
+
+        miss = {"hit": False, "embedding": embedding, "signature": signature, "version": version}
+        if match is None:
+            self._stats["misses"] += 1
+            return miss
+
+        entry = bucket["entries"][match]
+        if entry["version"] != version or time.time() - entry["created_at"] > self.ttl_seconds:
+            self._stats["stale"] += 1
+            self._stats["misses"] += 1
+            return miss
+
+        self._users.move_to_end(user_id)
+        entry["hits"] += 1
+        self._stats["hits"] += 1
+        if entry["question"] != key:
+            self._stats["semantic_hits"] += 1
+
+        return {
+            "hit": True,
+            "result": entry["result"],
+            "matched_question": entry["question"],
+            "similarity": round(similarity, 4)
+        }
+
+    async def store(
+        self,
+        user_id: str,
+        question: str,
+        result: Dict[str, Any],
+        embedding: Optional[np.ndarray] = None,
+        signature: Optional[Dict[str, Any]] = None,
+        version: Optional[str] = None
+    ):
+        """Remember a successful answer; versionless answers are never reusable"""
+        if version is None:
+            return
+        if embedding is None:
+            embedding = await self._embed(question)
+        if embedding is None:
+            return
+
+        embedding = np.asarray(embedding, dtype=np.float32)
+        key = normalize_question(question)
+        bucket = self._users.setdefault(user_id, {"entries": [], "matrix": None})
+        self._users.move_to_end(user_id)
+
+        entries: List[Dict[str, Any]] = [entry for entry in bucket["entries"] if entry["question"] != key]
+        entries.append({
+            "question": key,
+            "embedding": embedding,
+            "signature": signature if signature is not None else question_signature(question),
+            "version": version,
+            "result": result,
+            "created_at": time.time(),
+            "hits": 0
+        })
+        bucket["entries"] = entries[-self.max_entries_per_user:]
+        bucket["matrix"] = None
+        self._stats["stores"] += 1
+
+        while len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+
+    def invalidate_user(self, user_id: str):
+        """Forget every answer of one user"""
+        self._users.pop(user_id, None)
+
+    def clear(self):
+        """Clear all answers"""
+        self._users.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get cache statistics"""
+        lookups = self._stats["hits"] + self._stats["misses"]
+        return {
+            "users": len(self._users),
+            "answers": sum(len(bucket["entries"]) for bucket in self._users.values()),
+            "hit_rate": round(self._stats["hits"] / lookups, 3) if lookups else 0,
+            **self._stats
+        }
+
+
+# Global answer cache instance
+answer_cache = None
+
+
+def get_answer_cache() -> SemanticAnswerCache:
+    """Get answer cache instance with lazy initialization"""
+    global answer_cache
+    if answer_cache is None:
+        try:
+            from app.embeddings import embeddings_service
+        except Exception as e:
+            logger.warning(f"Embeddings unavailable for answer cache: {e}")
+            embeddings_service = None
+        from app.services.data_version import user_data_versions
+        answer_cache = SemanticAnswerCache(embeddings=embeddings_service, data_versions=user_data_versions)
+    return answer_cache
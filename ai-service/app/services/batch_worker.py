@@ -0,0 +1,103 @@
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class BatchWorker:
+    def __init__(
+        self,
+        handle_batch: Callable[[List[Any]], Awaitable[None]],
+        batch_size: int,
+        flush_interval: float,
+        max_queue_size: int
+    ):
+        """Bounded queue drained by one task in batches of batch_size items or flush_interval seconds"""
+        self.handle_batch = handle_batch
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue_size = max_queue_size
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    @property
+    def accepting(self) -> bool:
+        """Running and not shutting down, so put() buffers or drops instead of refusing"""
+        return self.running and not self._stopping
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    async def start(self):
+        """Start the background task"""
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Hand everything still queued to handle_batch, then stop"""
+        if not self.running:
+            return
+        self._stopping = True
+        await self._task
+        self._task = None
+
+    def put_nowait(self, item: Any) -> bool:
+        """Queue one item; False when not accepting or full"""
+        if not self.accepting:
+            return False
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    async def put(self, item: Any, timeout: float) -> bool:
+        """Queue one item, waiting up to timeout seconds for room; False when dropped"""
+        if not self.accepting:
+            return False
+        try:
+            await asyncio.wait_for(self._queue.put(item), timeout=timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def _run(self):
+        while True:
+            batch = await self._collect_batch()
+            if batch:
+                await self.handle_batch(batch)
+            elif self._stopping and self._queue.empty():
+                return
+
+    async def _collect_batch(self) -> List[Any]:
+        batch: List[Any] = []
+        deadline = time.monotonic() + self.flush_interval
+
+        while len(batch) < self.batch_size:
+            if self._stopping:
+                # Drain without waiting
+                while not self._queue.empty() and len(batch) < self.batch_size:
+                    batch.append(self._queue.get_nowait())
+                break
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
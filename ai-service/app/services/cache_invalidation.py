@@ -0,0 +1,219 @@
+import os
+import asyncio
+import logging
+from datetime import date
+from typing import Dict, Any, List, Callable, Set, Optional, Tuple
+
+from app.database.database import db_service
+from app.database.migrations import USER_DATA_CHANNEL, USER_DATA_PAYLOAD_SEPARATOR
+from app.services.data_version import user_data_versions
+
+logger = logging.getLogger(__name__)
+
+CACHE_INVALIDATION_ENABLED = os.getenv("CACHE_INVALIDATION_ENABLED", "true").lower() == "true"
+
+# An idle listener checks its session this often so a dead connection is noticed
+LISTENER_HEARTBEAT_SECONDS = float(os.getenv("CACHE_INVALIDATION_HEARTBEAT_SECONDS", "30"))
+
+LISTENER_MAX_RECONNECT_SECONDS = 60.0
+
+
+class CacheInvalidationListener:
+    def __init__(self, channel: str = USER_DATA_CHANNEL):
+        """LISTEN on every shard and evict a user's cached artefacts when their data changes"""
+        self.db_service = db_service
+        self.versions = user_data_versions
+        self.channel = channel
+
+        self._tasks: List[asyncio.Task] = []
+        self._connected: Set[str] = set()
+        self._subscribers: List[Callable[[str], None]] = []
+        self._stats = {"notifications": 0, "resets": 0, "reconnects": 0, "errors": 0}
+
+    @property
+    def running(self) -> bool:
+        return any(not task.done() for task in self._tasks)
+
+    def subscribe(self, callback: Callable[[Optional[str]], None]):
+        """Call back with the changed user id, or None when every user must be treated as changed"""
+        self._subscribers.append(callback)
+
+    async def start(self):
+        """Start one listener per shard (call from lifespan startup)"""
+        if self.running or not CACHE_INVALIDATION_ENABLED or self.db_service is None:
+            return
+        if self.db_service.engine.dialect.driver != "psycopg2":
+            logger.warning(f"⚠️ Cache invalidation needs psycopg2, not {self.db_service.engine.dialect.driver}; caches stay time-based")
+            return
+        self._tasks = [
+            asyncio.create_task(self._listen(name, shard.engine))
+            for name, shard in self.db_service.shards.items()
+        ]
+        logger.info(f"✅ Cache invalidation listening on '{self.channel}' across {len(self._tasks)} shard(s)")
+
+    async def stop(self):
+        """Stop listening (call from lifespan shutdown)"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._connected.clear()
+        self.versions.listening = False
+        logger.info("🛑 Cache invalidation listener stopped")
+
+    def _connect(self, engine):
+        raw = engine.raw_connection()
+        # A dedicated session: LISTEN state must never go back to the pool
+        raw.detach()
+        conn = raw.driver_connection
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute(f"LISTEN {self.channel}")
+        return raw
+
+    def _ping(self, conn):
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+
+    async def _listen(self, name: str, engine):
+        loop = asyncio.get_event_loop()
+        delay = 1.0
+        while True:
+            raw = None
+            try:
+                raw = await loop.run_in_executor(None, self._connect, engine)
+                conn = raw.driver_connection
+                self._set_connected(name, True)
+                delay = 1.0
+
+                ready = asyncio.Event()
+                loop.add_reader(conn.fileno(), ready.set)
+                try:
+                    while True:
+                        try:
+                            await asyncio.wait_for(ready.wait(), LISTENER_HEARTBEAT_SECONDS)
+                        except asyncio.TimeoutError:
+                            await loop.run_in_executor(None, self._ping, conn)
+                        ready.clear()
+                        conn.poll()
+                        while conn.notifies:
+                            self._handle(*self._parse(conn.notifies.pop(0).payload))
+                finally:
+                    loop.remove_reader(conn.fileno())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._stats["errors"] += 1
+                logger.warning(f"⚠️ Cache invalidation listener on shard {name} lost: {e}")
+            finally:
+                self._set_connected(name, False)
+                if raw is not None:
+                    try:
+                        raw.close()
+                    except Exception:
+                        pass
+
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, LISTENER_MAX_RECONNECT_SECONDS)
+            self._stats["reconnects"] += 1
+
+    def _set_connected(self, name: str, connected: bool):
+        if connected:
+            self._connected.add(name)
+            # Changes made while this shard was not listened to were missed
+            self._handle(None)
+        else:
+            self._connected.discard(name)
+        self.versions.listening = len(self._connected) == len(self.db_service.shards)
+
+    def _parse(self, payload: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """User id of a notification, plus the row when it announces a single inserted transaction"""
+        fields = payload.split(USER_DATA_PAYLOAD_SEPARATOR)
+        if len(fields) != 5:
+            return payload, None
+        user_id, row_id, day, amount, category_id = fields
+        try:
+            inserted = {"id": row_id, "day": date.fromisoformat(day), "amount": float(amount), "category_id": category_id or None}
+        except ValueError:
+            inserted = None
+        return user_id, inserted
+
+    def _handle(self, user_id: Optional[str], inserted: Optional[Dict[str, Any]] = None):
+        """Evict one user's cached artefacts, or everyone's when user_id is None"""
+        if user_id is None:
+            self._stats["resets"] += 1
+            self.versions.reset()
+        else:
+            self._stats["notifications"] += 1
+            self.versions.bump(user_id)
+            # Keep the user's reads on the primary until replicas have applied the change
+            self.db_service.mark_write(user_id)
+
+        _evict_answers(user_id)
+        _evict_workflow_context(user_id)
+        _evict_precomputed(user_id)
+        _update_aggregate_cube(user_id, inserted)
+        for callback in self._subscribers:
+            try:
+                callback(user_id)
+            except Exception as e:
+                logger.warning(f"Cache invalidation subscriber failed: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Notification counters and which shards are being listened to"""
+        return {
+            **self._stats,
+            "running": self.running,
+            "channel": self.channel,
+            "connected_shards": sorted(self._connected),
+            "data_versions": self.versions.get_stats()
+        }
+
+
+def _evict_answers(user_id: Optional[str]):
+    from app.services import answer_cache
+    if answer_cache.answer_cache is None:
+        return
+    if user_id is None:
+        answer_cache.answer_cache.clear()
+    else:
+        answer_cache.answer_cache.invalidate_user(user_id)
+
+
+def _evict_workflow_context(user_id: Optional[str]):
+    from app.workflows import financial_analysis
+    if financial_analysis.workflow is None:
+        return
+    if user_id is None:
+        financial_analysis.workflow.clear_cache()
+    else:
+        financial_analysis.workflow.invalidate_user(user_id)
+
+
+def _evict_precomputed(user_id: Optional[str]):
+    from app.agents import precomputed_results
+    if precomputed_results.precomputed_results is None:
+        return
+    if user_id is None:
+        precomputed_results.precomputed_results.clear()
+    else:
+        precomputed_results.precomputed_results.invalidate_user(user_id)
+
+
+def _update_aggregate_cube(user_id: Optional[str], inserted: Optional[Dict[str, Any]]):
+    from app.agents import aggregate_cube
+    if aggregate_cube.aggregate_cube_cache is None:
+        return
+    if user_id is None:
+        aggregate_cube.aggregate_cube_cache.clear()
+    elif inserted is not None:
+        # A new transaction is added to the cube in place; anything else needs a rebuild
+        aggregate_cube.aggregate_cube_cache.apply_insert(
+            user_id, inserted["day"], inserted["amount"], inserted["category_id"], inserted["id"]
+        )
+    else:
+        aggregate_cube.aggregate_cube_cache.invalidate_user(user_id)
+
+
+# Global instance
+cache_invalidation = CacheInvalidationListener()
@@ -1,16 +1,25 @@
-import json
+import os
 from datetime import datetime, timedelta
 from typing import Dict, List, Any
 from sqlalchemy import text
 from app.database.database import db_service
+from app.database.unit_of_work import run_in_executor
+from app.services.conversation_writer import conversation_writer
+from app.services.conversation_memory import conversation_memory
+from app.services.conversation_payloads import unpack_analysis_data
+from app.services.topic_stats import get_topic_stats
 import logging
 
 logger = logging.getLogger(__name__)
 
+# History reads stay within recent monthly partitions
+HISTORY_LOOKBACK_DAYS = int(os.getenv("CONVERSATION_HISTORY_LOOKBACK_DAYS", "90"))
+
 class ContextService:
     def __init__(self):
         self.db_service = db_service
-        self._table_created = False
+        self.writer = conversation_writer
+        self.memory = conversation_memory
 
     async def save_conversation(
         self,
@@ -19,52 +28,54 @@ class ContextService:
         response: str,
         analysis_data: Dict[str, Any] = None
     ):
-        """Save conversation to database with auto table creation"""
-        try:
-            if not self._table_created:
-                await self._ensure_conversation_table_exists()
-                self._table_created = True
+        """Save conversation via the write-behind queue, directly if it is not running"""
+        record = {
+            "user_id": user_id,
+            "question": question,
+            "response": response,
+            "analysis_data": analysis_data,
+            "created_at": datetime.now()
+        }
+        # Semantic indexing happens off the request path in batches
+        self.memory.enqueue(record)
+
+        if self.writer.accepting:
+            # A queue still full after the bounded wait drops the record and counts it
+            await self.writer.enqueue(record)
+            return
 
-            query = text("""
-                INSERT INTO conversation_history (
-                    user_id, question, response, analysis_data, created_at
-                ) VALUES (
-                    :user_id, :question, :response, :analysis_data, :created_at
-                )
-            """)
-
-            with self.db_service.engine.connect() as conn:
-                conn.execute(query, {
-                    "user_id": user_id,
-                    "question": question,
-                    "response": response,
-                    "analysis_data": json.dumps(analysis_data) if analysis_data else None,
-                    "created_at": datetime.now()
-                })
-                conn.commit()
+        try:
+            await run_in_executor(self.writer.insert_records, [record])
 
             logger.info(f"Saved conversation for user {user_id}")
         except Exception as e:
             logger.error(f"Error saving conversation: {e}")
 
-    async def get_conversation_history(self, user_id: str, limit: int = 10) -> List[Dict[str, Any]]:
-        """Get conversation history for user"""
+    async def get_conversation_history(
+        self,
+        user_id: str,
+        limit: int = 10,
+        lookback_days: int = None
+    ) -> List[Dict[str, Any]]:
+        """Get recent conversation history; the date bound prunes old partitions"""
         try:
-            if not self._table_created:
-                await self._ensure_conversation_table_exists()
-                self._table_created = True
+            lookback_days = lookback_days or HISTORY_LOOKBACK_DAYS
 
             query = text("""
-                SELECT question, response, analysis_data, created_at
-                FROM conversation_history
-                WHERE user_id = :user_id
-                ORDER BY created_at DESC
+                SELECT h.question, h.response,
+                       COALESCE(p.analysis_data, h.analysis_data), p.markdown, h.created_at
+                FROM conversation_history h
+                LEFT JOIN conversation_payloads p ON p.hash = h.payload_hash
+                WHERE h.user_id = :user_id
+                AND h.created_at >= :since
+                ORDER BY h.created_at DESC
                 LIMIT :limit
             """)
 
-            with self.db_service.engine.connect() as conn:
+            with self.db_service.read_connection(user_id) as conn:
                 result = conn.execute(query, {
                     "user_id": user_id,
+                    "since": datetime.now() - timedelta(days=lookback_days),
                     "limit": limit
                 })
 
@@ -73,8 +84,8 @@ class ContextService:
                     conv = {
                         "question": row[0],
                         "response": row[1],
-                        "analysis_data": json.loads(row[2]) if row[2] else None,
-                        "created_at": row[3].isoformat() if row[3] else None
+                        "analysis_data": unpack_analysis_data(row[2], row[3]),
+                        "created_at": row[4].isoformat() if row[4] else None
                     }
                     conversations.append(conv)
 
@@ -84,75 +95,45 @@ class ContextService:
             return []
 
     async def get_user_patterns(self, user_id: str, days: int = 30) -> Dict[str, Any]:
-        """Analyze user conversation patterns"""
+        """Analyze user conversation patterns from incrementally maintained topic counters"""
         try:
-            conversations = await self.get_conversation_history(user_id, limit=50)
-
-            patterns = {
-                "frequent_topics": [],
-                "common_questions": [],
+            stats = await run_in_executor(get_topic_stats, user_id, days, 5)
+            topics = [topic["term"].replace("_", " ") for topic in stats["topics"]]
+            questions = await run_in_executor(self._recent_questions, user_id, days, 5)
+
+            return {
+                "frequent_topics": topics,
+                "common_questions": questions,
+                "topic_scores": stats["topics"],
                 "user_interests": [],
-                "interaction_frequency": 0
+                "interaction_frequency": stats["interactions"] / days
             }
-
-            if not conversations:
-                return patterns
-
-            recent_conversations = [
-                c for c in conversations 
-                if c["created_at"] and 
-                datetime.fromisoformat(c["created_at"]) > datetime.now() - timedelta(days=days)
-            ]
-
-            patterns["interaction_frequency"] = len(recent_conversations) / days
-
-            questions = [c["question"] for c in recent_conversations if c["question"]]
-
-            keywords = {}
-            for question in questions:
-                words = question.lower().split()
-                for word in words:
-                    if len(word) > 3:
-                        keywords[word] = keywords.get(word, 0) + 1
-
-            sorted_keywords = sorted(keywords.items(), key=lambda x: x[1], reverse=True)
-            patterns["frequent_topics"] = [kw[0] for kw in sorted_keywords[:5]]
-
-            patterns["common_questions"] = questions[:5]
-
-            return patterns
         except Exception as e:
             logger.error(f"Error analyzing user patterns: {e}")
             return {}
 
-    async def _ensure_conversation_table_exists(self):
-        """Ensure conversation history table exists"""
-        try:
-            create_table_query = text("""
-                CREATE TABLE IF NOT EXISTS conversation_history (
-                    id SERIAL PRIMARY KEY,
-                    user_id TEXT NOT NULL,
-                    question TEXT NOT NULL,
-                    response TEXT NOT NULL,
-                    analysis_data JSONB,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                );
-                CREATE INDEX IF NOT EXISTS idx_conversation_user_created
-                ON conversation_history (user_id, created_at DESC);
-            """)
-
-            with self.db_service.engine.connect() as conn:
-                conn.execute(create_table_query)
-                conn.commit()
-
-            logger.info("✅ conversation_history table ensured")
-        except Exception as e:
-            logger.error(f"Error creating conversation table: {e}")
+    def _recent_questions(self, user_id: str, days: int, limit: int) -> List[str]:
+        """The user's latest questions; an index range scan over the recent partitions only"""
+        query = text("""
+            SELECT h.question
+            FROM conversation_history h
+            WHERE h.user_id = :user_id
+            AND h.created_at >= :since
+            ORDER BY h.created_at DESC
+            LIMIT :limit
+        """)
+        with self.db_service.read_connection(user_id) as conn:
+            result = conn.execute(query, {
+                "user_id": user_id,
+                "since": datetime.now() - timedelta(days=days),
+                "limit": limit
+            })
+            return [row[0] for row in result if row[0]]
 
     async def _execute_query(self, query, params=None):
         """Execute database query"""
         try:
-            with self.db_service.engine.connect() as conn:
+            with self.db_service.engine_for((params or {}).get("user_id")).connect() as conn:
                 if params:
                     result = conn.execute(query, params)
                 else:
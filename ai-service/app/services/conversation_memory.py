@@ -0,0 +1,215 @@
+import os
+import time
+import asyncio
+import hashlib
+import logging
+from collections import deque
+from typing import Dict, Any, List, Optional
+
+from app.services.batch_worker import BatchWorker
+
+logger = logging.getLogger(__name__)
+
+# Rough chars-per-token ratio used to keep retrieved context within budget
+CHARS_PER_TOKEN = 4
+
+# Answers are stored truncated; only the gist is useful as context
+MAX_ANSWER_CHARS = 600
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+class ConversationMemory:
+    def __init__(
+        self,
+        embeddings=None,
+        batch_size: int = None,
+        flush_interval_ms: int = None,
+        max_queue_size: int = None,
+        top_k: int = None,
+        token_budget: int = None,
+        min_similarity: float = None
+    ):
+        """Per-user semantic index of past exchanges, filled by a background batch indexer"""
+        self._embeddings = embeddings
+        self.batch_size = batch_size or int(os.getenv("CONVERSATION_MEMORY_BATCH_SIZE", "32"))
+        self.flush_interval = (flush_interval_ms or int(os.getenv("CONVERSATION_MEMORY_FLUSH_INTERVAL_MS", "1000"))) / 1000
+        self.max_queue_size = max_queue_size or int(os.getenv("CONVERSATION_MEMORY_QUEUE_SIZE", "2000"))
+        self.top_k = top_k or int(os.getenv("CONVERSATION_MEMORY_TOP_K", "3"))
+        self.token_budget = token_budget or int(os.getenv("CONVERSATION_MEMORY_TOKEN_BUDGET", "400"))
+        self.min_similarity = min_similarity or float(os.getenv("CONVERSATION_MEMORY_MIN_SIMILARITY", "0.6"))
+
+        self._collection = None
+        self._worker = BatchWorker(self._index_batch, self.batch_size, self.flush_interval, self.max_queue_size)
+
+        self._index_latencies_ms = deque(maxlen=200)
+        self._stats = {
+            "enqueued": 0,
+            "indexed": 0,
+            "dropped": 0,
+            "failed": 0,
+            "batches": 0,
+            "retrievals": 0,
+            "retrieved": 0
+        }
+
+    @property
+    def embeddings(self):
+        if self._embeddings is None:
+            from app.embeddings import embeddings_service
+            self._embeddings = embeddings_service
+        return self._embeddings
+
+    @property
+    def collection(self):
+        """Chroma HNSW collection; every entry carries its user_id for filtered search"""
+        if self._collection is None and self.embeddings and self.embeddings.chroma_client:
+            self._collection = self.embeddings.chroma_client.get_or_create_collection(
+                name="conversation_memory",
+                metadata={
+                    "description": "Past question/answer exchanges per user",
+                    "hnsw:space": "cosine"
+                }
+            )
+        return self._collection
+
+    @property
+    def running(self) -> bool:
+        return self._worker.running
+
+    async def start(self):
+        """Start the background indexer (call from lifespan startup)"""
+        if self.running:
+            return
+        await self._worker.start()
+        logger.info(f"✅ Conversation memory indexer started (batch {self.batch_size})")
+
+    async def stop(self):
+        """Index everything still queued and stop (call from lifespan shutdown)"""
+        if not self.running:
+            return
+        await self._worker.stop()
+        logger.info(f"🛑 Conversation memory indexer stopped ({self._stats['indexed']} exchanges indexed)")
+
+    def enqueue(self, record: Dict[str, Any]) -> bool:
+        """Queue one exchange for indexing; never waits, drops when full"""
+        if not self._worker.accepting or not record.get("response"):
+            return False
+        if not self._worker.put_nowait(record):
+            self._stats["dropped"] += 1
+            return False
+        self._stats["enqueued"] += 1
+        return True
+
+    async def _index_batch(self, batch: List[Dict[str, Any]]):
+        """Embed a batch of questions in one encode call and upsert into the index"""
+        started = time.perf_counter()
+        try:
+            collection = self.collection
+            if collection is None:
+                self._stats["dropped"] += len(batch)
+                return
+
+            vectors = await self.embeddings.embed_texts([r["question"] for r in batch])
+
+            ids, documents, metadatas = [], [], []
+            for record in batch:
+                created_at = str(record.get("created_at") or "")
+                ids.append(hashlib.sha1(
+                    f"{record['user_id']}|{created_at}|{record['question']}".encode("utf-8")
+                ).hexdigest())
+                documents.append(record["question"])
+                metadatas.append({
+                    "user_id": record["user_id"],
+                    "answer": record["response"][:MAX_ANSWER_CHARS],
+                    "created_at": created_at
+                })
+
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(None, lambda: collection.upsert(
+                ids=ids,
+                embeddings=vectors.tolist(),
+                documents=documents,
+                metadatas=metadatas
+            ))
+            self._stats["indexed"] += len(batch)
+        except Exception as e:
+            self._stats["failed"] += len(batch)
+            logger.error(f"Error indexing {len(batch)} conversations: {e}")
+        finally:
+            self._stats["batches"] += 1
+            self._index_latencies_ms.append((time.perf_counter() - started) * 1000)
+
+    async def retrieve(
+        self,
+        user_id: str,
+        question: str,
+        top_k: int = None,
+        token_budget: int = None,
+        embedding: Optional[List[float]] = None
+    ) -> List[Dict[str, Any]]:
+        """Most similar past exchanges of this user that fit in the token budget"""
+        collection = self.collection
+        if collection is None:
+            return []
+
+        top_k = top_k or self.top_k
+        budget = token_budget or self.token_budget
+
+        try:
+            if embedding is None:
+                embedding = await self.embeddings.embed_text(question)
+            loop = asyncio.get_event_loop()
+            results = await loop.run_in_executor(None, lambda: collection.query(
+                query_embeddings=[list(embedding)],
+                n_results=top_k,
+                where={"user_id": user_id}
+            ))
+        except Exception as e:
+            logger.warning(f"Conversation memory lookup failed: {e}")
+            return []
+
+        self._stats["retrievals"] += 1
+        exchanges = []
+        used = 0
+        if results.get("documents") and results["documents"][0]:
+            for doc, meta, distance in zip(
+                results["documents"][0],
+                results["metadatas"][0],
+                results["distances"][0]
+            ):
+                similarity = 1 - distance
+                if similarity < self.min_similarity:
+                    continue
+                cost = estimate_tokens(doc) + estimate_tokens(meta.get("answer", ""))
+                if used + cost > budget:
+                    break
+                used += cost
+                exchanges.append({
+                    "question": doc,
+                    "answer": meta.get("answer", ""),
+                    "created_at": meta.get("created_at"),
+                    "similarity": round(float(similarity), 3)
+                })
+
+        self._stats["retrieved"] += len(exchanges)
+        return exchanges
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Indexer queue and batch latency metrics"""
+        latencies = sorted(self._index_latencies_ms)
+        return {
+            **self._stats,
+            "running": self.running,
+            "queue_depth": self._worker.depth,
+            "index_latency_ms": {
+                "avg": round(sum(latencies) / len(latencies), 2) if latencies else 0,
+                "max": round(latencies[-1], 2) if latencies else 0
+            }
+        }
+
+
+# Global memory instance shared by ContextService and the workflow
+conversation_memory = ConversationMemory()
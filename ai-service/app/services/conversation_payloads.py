@@ -0,0 +1,43 @@
+import json
+import zlib
+import hashlib
+from typing import Dict, Any, Optional, Tuple
+
+# Markdown shorter than this is not worth a zlib header
+COMPRESSION_MIN_BYTES = 256
+
+
+def pack_analysis_data(analysis_data: Optional[Dict[str, Any]]) -> Optional[Tuple[str, str, Optional[bytes]]]:
+    """Split analysis_data into (content hash, JSON without markdown, compressed markdown)"""
+    if not analysis_data:
+        return None
+
+    canonical = json.dumps(analysis_data, sort_keys=True, default=str, ensure_ascii=False)
+    content_hash = hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    data = json.loads(canonical)
+    markdown = None
+    if isinstance(data.get("data"), dict):
+        markdown = data["data"].pop("markdown_response", None)
+
+    compressed = None
+    if markdown is not None:
+        raw = markdown.encode("utf-8")
+        compressed = b"z" + zlib.compress(raw, 6) if len(raw) >= COMPRESSION_MIN_BYTES else b"r" + raw
+
+    return content_hash, json.dumps(data, ensure_ascii=False), compressed
+
+
+def unpack_analysis_data(data: Any, markdown: Optional[bytes]) -> Optional[Dict[str, Any]]:
+    """Reassemble analysis_data from its stored JSON and compressed markdown"""
+    if data is None:
+        return None
+    if isinstance(data, str):
+        data = json.loads(data)
+
+    if markdown is not None and isinstance(data.get("data"), dict):
+        markdown = bytes(markdown)
+        body = zlib.decompress(markdown[1:]) if markdown[:1] == b"z" else markdown[1:]
+        data["data"]["markdown_response"] = body.decode("utf-8")
+
+    return data
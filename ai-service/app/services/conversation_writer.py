@@ -0,0 +1,178 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime
+from typing import Dict, Any, List
+
+from sqlalchemy import text
+from app.database.database import db_service
+from app.services.batch_worker import BatchWorker
+from app.services.conversation_payloads import pack_analysis_data
+from app.services.topic_stats import count_topic_terms, upsert_topic_stats
+
+logger = logging.getLogger(__name__)
+
+
+class ConversationWriter:
+    def __init__(
+        self,
+        batch_size: int = None,
+        flush_interval_ms: int = None,
+        max_queue_size: int = None,
+        enqueue_timeout_ms: int = None
+    ):
+        """Write-behind buffer that batches conversation_history inserts"""
+        self.db_service = db_service
+        self.batch_size = batch_size or int(os.getenv("CONVERSATION_BATCH_SIZE", "100"))
+        self.flush_interval = (flush_interval_ms or int(os.getenv("CONVERSATION_FLUSH_INTERVAL_MS", "500"))) / 1000
+        self.max_queue_size = max_queue_size or int(os.getenv("CONVERSATION_QUEUE_SIZE", "5000"))
+        self.enqueue_timeout = (enqueue_timeout_ms or int(os.getenv("CONVERSATION_ENQUEUE_TIMEOUT_MS", "50"))) / 1000
+
+        self._worker = BatchWorker(self._flush, self.batch_size, self.flush_interval, self.max_queue_size)
+
+        self._flush_latencies_ms = deque(maxlen=500)
+        self._batch_sizes = deque(maxlen=500)
+        self._stats = {
+            "enqueued": 0,
+            "written": 0,
+            "dropped": 0,
+            "failed": 0,
+            "flushes": 0,
+            "backpressure_waits": 0
+        }
+
+    @property
+    def running(self) -> bool:
+        return self._worker.running
+
+    @property
+    def accepting(self) -> bool:
+        """Running and not shutting down, so enqueue() buffers or drops instead of refusing"""
+        return self._worker.accepting
+
+    async def start(self):
+        """Start the background flusher (call from lifespan startup)"""
+        if self.running:
+            return
+        await self._worker.start()
+        logger.info(f"✅ Conversation writer started (batch {self.batch_size}, {self.flush_interval * 1000:.0f} ms)")
+
+    async def stop(self):
+        """Flush everything still buffered and stop (call from lifespan shutdown)"""
+        if not self.running:
+            return
+        await self._worker.stop()
+        logger.info(f"🛑 Conversation writer stopped ({self._stats['written']} records written)")
+
+    async def enqueue(self, record: Dict[str, Any]) -> bool:
+        """Buffer one record; waits briefly when full, then drops"""
+        if not self.accepting:
+            return False
+
+        if not self._worker.put_nowait(record):
+            # Backpressure: make the producer wait for the flusher to catch up
+            self._stats["backpressure_waits"] += 1
+            if not await self._worker.put(record, self.enqueue_timeout):
+                self._stats["dropped"] += 1
+                logger.warning("Conversation queue full, dropping record")
+                return False
+
+        self._stats["enqueued"] += 1
+        return True
+
+    async def _flush(self, batch: List[Dict[str, Any]]):
+        started = time.perf_counter()
+        try:
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(None, self._insert_batch, batch)
+            self._stats["written"] += len(batch)
+        except Exception as e:
+            self._stats["failed"] += len(batch)
+            logger.error(f"Error flushing {len(batch)} conversations: {e}")
+        finally:
+            self._stats["flushes"] += 1
+            self._flush_latencies_ms.append((time.perf_counter() - started) * 1000)
+            self._batch_sizes.append(len(batch))
+
+    def _insert_batch(self, batch: List[Dict[str, Any]]):
+        self.insert_records(batch)
+
+    def insert_records(self, records: List[Dict[str, Any]]):
+        """Write records to their users' shards, one transaction per shard"""
+        by_shard: Dict[str, List[Dict[str, Any]]] = {}
+        for record in records:
+            by_shard.setdefault(self.db_service.shard_for(record["user_id"]).name, []).append(record)
+        for name, shard_records in by_shard.items():
+            self._insert_shard_records(self.db_service.shards[name].engine, shard_records)
+
+        # Follow-up history reads of these users stay on the primary until replicas catch up
+        for user_id in {record["user_id"] for record in records}:
+            self.db_service.mark_write(user_id)
+
+    def _insert_shard_records(self, engine, records: List[Dict[str, Any]]):
+        """Multi-row INSERTs of payloads, history rows and topic counters in one transaction"""
+        payloads: Dict[str, tuple] = {}
+        rows = []
+        params: Dict[str, Any] = {}
+
+        for i, record in enumerate(records):
+            packed = pack_analysis_data(record.get("analysis_data"))
+            payload_hash = None
+            if packed is not None:
+                payload_hash = packed[0]
+                payloads[payload_hash] = packed
+
+            rows.append(f"(:user_id_{i}, :question_{i}, :response_{i}, :payload_hash_{i}, :created_at_{i})")
+            params[f"user_id_{i}"] = record["user_id"]
+            params[f"question_{i}"] = record["question"]
+            params[f"response_{i}"] = record["response"]
+            params[f"payload_hash_{i}"] = payload_hash
+            params[f"created_at_{i}"] = record.get("created_at") or datetime.now()
+
+        with engine.begin() as conn:
+            if payloads:
+                payload_rows = []
+                payload_params: Dict[str, Any] = {}
+                for j, (content_hash, data_json, markdown) in enumerate(payloads.values()):
+                    payload_rows.append(f"(:hash_{j}, :analysis_data_{j}, :markdown_{j})")
+                    payload_params[f"hash_{j}"] = content_hash
+                    payload_params[f"analysis_data_{j}"] = data_json
+                    payload_params[f"markdown_{j}"] = markdown
+                conn.execute(text(
+                    "INSERT INTO conversation_payloads (hash, analysis_data, markdown) VALUES "
+                    + ", ".join(payload_rows)
+                    + " ON CONFLICT (hash) DO NOTHING"
+                ), payload_params)
+
+            conn.execute(text(
+                "INSERT INTO conversation_history (user_id, question, response, payload_hash, created_at) VALUES "
+                + ", ".join(rows)
+            ), params)
+
+            upsert_topic_stats(conn, count_topic_terms(records))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Queue depth, flush latency and batch size metrics"""
+        latencies = sorted(self._flush_latencies_ms)
+        sizes = list(self._batch_sizes)
+        return {
+            **self._stats,
+            "running": self.running,
+            "queue_depth": self._worker.depth,
+            "queue_capacity": self.max_queue_size,
+            "flush_latency_ms": {
+                "avg": round(sum(latencies) / len(latencies), 2) if latencies else 0,
+                "p95": round(latencies[int(len(latencies) * 0.95) - 1], 2) if latencies else 0,
+                "max": round(latencies[-1], 2) if latencies else 0
+            },
+            "batch_size": {
+                "avg": round(sum(sizes) / len(sizes), 1) if sizes else 0,
+                "max": max(sizes) if sizes else 0
+            }
+        }
+
+
+# Global writer instance shared by all ContextService instances
+conversation_writer = ConversationWriter()
@@ -0,0 +1,104 @@
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+from datetime import date
+from typing import Optional, Tuple
+
+from sqlalchemy import text
+from app.database.database import db_service
+
+logger = logging.getLogger(__name__)
+
+# Users whose fingerprint and change sequence are kept in memory
+MAX_TRACKED_USERS = 10000
+
+
+class UserDataVersions:
+    def __init__(self, db_service=None):
+        """Cheap fingerprints of a user's transaction data for cache validation"""
+        self.db_service = db_service
+
+        # True while the invalidation listener receives change notifications from every shard
+        self.listening = False
+
+        self._versions: "OrderedDict[str, Tuple[str, str]]" = OrderedDict()  # user -> (day, version)
+        self._changes: "OrderedDict[str, int]" = OrderedDict()  # user -> sequence of its last change
+        self._sequence = 0
+        self._resets = 0
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "database_reads": 0, "bumps": 0}
+
+    def bump(self, user_id: str):
+        """A change notification arrived: the next get() reads a new version"""
+        with self._lock:
+            self._sequence += 1
+            self._changes[user_id] = self._sequence
+            self._changes.move_to_end(user_id)
+            while len(self._changes) > MAX_TRACKED_USERS:
+                self._changes.popitem(last=False)
+            self._versions.pop(user_id, None)
+            self._stats["bumps"] += 1
+
+    def reset(self):
+        """Notifications may have been missed: forget every remembered version"""
+        with self._lock:
+            self._sequence += 1
+            self._resets += 1
+            self._versions.clear()
+
+    def change_marker(self, user_id: str) -> tuple:
+        """Differs before and after any change notification for this user, or any reset"""
+        with self._lock:
+            return self._resets, self._changes.get(user_id, 0)
+
+    def get(self, user_id: str) -> Optional[str]:
+        """Version string that changes when the user's transactions or the day change"""
+        if self.db_service is None:
+            return None
+
+        today = date.today().isoformat()
+        with self._lock:
+            remembered = self._versions.get(user_id) if self.listening else None
+            if remembered is not None and remembered[0] == today:
+                self._stats["memory_hits"] += 1
+                return remembered[1]
+            sequence = self._sequence
+            change = self._changes.get(user_id, 0)
+
+        query = text("""
+            SELECT COUNT(t.id), COALESCE(SUM(t.amount), 0), MAX(t.date)
+            FROM transactions t
+            WHERE t.user_id = :user_id
+        """)
+
+        try:
+            # Inside a request this reads the same snapshot the analysis runs on
+            with self.db_service.user_connection(user_id) as conn:
+                count, total, latest = conn.execute(query, {"user_id": user_id}).one()
+        except Exception as e:
+            logger.warning(f"Could not read data version for user {user_id}: {e}")
+            return None
+
+        # Relative windows ("tháng này") mean yesterday's answer is stale even without writes;
+        # the change sequence covers edits the aggregates miss, such as a renamed category
+        fingerprint = f"{today}|{count}|{total}|{latest}|{change}"
+        version = hashlib.sha1(fingerprint.encode("utf-8")).hexdigest()[:16]
+
+        with self._lock:
+            self._stats["database_reads"] += 1
+            # A notification that arrived during the read makes this version stale already
+            if self.listening and self._sequence == sequence:
+                self._versions[user_id] = (today, version)
+                self._versions.move_to_end(user_id)
+                while len(self._versions) > MAX_TRACKED_USERS:
+                    self._versions.popitem(last=False)
+        return version
+
+    def get_stats(self):
+        with self._lock:
+            return {**self._stats, "listening": self.listening, "remembered_users": len(self._versions)}
+
+
+# Global instance
+user_data_versions = UserDataVersions(db_service)
@@ -75,7 +75,8 @@ class GrokService:
     ) -> List[Dict]:
         """Build minimal messages without repetition"""
 
-        context_key = f"{context.get('user_question', '')}_{hash(str(context.get('sql_data', {})))}"
+        history_key = hash(tuple(h.get('question', '') for h in context.get('relevant_history', [])))
+        context_key = f"{context.get('user_question', '')}_{hash(str(context.get('sql_data', {})))}_{history_key}"
 
         if use_cache and context_key in self._message_cache:
             cached_messages = self._message_cache[context_key]
@@ -119,6 +120,12 @@ class GrokService:
         if preferences.get('monthly_income'):
             parts.append(f"Thu nhập: {preferences['monthly_income']:,}VND")
 
+        history = context.get('relevant_history', [])
+        if history:
+            parts.append("Trao đổi trước liên quan:")
+            for exchange in history:
+                parts.append(f"- Hỏi: {exchange['question']} | Đáp: {exchange['answer']}")
+
         parts.append("Yêu cầu: Phân tích ngắn gọn, số liệu cụ thể, khuyến nghị thiết thực.")
 
         return "\n".join(parts)
@@ -0,0 +1,167 @@
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+
+from app.database.database import db_service
+from app.database.admission import DBOverloadedError, LANE_BACKGROUND, LANE_CANNED, LANE_CUSTOM
+from app.agents.precomputed_results import get_precomputed_results
+from app.services.cache_invalidation import cache_invalidation
+from app.services.data_version import user_data_versions
+
+logger = logging.getLogger(__name__)
+
+PRECOMPUTE_ENABLED = os.getenv("PRECOMPUTE_ENABLED", "true").lower() == "true"
+
+# Wait this long after a user's last change so a bulk import is precomputed once
+PRECOMPUTE_DEBOUNCE_SECONDS = float(os.getenv("PRECOMPUTE_DEBOUNCE_SECONDS", "10"))
+
+# Only users who asked something within this window are precomputed for
+PRECOMPUTE_ACTIVE_HOURS = float(os.getenv("PRECOMPUTE_ACTIVE_HOURS", "72"))
+
+# Back off while live queries use more than this share of their lanes on the user's shard
+PRECOMPUTE_MAX_LIVE_LOAD = float(os.getenv("PRECOMPUTE_MAX_LIVE_LOAD", "0.5"))
+
+# Pause between two precomputed queries
+PRECOMPUTE_PAUSE_SECONDS = float(os.getenv("PRECOMPUTE_PAUSE_SECONDS", "0.2"))
+
+PRECOMPUTE_BUSY_BACKOFF_SECONDS = 5.0
+
+# Periods precomputed for every canned template besides its default: the current month
+PRECOMPUTE_EXTRA_WINDOWS = [{"kind": "calendar", "unit": "month", "offset": 0}]
+
+
+class PrecomputeWorker:
+    def __init__(self):
+        """Run the canned analyses of recently active users right after their data changes"""
+        self.db_service = db_service
+        self.results = get_precomputed_results()
+
+        self._pending: "OrderedDict[str, float]" = OrderedDict()  # user -> not before (monotonic)
+        self._task: Optional[asyncio.Task] = None
+        self._stats = {
+            "queued": 0,
+            "skipped_inactive": 0,
+            "users_done": 0,
+            "queries": 0,
+            "stale": 0,
+            "deferred_busy": 0,
+            "failed": 0
+        }
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        """Follow change notifications and precompute in the background (call from lifespan startup)"""
+        if self.running or not PRECOMPUTE_ENABLED or self.db_service is None:
+            return
+        cache_invalidation.subscribe(self._on_change)
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"✅ Precompute worker started ({PRECOMPUTE_DEBOUNCE_SECONDS:.0f}s debounce)")
+
+    async def stop(self):
+        """Stop precomputing (call from lifespan shutdown)"""
+        if not self.running:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        logger.info(f"🛑 Precompute worker stopped ({self._stats['users_done']} users precomputed)")
+
+    def _on_change(self, user_id: Optional[str]):
+        if user_id is None:
+            return
+        if not self.results.seen_within(user_id, PRECOMPUTE_ACTIVE_HOURS * 3600):
+            self._stats["skipped_inactive"] += 1
+            return
+        # Every further change pushes the user back, so a burst of writes is precomputed once
+        self._pending[user_id] = time.monotonic() + PRECOMPUTE_DEBOUNCE_SECONDS
+        self._pending.move_to_end(user_id)
+        self._stats["queued"] += 1
+
+    def _next_due(self) -> Optional[str]:
+        now = time.monotonic()
+        for user_id, due in self._pending.items():
+            if due <= now:
+                del self._pending[user_id]
+                return user_id
+        return None
+
+    def _live_load(self, user_id: str) -> float:
+        shard = self.db_service.shard_for(user_id).name
+        return self.db_service.admission.load(shard, [LANE_CANNED, LANE_CUSTOM])
+
+    async def _run(self):
+        while True:
+            user_id = self._next_due()
+            if user_id is None:
+                await asyncio.sleep(1.0)
+                continue
+
+            if self._live_load(user_id) > PRECOMPUTE_MAX_LIVE_LOAD:
+                self._defer(user_id)
+                await asyncio.sleep(PRECOMPUTE_BUSY_BACKOFF_SECONDS)
+                continue
+
+            try:
+                await self._precompute_user(user_id)
+            except DBOverloadedError:
+                self._defer(user_id)
+            except Exception as e:
+                self._stats["failed"] += 1
+                logger.warning(f"Precompute failed for user {user_id}: {e}")
+
+    def _defer(self, user_id: str):
+        self._stats["deferred_busy"] += 1
+        self._pending.setdefault(user_id, time.monotonic() + PRECOMPUTE_BUSY_BACKOFF_SECONDS)
+
+    def _targets(self, agent) -> List[Tuple[str, Dict[str, Any]]]:
+        """(template, period) pairs a question without an unusual period resolves to"""
+        from app.agents.sql_agent import DEFAULT_WINDOWS
+
+        targets, seen = [], set()
+        for query_type in DEFAULT_WINDOWS:
+            for window in [None, *PRECOMPUTE_EXTRA_WINDOWS]:
+                date_range = agent._resolve_date_range("", query_type, {"time_window": window})
+                key = (query_type, date_range["start"], date_range["end"])
+                if key not in seen:
+                    seen.add(key)
+                    targets.append((query_type, date_range))
+        return targets
+
+    async def _precompute_user(self, user_id: str):
+        from app.agents.sql_agent import get_sql_agent
+        agent = get_sql_agent()
+
+        for query_type, date_range in self._targets(agent):
+            # Changed again meanwhile: the debounced rerun will redo everything
+            if user_id in self._pending or self._live_load(user_id) > PRECOMPUTE_MAX_LIVE_LOAD:
+                self._defer(user_id)
+                return
+
+            marker = user_data_versions.change_marker(user_id)
+            result = await agent.precompute(user_id, query_type, date_range, lane=LANE_BACKGROUND)
+            self._stats["queries"] += 1
+            if not self.results.store(user_id, query_type, date_range, result, marker):
+                self._stats["stale"] += 1
+                return
+            await asyncio.sleep(PRECOMPUTE_PAUSE_SECONDS)
+
+        self._stats["users_done"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Worker counters plus hit rate of the precomputed results"""
+        return {
+            **self._stats,
+            "running": self.running,
+            "pending_users": len(self._pending),
+            "results": self.results.get_stats()
+        }
+
+
+# Global instance
+precompute_worker = PrecomputeWorker()
@@ -0,0 +1,111 @@
+import os
+import logging
+from collections import Counter
+from datetime import date, datetime, timedelta
+from typing import Dict, Any, List, Tuple
+
+from sqlalchemy import text
+from app.database.database import db_service
+from app.utils.vietnamese_text import extract_topic_terms
+
+logger = logging.getLogger(__name__)
+
+# Reserved term holding the number of questions asked in a bucket
+INTERACTIONS_TERM = "#questions"
+
+# A bucket's weight halves every TOPIC_DECAY_HALF_LIFE_DAYS
+TOPIC_DECAY_HALF_LIFE_DAYS = float(os.getenv("TOPIC_DECAY_HALF_LIFE_DAYS", "14"))
+
+# Buckets older than this are pruned by storage maintenance
+TOPIC_STATS_RETENTION_DAYS = int(os.getenv("TOPIC_STATS_RETENTION_DAYS", "180"))
+
+
+def _bucket_of(created_at) -> date:
+    """Daily bucket for a conversation timestamp"""
+    if isinstance(created_at, datetime):
+        return created_at.date()
+    if isinstance(created_at, date):
+        return created_at
+    return date.today()
+
+
+def count_topic_terms(records: List[Dict[str, Any]]) -> Counter:
+    """Aggregate (user_id, bucket, term) -> hits for a batch of conversation records"""
+    counts: Counter = Counter()
+    for record in records:
+        key = (record["user_id"], _bucket_of(record.get("created_at")))
+        counts[key + (INTERACTIONS_TERM,)] += 1
+        for term in extract_topic_terms(record.get("question") or ""):
+            counts[key + (term,)] += 1
+    return counts
+
+
+def upsert_topic_stats(conn, counts: Dict[Tuple[str, date, str], int]):
+    """Increment counters with one multi-row upsert inside the caller's transaction"""
+    if not counts:
+        return
+
+    rows = []
+    params: Dict[str, Any] = {}
+    # Sorted keys give concurrent writers the same lock order
+    for i, ((user_id, bucket_start, term), hits) in enumerate(sorted(counts.items())):
+        rows.append(f"(:user_id_{i}, :bucket_start_{i}, :term_{i}, :hits_{i})")
+        params[f"user_id_{i}"] = user_id
+        params[f"bucket_start_{i}"] = bucket_start
+        params[f"term_{i}"] = term
+        params[f"hits_{i}"] = hits
+
+    conn.execute(text(
+        "INSERT INTO user_topic_stats (user_id, bucket_start, term, hits) VALUES "
+        + ", ".join(rows)
+        + " ON CONFLICT (user_id, bucket_start, term)"
+        + " DO UPDATE SET hits = user_topic_stats.hits + EXCLUDED.hits"
+    ), params)
+
+
+def get_topic_stats(user_id: str, days: int = 30, limit: int = 10) -> Dict[str, Any]:
+    """Decayed top terms and question count for one user from a single index range scan"""
+    query = text("""
+        SELECT term,
+               SUM(hits) AS hits,
+               SUM(hits * power(0.5, (CURRENT_DATE - bucket_start) / CAST(:half_life AS FLOAT))) AS score
+        FROM user_topic_stats
+        WHERE user_id = :user_id
+        AND bucket_start > CURRENT_DATE - :days
+        GROUP BY term
+        ORDER BY (term = :interactions_term) DESC, score DESC
+        LIMIT :limit
+    """)
+
+    with db_service.read_connection(user_id) as conn:
+        result = conn.execute(query, {
+            "user_id": user_id,
+            "days": days,
+            "half_life": TOPIC_DECAY_HALF_LIFE_DAYS,
+            "interactions_term": INTERACTIONS_TERM,
+            "limit": limit + 1
+        })
+
+        interactions = 0
+        topics = []
+        for term, hits, score in result:
+            if term == INTERACTIONS_TERM:
+                interactions = int(hits)
+            else:
+                topics.append({"term": term, "hits": int(hits), "score": round(float(score), 3)})
+
+    return {"interactions": interactions, "topics": topics[:limit]}
+
+
+def prune_topic_stats(retention_days: int = TOPIC_STATS_RETENTION_DAYS, engine=None) -> int:
+    """Delete counter buckets past the retention window"""
+    engine = engine or db_service.engine
+    try:
+        with engine.begin() as conn:
+            result = conn.execute(text(
+                "DELETE FROM user_topic_stats WHERE bucket_start < :cutoff"
+            ), {"cutoff": date.today() - timedelta(days=retention_days)})
+            return result.rowcount
+    except Exception as e:
+        logger.error(f"❌ Error pruning topic stats: {e}")
+        return 0
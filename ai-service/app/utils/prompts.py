@@ -10,7 +10,7 @@ SQL_AGENT_PROMPT = dedent("""\
 
     NGUYÊN TẮC QUAN TRỌNG:
     1. LUÔN LUÔN filter theo user_id để đảm bảo bảo mật dữ liệu
-    2. Sử dụng CAST(amount AS DECIMAL) cho các phép tính toán học
+    2. amount đã là NUMERIC, dùng trực tiếp, không CAST (CAST làm mất tác dụng của index)
     3. Định dạng số tiền theo đơn vị VND
     4. Kiểm tra NULL values và xử lý appropriately
     5. Sử dụng JOINs thích hợp để lấy thông tin đầy đủ
@@ -27,12 +27,11 @@ SQL_AGENT_PROMPT = dedent("""\
     SELECT
         c.name as category_name,
         COUNT(*) as transaction_count,
-        SUM(ABS(CAST(t.amount AS DECIMAL))) as total_amount
+        SUM(ABS(t.amount)) as total_amount
     FROM transactions t
-    JOIN accounts a ON t.account_id = a.id
     LEFT JOIN categories c ON t.category_id = c.id
-    WHERE a.user_id = 'user_id_here'
-        AND CAST(t.amount AS DECIMAL) < 0
+    WHERE t.user_id = 'user_id_here'
+        AND t.amount < 0
         AND t.date >= DATE_TRUNC('month', CURRENT_DATE)
     GROUP BY c.name
     ORDER BY total_amount DESC;
@@ -0,0 +1,164 @@
+import re
+import calendar
+import unicodedata
+from datetime import date, timedelta
+from typing import Dict, Any, List, Optional, Tuple
+
+# Relative time expressions (Vietnamese and English).
+# Calendar windows: offset 0 = current period, 1 = previous period.
+_CALENDAR_PATTERNS = [
+    (r"\b(hôm nay|today)\b", "day", 0),
+    (r"\b(hôm qua|yesterday)\b", "day", 1),
+    (r"\b(tuần này|this week)\b", "week", 0),
+    (r"\b(tuần trước|tuần rồi|last week)\b", "week", 1),
+    (r"\b(tháng này|tháng hiện tại|từ đầu tháng|this month|month to date)\b", "month", 0),
+    (r"\b(tháng trước|tháng rồi|last month)\b", "month", 1),
+    (r"\b(quý này|this quarter)\b", "quarter", 0),
+    (r"\b(quý trước|last quarter)\b", "quarter", 1),
+    (r"\b(năm nay|từ đầu năm|this year|year to date|ytd)\b", "year", 0),
+    (r"\b(năm trước|năm ngoái|last year)\b", "year", 1),
+]
+
+_UNIT_WORDS = {
+    "ngày": "day", "day": "day", "days": "day",
+    "tuần": "week", "week": "week", "weeks": "week",
+    "tháng": "month", "month": "month", "months": "month",
+    "quý": "quarter", "quarter": "quarter", "quarters": "quarter",
+    "năm": "year", "year": "year", "years": "year",
+}
+
+# Rolling windows: "3 tháng gần đây", "30 ngày qua", "last 6 months", "past 2 weeks"
+_ROLLING_VI = re.compile(r"\b(\d{1,3})\s+(ngày|tuần|tháng|quý|năm)\s+(gần đây|gần nhất|qua|vừa qua|trở lại đây)\b")
+_ROLLING_EN = re.compile(r"\b(?:last|past|previous)\s+(\d{1,3})\s+(days?|weeks?|months?|quarters?|years?)\b")
+
+# Single earlier periods: "3 tháng trước", "2 weeks ago"
+_AGO_VI = re.compile(r"\b(\d{1,3})\s+(ngày|tuần|tháng|quý|năm)\s+(?:trước|về trước)\b")
+_AGO_EN = re.compile(r"\b(\d{1,3})\s+(days?|weeks?|months?|quarters?|years?)\s+ago\b")
+
+# "chi tiêu cho ăn uống", "danh mục mua sắm", "category groceries"
+_CATEGORY_PATTERN = re.compile(
+    r"(?:danh mục|mục|category|chi tiêu cho|chi cho|spending on|spent on)\s+([^\s,.?!]+(?:\s+[^\s,.?!]+){0,2})"
+)
+
+# "ở Highlands", "tại Circle K", "at Starbucks", "from Grab"
+_PAYEE_PATTERN = re.compile(
+    r"(?:\bở\b|\btại\b|\bat\b|\bfrom\b|\bcho\b)\s+([A-ZĐ][\w&'.-]*(?:\s+[A-ZĐ0-9][\w&'.-]*){0,3})"
+)
+
+# Words that end a captured category/payee phrase
+_SLOT_STOPWORDS = {
+    "trong", "tháng", "tuần", "năm", "ngày", "hôm", "gần", "này", "trước", "là", "bao",
+    "nhiêu", "in", "this", "last", "during", "for", "the", "past", "và", "and",
+}
+
+
+def normalize_question(question: str) -> str:
+    """NFC-normalize, lowercase and collapse whitespace"""
+    text = unicodedata.normalize("NFC", question or "")
+    return " ".join(text.strip().lower().split())
+
+
+def extract_time_window(question: str) -> Optional[Dict[str, Any]]:
+    """Extract a relative time window from the question, if any"""
+    text = normalize_question(question)
+
+    match = _ROLLING_VI.search(text)
+    if match:
+        return {"kind": "rolling", "unit": _UNIT_WORDS[match.group(2)], "count": int(match.group(1)), "text": match.group(0)}
+
+    match = _ROLLING_EN.search(text)
+    if match:
+        return {"kind": "rolling", "unit": _UNIT_WORDS[match.group(2)], "count": int(match.group(1)), "text": match.group(0)}
+
+    for pattern in (_AGO_VI, _AGO_EN):
+        match = pattern.search(text)
+        if match:
+            return {"kind": "calendar", "unit": _UNIT_WORDS[match.group(2)], "offset": int(match.group(1)), "text": match.group(0)}
+
+    for pattern, unit, offset in _CALENDAR_PATTERNS:
+        match = re.search(pattern, text)
+        if match:
+            return {"kind": "calendar", "unit": unit, "offset": offset, "text": match.group(0)}
+
+    return None
+
+
+def _add_months(d: date, months: int) -> date:
+    index = d.year * 12 + d.month - 1 + months
+    year, month = index // 12, index % 12 + 1
+    return date(year, month, min(d.day, calendar.monthrange(year, month)[1]))
+
+
+def _shift(d: date, unit: str, count: int) -> date:
+    if unit == "day":
+        return d + timedelta(days=count)
+    if unit == "week":
+        return d + timedelta(weeks=count)
+    months = {"month": 1, "quarter": 3, "year": 12}[unit]
+    return _add_months(d, months * count)
+
+
+def _period_start(d: date, unit: str) -> date:
+    if unit == "day":
+        return d
+    if unit == "week":
+        return d - timedelta(days=d.weekday())
+    if unit == "month":
+        return d.replace(day=1)
+    if unit == "quarter":
+        return date(d.year, (d.month - 1) // 3 * 3 + 1, 1)
+    return date(d.year, 1, 1)
+
+
+def time_window_range(window: Dict[str, Any], today: Optional[date] = None) -> Tuple[date, date]:
+    """[start, end) dates covered by an extracted time window"""
+    today = today or date.today()
+
+    if window["kind"] == "rolling":
+        return _shift(today, window["unit"], -window["count"]) + timedelta(days=1), today + timedelta(days=1)
+
+    start = _shift(_period_start(today, window["unit"]), window["unit"], -window["offset"])
+    return start, _shift(start, window["unit"], 1)
+
+
+def _trim_phrase(phrase: str) -> Optional[str]:
+    """Cut a captured phrase at the first stopword"""
+    words = []
+    for word in phrase.split():
+        if word.lower() in _SLOT_STOPWORDS or word.isdigit():
+            break
+        words.append(word)
+    return " ".join(words) or None
+
+
+def extract_category(question: str, known_categories: Optional[List[str]] = None) -> Optional[str]:
+    """Extract a category name, preferring exact matches against known categories"""
+    text = normalize_question(question)
+
+    if known_categories:
+        # Longest name first so "Ăn uống ngoài" wins over "Ăn uống"
+        for name in sorted(known_categories, key=len, reverse=True):
+            if name and normalize_question(name) in text:
+                return name
+
+    match = _CATEGORY_PATTERN.search(text)
+    if match:
+        return _trim_phrase(match.group(1))
+    return None
+
+
+def extract_payee(question: str) -> Optional[str]:
+    """Extract a capitalized payee name following a location/merchant preposition"""
+    match = _PAYEE_PATTERN.search(unicodedata.normalize("NFC", question or ""))
+    if match:
+        return _trim_phrase(match.group(1))
+    return None
+
+
+def extract_slots(question: str, known_categories: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Extract time window, category and payee slots from a question"""
+    return {
+        "time_window": extract_time_window(question),
+        "category": extract_category(question, known_categories),
+        "payee": extract_payee(question),
+    }
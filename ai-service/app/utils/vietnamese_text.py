@@ -0,0 +1,70 @@
+import re
+import logging
+import unicodedata
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+# Function words that carry no topic signal (pyvi joins compounds with "_")
+TOPIC_STOPWORDS = {
+    "tôi", "mình", "của", "cho", "và", "là", "có", "không", "được", "bao_nhiêu",
+    "nào", "gì", "này", "kia", "đó", "thì", "mà", "với", "các", "những", "một",
+    "trong", "ở", "tại", "từ", "đến", "về", "như", "thế", "thế_nào", "hãy", "giúp",
+    "xem", "cho_tôi", "bao_giờ", "khi", "nhất", "hơn", "rồi", "đã", "đang", "sẽ",
+    "the", "and", "for", "what", "how", "much", "many", "did", "does", "show", "my",
+    "this", "that", "with", "from", "last", "about", "are", "was", "is", "me",
+    # Time words and unsegmented halves of common compounds (when pyvi is absent)
+    "bao", "nhiêu", "ngày", "tuần", "tháng", "năm", "nay", "hôm", "qua", "trước",
+    "month", "week", "year", "today",
+}
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_TOKEN_PATTERN = re.compile(r"^[^\W\d]+(?:_[^\W\d]+)*$")
+
+_pyvi_tokenize = None
+_pyvi_missing = False
+
+
+def preprocess_vietnamese_text(text: str) -> str:
+    """NFC-normalise, lowercase and collapse whitespace"""
+    text = unicodedata.normalize('NFC', text)
+    text = text.strip().lower()
+    return ' '.join(text.split())
+
+
+def tokenize_vietnamese_text(text: str) -> str:
+    """Word-segment Vietnamese text with pyvi, joining compounds with underscores"""
+    global _pyvi_tokenize, _pyvi_missing
+
+    if _pyvi_tokenize is None and not _pyvi_missing:
+        try:
+            from pyvi.ViTokenizer import tokenize
+            _pyvi_tokenize = tokenize
+        except ImportError:
+            _pyvi_missing = True
+            logger.warning("⚠️ pyvi not installed, skipping Vietnamese tokenization")
+
+    if _pyvi_tokenize is None:
+        return text
+    try:
+        return _pyvi_tokenize(text)
+    except Exception as e:
+        logger.warning(f"⚠️ Error tokenizing text: {e}")
+        return text
+
+
+def extract_topic_terms(text: str, max_terms: int = 20) -> List[str]:
+    """Distinct topic terms of a question, using the embedding tokenisation pipeline"""
+    tokenized = tokenize_vietnamese_text(preprocess_vietnamese_text(text))
+    tokens = _PUNCTUATION.sub(" ", tokenized).split()
+
+    terms: List[str] = []
+    for token in tokens:
+        if len(token) < 2 or token in TOPIC_STOPWORDS or not _TOKEN_PATTERN.match(token):
+            continue
+        if token not in terms:
+            terms.append(token)
+        if len(terms) >= max_terms:
+            break
+
+    return terms
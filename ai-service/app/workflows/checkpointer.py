@@ -0,0 +1,180 @@
+import os
+import time
+import threading
+import logging
+from collections import OrderedDict
+from typing import Dict, Any, Set
+
+from langgraph.checkpoint.memory import MemorySaver
+
+logger = logging.getLogger(__name__)
+
+# WORKFLOW_CHECKPOINTER values
+CHECKPOINTER_MODES = ("bounded", "none", "memory", "sqlite", "postgres")
+
+
+class BoundedMemorySaver(MemorySaver):
+    """MemorySaver with LRU and TTL eviction of whole threads"""
+
+    def __init__(self, max_threads: int = 1000, ttl_seconds: int = 900, **kwargs):
+        super().__init__(**kwargs)
+        self.max_threads = max_threads
+        self.ttl_seconds = ttl_seconds
+
+        self._last_access: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._evicted_threads = 0
+
+    def _touch(self, config: Dict[str, Any]):
+        thread_id = config["configurable"]["thread_id"]
+        with self._lock:
+            self._last_access[thread_id] = time.monotonic()
+            self._last_access.move_to_end(thread_id)
+            victims = self._collect_victims()
+        if victims:
+            self._delete_threads(victims)
+
+    def _collect_victims(self) -> Set[str]:
+        """Expired threads plus LRU overflow; batched to amortise the key scan"""
+        victims: Set[str] = set()
+        cutoff = time.monotonic() - self.ttl_seconds
+
+        for thread_id, accessed in self._last_access.items():
+            if accessed >= cutoff:
+                break
+            victims.add(thread_id)
+
+        # Let the map overshoot by 10% before trimming back to max_threads
+        overflow_limit = self.max_threads + max(1, self.max_threads // 10)
+        if len(self._last_access) - len(victims) > overflow_limit:
+            for thread_id in self._last_access:
+                if len(self._last_access) - len(victims) <= self.max_threads:
+                    break
+                victims.add(thread_id)
+
+        for thread_id in victims:
+            del self._last_access[thread_id]
+        return victims
+
+    def _delete_threads(self, thread_ids: Set[str]):
+        """Drop checkpoints, pending writes and blobs of several threads in one pass"""
+        for thread_id in thread_ids:
+            self.storage.pop(thread_id, None)
+        for key in [k for k in self.writes if k[0] in thread_ids]:
+            del self.writes[key]
+        for key in [k for k in self.blobs if k[0] in thread_ids]:
+            del self.blobs[key]
+        self._evicted_threads += len(thread_ids)
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        result = super().put(config, checkpoint, metadata, new_versions)
+        self._touch(config)
+        return result
+
+    def put_writes(self, config, writes, task_id, task_path: str = ""):
+        super().put_writes(config, writes, task_id, task_path)
+        self._touch(config)
+
+    def get_tuple(self, config):
+        result = super().get_tuple(config)
+        if result is not None:
+            thread_id = config["configurable"]["thread_id"]
+            with self._lock:
+                if thread_id in self._last_access:
+                    self._last_access[thread_id] = time.monotonic()
+                    self._last_access.move_to_end(thread_id)
+        return result
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            self._last_access.pop(thread_id, None)
+        super().delete_thread(thread_id)
+
+    def get_stats(self) -> Dict[str, int]:
+        """Get checkpointer statistics"""
+        return {
+            "threads": len(self._last_access),
+            "max_threads": self.max_threads,
+            "evicted_threads": self._evicted_threads
+        }
+
+
+def create_checkpointer(mode: str = None):
+    """Create the workflow checkpointer; None means stateless (no checkpoints)"""
+    mode = (mode or os.getenv("WORKFLOW_CHECKPOINTER", "bounded")).lower()
+    if mode not in CHECKPOINTER_MODES:
+        logger.warning(f"Unknown checkpointer mode '{mode}', using bounded")
+        mode = "bounded"
+
+    if mode == "none":
+        return None
+
+    if mode == "memory":
+        return MemorySaver()
+
+    if mode == "sqlite":
+        import aiosqlite
+        from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+        path = os.getenv("WORKFLOW_CHECKPOINT_SQLITE_PATH", "./cache/checkpoints.sqlite")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Connection is started lazily by AsyncSqliteSaver.setup()
+        return AsyncSqliteSaver(aiosqlite.connect(path))
+
+    if mode == "postgres":
+        from psycopg.rows import dict_row
+        from psycopg_pool import AsyncConnectionPool
+        from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+
+        conninfo = os.getenv("WORKFLOW_CHECKPOINT_POSTGRES_URL") or os.getenv("DRIZZLE_DATABASE_URL")
+        pool = AsyncConnectionPool(
+            conninfo,
+            max_size=int(os.getenv("WORKFLOW_CHECKPOINT_POOL_SIZE", "5")),
+            open=False,
+            kwargs={"autocommit": True, "prepare_threshold": 0, "row_factory": dict_row}
+        )
+        return AsyncPostgresSaver(pool)
+
+    return BoundedMemorySaver(
+        max_threads=int(os.getenv("WORKFLOW_CHECKPOINT_MAX_THREADS", "1000")),
+        ttl_seconds=int(os.getenv("WORKFLOW_CHECKPOINT_TTL_SECONDS", "900"))
+    )
+
+
+async def prepare_checkpointer(checkpointer) -> None:
+    """Open connections and create tables for persistent checkpointers"""
+    if checkpointer is None or isinstance(checkpointer, MemorySaver):
+        return
+
+    pool = getattr(checkpointer, "conn", None)
+    if pool is not None and hasattr(pool, "open") and getattr(pool, "closed", False):
+        await pool.open()
+
+    await checkpointer.setup()
+    logger.info(f"✅ Checkpointer {type(checkpointer).__name__} ready")
+
+
+async def close_checkpointer(checkpointer) -> None:
+    """Close the SQLite connection or Postgres pool of a persistent checkpointer"""
+    if checkpointer is None or isinstance(checkpointer, MemorySaver):
+        return
+
+    conn = getattr(checkpointer, "conn", None)
+    if conn is None:
+        return
+    try:
+        await conn.close()
+        logger.info(f"🛑 Checkpointer {type(checkpointer).__name__} closed")
+    except Exception as e:
+        logger.warning(f"Closing checkpointer failed: {e}")
+
+
+def get_checkpointer_stats(checkpointer) -> Dict[str, Any]:
+    """Describe the active checkpointer"""
+    if checkpointer is None:
+        return {"mode": "none"}
+    if isinstance(checkpointer, BoundedMemorySaver):
+        return {"mode": "bounded", **checkpointer.get_stats()}
+    if isinstance(checkpointer, MemorySaver):
+        return {"mode": "memory", "threads": len(checkpointer.storage)}
+    return {"mode": type(checkpointer).__name__}
@@ -1,20 +1,44 @@
-from typing import Dict, Any, List, Optional, TypedDict, Literal
-from langgraph.graph import StateGraph, END
-from langgraph.checkpoint.memory import MemorySaver
+from typing import Dict, Any, List, Optional, TypedDict, Literal, Annotated, AsyncIterator, Tuple
+from langgraph.graph import StateGraph, START, END
+from app.workflows.checkpointer import create_checkpointer, prepare_checkpointer, close_checkpointer, get_checkpointer_stats
 from app.agents.sql_agent import get_sql_agent
+from app.agents.aggregate_cube import UserCube, current_batch_cube
 from app.services.grok_service import GrokService
 from app.services.context_service import ContextService
+from app.services.conversation_memory import conversation_memory
+from app.services.answer_cache import get_answer_cache
 from app.embeddings import embeddings_service
-import logging
+from app.database.database import db_service
+from app.database.unit_of_work import current_unit_of_work, run_in_executor
+from contextlib import nullcontext
+from collections import OrderedDict
 import asyncio
+import hashlib
+import logging
+import os
+import time
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+# Users analysed at once by analyze_financial_batch
+ANALYZE_BATCH_CONCURRENCY = int(os.getenv("ANALYZE_BATCH_CONCURRENCY", "4"))
+
+def _merge_timings(left: Dict[str, float], right: Dict[str, float]) -> Dict[str, float]:
+    """Reducer: parallel nodes each contribute their own timing; an empty input resets"""
+    if not right:
+        return {}
+    return {**(left or {}), **right}
+
+def _latest_error(left: Optional[str], right: Optional[str]) -> Optional[str]:
+    """Reducer: lets parallel nodes both report errors; a None input resets a reused thread"""
+    return right
+
 class FinancialState(TypedDict):
     """State with system prompt caching"""
     user_id: str
     user_question: str
+    question_embedding: Optional[List[float]]
 
     # System context
     system_prompt: str
@@ -24,6 +48,7 @@ class FinancialState(TypedDict):
     # Analysis results
     sql_analysis: Dict[str, Any]
     similar_patterns: List[Dict]
+    relevant_history: List[Dict]
 
     # Response generation
     response_chunks: List[str]
@@ -32,47 +57,65 @@ class FinancialState(TypedDict):
     # Optimization tracking
     tokens_used: int
     cache_hits: int
-    error_message: Optional[str]
+    node_timings: Annotated[Dict[str, float], _merge_timings]
+    error_message: Annotated[Optional[str], _latest_error]
 
 class FinancialWorkflow:
     def __init__(self):
         self.sql_agent = get_sql_agent()
         self.grok_service = GrokService()
         self.context_service = ContextService()
+        self.conversation_memory = conversation_memory
 
         self._prompt_cache: Dict[str, str] = {}
         self._context_cache: Dict[str, Dict] = {}
 
         self.workflow = self._create_workflow()
 
-        # Use MemorySaver instead of SqliteSaver to avoid session conflicts
-        memory = MemorySaver()
-        self.app = self.workflow.compile(checkpointer=memory)
+        # Bounded by default; WORKFLOW_CHECKPOINTER selects none/memory/sqlite/postgres
+        self.checkpointer = create_checkpointer()
+        self._checkpointer_ready = False
+        self.app = self.workflow.compile(checkpointer=self.checkpointer)
+
+    async def ensure_ready(self):
+        """Open persistent checkpointer connections on first use"""
+        if not self._checkpointer_ready:
+            await prepare_checkpointer(self.checkpointer)
+            self._checkpointer_ready = True
+
+    async def close(self):
+        """Close persistent checkpointer connections (call from lifespan shutdown)"""
+        if self._checkpointer_ready:
+            await close_checkpointer(self.checkpointer)
+            self._checkpointer_ready = False
+
+    def get_checkpointer_stats(self) -> Dict[str, Any]:
+        """Get checkpointer statistics"""
+        return get_checkpointer_stats(self.checkpointer)
 
     def _create_workflow(self) -> StateGraph:
-        """Create optimized workflow with minimal state transitions"""
+        """Create workflow: context loading, history retrieval and SQL analysis run concurrently"""
         workflow = StateGraph(FinancialState)
 
         # Define nodes
-        workflow.add_node("load_context_step", self._load_context_cached)
-        workflow.add_node("execute_sql_step", self._sql_analysis)
-        workflow.add_node("generate_response_step", self._generate_response_streaming)
+        workflow.add_node("load_context_step", self._timed("load_context_step", self._load_context_cached))
+        workflow.add_node("retrieve_history_step", self._timed("retrieve_history_step", self._retrieve_history))
+        workflow.add_node("execute_sql_step", self._timed("execute_sql_step", self._sql_analysis))
+        workflow.add_node("join_step", self._join_analysis)
+        workflow.add_node("generate_response_step", self._timed("generate_response_step", self._generate_response_streaming))
         workflow.add_node("handle_error_step", self._handle_error_minimal)
 
-        workflow.set_entry_point("load_context_step")
+        # Fan out: no step reads another's output
+        workflow.add_edge(START, "load_context_step")
+        workflow.add_edge(START, "retrieve_history_step")
+        workflow.add_edge(START, "execute_sql_step")
 
-        workflow.add_conditional_edges(
-            "load_context_step",
-            self._check_context_loaded,
-            {
-                "loaded": "execute_sql_step",
-                "error": "handle_error_step"
-            }
-        )
+        # Fan in: join waits for all branches
+        workflow.add_edge(["load_context_step", "retrieve_history_step", "execute_sql_step"], "join_step")
 
         workflow.add_conditional_edges(
-            "execute_sql_step",
-            self._check_analysis_success,
+            "join_step",
+            self._check_ready,
             {
                 "success": "generate_response_step",
                 "error": "handle_error_step"
@@ -84,22 +127,42 @@ class FinancialWorkflow:
 
         return workflow
 
-    async def _load_context_cached(self, state: FinancialState) -> FinancialState:
+    def _timed(self, name: str, step):
+        """Wrap a node so it reports its wall-clock time in milliseconds"""
+        async def run(state: FinancialState) -> Dict[str, Any]:
+            started = time.perf_counter()
+            update = await step(state)
+            update["node_timings"] = {name: round((time.perf_counter() - started) * 1000, 2)}
+            return update
+        return run
+
+    async def _join_analysis(self, state: FinancialState) -> Dict[str, Any]:
+        """Join point for the parallel context and SQL branches"""
+        # All reads are done; don't hold the request's connection through response generation
+        unit = current_unit_of_work.get()
+        if unit is not None:
+            await run_in_executor(unit.release)
+        return {}
+
+    async def _load_context_cached(self, state: FinancialState) -> Dict[str, Any]:
         """Load context with caching to avoid repeated API calls"""
         try:
             user_id = state["user_id"]
 
+            # Already resolved for all of a batch group's questions
+            if state.get("context_loaded"):
+                return {"cache_hits": state.get("cache_hits", 0) + 1}
+
             # Check cache first
             if user_id in self._context_cache:
                 cached_time = self._context_cache[user_id].get("timestamp", 0)
                 if datetime.now().timestamp() - cached_time < 300:  # 5 minute cache
-                    state.update({
+                    return {
                         "user_context": self._context_cache[user_id]["data"],
                         "system_prompt": self._get_cached_system_prompt(user_id),
                         "context_loaded": True,
                         "cache_hits": state.get("cache_hits", 0) + 1
-                    })
-                    return state
+                    }
 
             # Load fresh context
             try:
@@ -120,51 +183,71 @@ class FinancialWorkflow:
             system_prompt = self._generate_system_prompt(user_context)
             self._prompt_cache[user_id] = system_prompt
 
-            state.update({
+            logger.info(f"Context loaded for user {user_id}")
+            return {
                 "user_context": user_context,
                 "system_prompt": system_prompt,
                 "context_loaded": True,
                 "cache_hits": state.get("cache_hits", 0)
-            })
-
-            logger.info(f"Context loaded for user {user_id}")
+            }
         except Exception as e:
             logger.error(f"Context loading error: {e}")
-            state["error_message"] = f"Context loading failed: {str(e)}"
-            state["context_loaded"] = False
+            return {
+                "error_message": f"Context loading failed: {str(e)}",
+                "context_loaded": False
+            }
+
+    async def load_context(self, user_id: str) -> Dict[str, Any]:
+        """User context and system prompt resolved once ahead of several questions; {} if loading failed"""
+        update = await self._load_context_cached({"user_id": user_id, "cache_hits": 0})
+        if not update.get("context_loaded"):
+            return {}
+        return {"user_context": update["user_context"], "system_prompt": update["system_prompt"]}
 
-        return state
+    async def _retrieve_history(self, state: FinancialState) -> Dict[str, Any]:
+        """Retrieve relevant past exchanges; optional context, so failures are not errors"""
+        try:
+            history = await self.conversation_memory.retrieve(
+                state["user_id"], state["user_question"], embedding=state.get("question_embedding")
+            )
+        except Exception as e:
+            logger.warning(f"History retrieval error: {e}")
+            history = []
+        return {"relevant_history": history}
 
-    async def _sql_analysis(self, state: FinancialState) -> FinancialState:
-        """Optimized SQL analysis with minimal prompt overhead"""
+    async def _sql_analysis(self, state: FinancialState) -> Dict[str, Any]:
+        """SQL analysis; independent of the loaded context so it runs in parallel"""
         try:
             result = await self.sql_agent.execute_financial_query(
                 user_id=state["user_id"],
                 question=state["user_question"],
-                system_prompt=state["system_prompt"]
+                embedding=state.get("question_embedding")
             )
 
-            state["sql_analysis"] = result
-
             if result["success"]:
                 logger.info(f"SQL analysis completed for user {state['user_id']}")
-            else:
-                state["error_message"] = result.get("error", "SQL analysis failed")
+                return {"sql_analysis": result}
+
+            return {
+                "sql_analysis": result,
+                "error_message": result.get("error", "SQL analysis failed")
+            }
 
         except Exception as e:
             logger.error(f"SQL analysis error: {e}")
-            state["error_message"] = f"SQL analysis failed: {str(e)}"
-            state["sql_analysis"] = {"success": False, "error": str(e)}
-
-        return state
+            return {
+                "error_message": f"SQL analysis failed: {str(e)}",
+                "sql_analysis": {"success": False, "error": str(e)}
+            }
 
-    async def _generate_response_streaming(self, state: FinancialState) -> FinancialState:
+    async def _generate_response_streaming(self, state: FinancialState) -> Dict[str, Any]:
         """Generate response with streaming and cached context"""
         try:
             response_context = {
                 "user_question": state["user_question"],
                 "sql_data": state["sql_analysis"].get("data", {}),
-                "user_preferences": state["user_context"]
+                "user_preferences": state["user_context"],
+                "relevant_history": state.get("relevant_history", [])
             }
 
             response_stream = self.grok_service.generate_response(
@@ -181,30 +264,31 @@ class FinancialWorkflow:
                 response_chunks.append(chunk)
                 full_response += chunk
 
-            state.update({
+            update = {
                 "response_chunks": response_chunks,
                 "final_response": full_response,
                 "tokens_used": state.get("tokens_used", 0) + len(full_response.split())
-            })
+            }
 
-            # Save conversation asynchronously
-            asyncio.create_task(self._save_conversation_async(
+            # Buffered by the write-behind queue; only waits when the queue is full
+            await self._save_conversation_async(
                 user_id=state["user_id"],
                 question=state["user_question"],
                 response=full_response,
                 analysis_data=state["sql_analysis"]
-            ))
+            )
 
             logger.info(f"Response generated with {len(response_chunks)} chunks")
+            return update
         except Exception as e:
             logger.error(f"Response generation error: {e}")
-            state["error_message"] = f"Response generation failed: {str(e)}"
-            state["final_response"] = "Xin lỗi, có lỗi trong quá trình tạo phản hồi."
-
-        return state
+            return {
+                "error_message": f"Response generation failed: {str(e)}",
+                "final_response": "Xin lỗi, có lỗi trong quá trình tạo phản hồi."
+            }
 
     async def _save_conversation_async(self, user_id: str, question: str, response: str, analysis_data: Dict):
-        """Save conversation asynchronously without blocking"""
+        """Hand the conversation to the write-behind queue"""
         try:
             await self.context_service.save_conversation(
                 user_id=user_id,
@@ -215,22 +299,16 @@ class FinancialWorkflow:
         except Exception as e:
             logger.warning(f"Could not save conversation: {e}")
 
-    async def _handle_error_minimal(self, state: FinancialState) -> FinancialState:
+    async def _handle_error_minimal(self, state: FinancialState) -> Dict[str, Any]:
         """Minimal error handling"""
         error_msg = state.get("error_message", "Unknown error")
         logger.error(f"Workflow error for user {state.get('user_id', 'unknown')}: {error_msg}")
 
-        state["final_response"] = f"Xin lỗi, có lỗi xảy ra khi xử lý yêu cầu của bạn. Vui lòng thử lại sau."
-
-        return state
+        return {"final_response": "Xin lỗi, có lỗi xảy ra khi xử lý yêu cầu của bạn. Vui lòng thử lại sau."}
 
-    def _check_context_loaded(self, state: FinancialState) -> Literal["loaded", "error"]:
-        """Check if context was loaded successfully"""
-        return "loaded" if state.get("context_loaded", False) else "error"
-
-    def _check_analysis_success(self, state: FinancialState) -> Literal["success", "error"]:
-        """Check if SQL analysis was successful"""
-        if state.get("error_message"):
+    def _check_ready(self, state: FinancialState) -> Literal["success", "error"]:
+        """Check that both parallel branches succeeded"""
+        if state.get("error_message") or not state.get("context_loaded", False):
             return "error"
         return "success" if state["sql_analysis"].get("success", False) else "error"
 
@@ -252,12 +330,31 @@ class FinancialWorkflow:
 
         return base_prompt
 
+    def invalidate_user(self, user_id: str):
+        """Drop one user's cached context and system prompt after their data changed"""
+        self._context_cache.pop(user_id, None)
+        self._prompt_cache.pop(user_id, None)
+
     def clear_cache(self):
         """Clear internal caches"""
         self._prompt_cache.clear()
         self._context_cache.clear()
         logger.info("Workflow caches cleared")
 
+async def _embed_question(question: str) -> Optional[List[float]]:
+    """The question's vector, computed once and shared by the answer cache, router, SQL templates and memory"""
+    if not embeddings_service:
+        return None
+    try:
+        return [float(x) for x in await embeddings_service.embed_text(question)]
+    except Exception as e:
+        logger.warning(f"Question embedding failed: {e}")
+        return None
+
+def _request_scope(user_id: str):
+    """Request-scoped unit of work on the user's shard, a no-op without a database"""
+    return db_service.unit_of_work(user_id) if db_service else nullcontext()
+
 # Initialize workflow with better error handling
 workflow = None
 
@@ -273,8 +370,13 @@ def get_workflow():
             raise
     return workflow
 
-async def analyze_financial(user_id: str, question: str) -> Dict[str, Any]:
-    """Optimized financial analysis entry point"""
+async def analyze_financial(
+    user_id: str,
+    question: str,
+    use_cache: bool = True,
+    context: Dict[str, Any] = None
+) -> Dict[str, Any]:
+    """Optimized financial analysis entry point; context is the user's preloaded load_context() result"""
     try:
         workflow_instance = get_workflow()
     except Exception as e:
@@ -285,37 +387,84 @@ async def analyze_financial(user_id: str, question: str) -> Dict[str, Any]:
             "error": str(e)
         }
 
-    # Use a simpler config without thread_id complications
-    config = {"configurable": {"thread_id": f"user_{user_id}_{hash(question) % 10000}"}}
+    # Stable across processes, so persistent checkpointers find the same thread after a restart
+    thread_key = hashlib.sha1(f"{user_id}\n{question}".encode("utf-8")).hexdigest()
+    config = {"configurable": {"thread_id": f"user_{user_id}_{thread_key}"}}
 
     initial_state = {
         "user_id": user_id,
         "user_question": question,
-        "system_prompt": "",
-        "user_context": {},
-        "context_loaded": False,
+        "question_embedding": None,
+        "system_prompt": (context or {}).get("system_prompt", ""),
+        "user_context": (context or {}).get("user_context", {}),
+        "context_loaded": bool(context),
         "sql_analysis": {},
         "similar_patterns": [],
+        "relevant_history": [],
         "response_chunks": [],
         "final_response": "",
         "tokens_used": 0,
         "cache_hits": 0,
+        "node_timings": {},
         "error_message": None
     }
 
     try:
-        result = await workflow_instance.app.ainvoke(initial_state, config)
+        started = time.perf_counter()
+
+        # Every read of this request (data version, EXPLAIN, analytic queries) shares one connection
+        async with _request_scope(user_id) as unit:
+            # Paraphrases of an answered question reuse the answer while the user's data is unchanged
+            answer_cache = get_answer_cache()
+            cached = await answer_cache.lookup(user_id, question) if use_cache else {"hit": False}
+            if cached["hit"]:
+                return {
+                    **cached["result"],
+                    "optimization_stats": {
+                        "answer_cache_hit": True,
+                        "matched_question": cached["matched_question"],
+                        "similarity": cached["similarity"],
+                        "total_ms": round((time.perf_counter() - started) * 1000, 2)
+                    }
+                }
+
+            # The cache embeds only when it had to compare against a paraphrase
+            embedding = cached.get("embedding")
+            if embedding is None:
+                embedding = await _embed_question(question)
+            else:
+                embedding = [float(x) for x in embedding]
+            initial_state["question_embedding"] = embedding
+
+            await workflow_instance.ensure_ready()
+            result = await workflow_instance.app.ainvoke(initial_state, config)
+            total_ms = round((time.perf_counter() - started) * 1000, 2)
+
+            response = {
+                "response": result["final_response"],
+                "analysis": result["sql_analysis"],
+                "optimization_stats": {
+                    "tokens_used": result["tokens_used"],
+                    "cache_hits": result["cache_hits"],
+                    "response_chunks": len(result["response_chunks"]),
+                    "node_timings_ms": result.get("node_timings", {}),
+                    "db_connection": unit.get_stats() if unit else {},
+                    "total_ms": total_ms
+                },
+                "success": not bool(result.get("error_message"))
+            }
 
-        return {
-            "response": result["final_response"],
-            "analysis": result["sql_analysis"],
-            "optimization_stats": {
-                "tokens_used": result["tokens_used"],
-                "cache_hits": result["cache_hits"],
-                "response_chunks": len(result["response_chunks"])
-            },
-            "success": not bool(result.get("error_message"))
-        }
+            if response["success"] and use_cache:
+                await answer_cache.store(
+                    user_id,
+                    question,
+                    {"response": response["response"], "analysis": response["analysis"], "success": True},
+                    embedding=embedding,
+                    signature=cached.get("signature"),
+                    version=cached.get("version")
+                )
+
+            return response
     except Exception as e:
         logger.error(f"Workflow execution error: {e}")
         return {
@@ -324,4 +473,62 @@ async def analyze_financial(user_id: str, question: str) -> Dict[str, Any]:
             "optimization_stats": {},
             "success": False,
             "error": str(e)
-        }
\ No newline at end of file
+        }
+
+async def _prepare_user(user_id: str, questions: int) -> Tuple[Dict[str, Any], Optional[UserCube]]:
+    """Context and (for several questions) a one-off aggregate cube shared by a batch group"""
+    workflow_instance = get_workflow()
+    context = await workflow_instance.load_context(user_id)
+
+    # Canned analyses of every question then come from two reads instead of one query each
+    cube = None
+    if questions > 1 and db_service:
+        try:
+            cube = await run_in_executor(workflow_instance.sql_agent.aggregate_cube.load_cube, user_id)
+        except Exception as e:
+            logger.warning(f"Batch aggregates for user {user_id} failed, querying per question: {e}")
+    return context, cube
+
+async def analyze_financial_batch(
+    items: List[Tuple[str, str]],
+    use_cache: bool = True,
+    concurrency: int = None
+) -> AsyncIterator[Dict[str, Any]]:
+    """Analyze many (user_id, question) pairs as results complete; a user's questions share one unit of work"""
+    by_user: "OrderedDict[str, List[Tuple[int, str]]]" = OrderedDict()
+    for index, (user_id, question) in enumerate(items):
+        by_user.setdefault(user_id, []).append((index, question))
+
+    results: asyncio.Queue = asyncio.Queue()
+    semaphore = asyncio.Semaphore(concurrency or ANALYZE_BATCH_CONCURRENCY)
+
+    async def run_user(user_id: str, questions: List[Tuple[int, str]]):
+        # Context and canned aggregates are resolved once, then the user's questions run in turn on them
+        async with semaphore:
+            pending = list(questions)
+            try:
+                async with _request_scope(user_id):
+                    context, cube = await _prepare_user(user_id, len(questions))
+                    if cube is not None:
+                        current_batch_cube.set((user_id, cube))
+                    while pending:
+                        index, question = pending[0]
+                        result = await analyze_financial(user_id, question, use_cache, context)
+                        pending.pop(0)
+                        await results.put({"index": index, "user_id": user_id, "question": question, **result})
+            except Exception as e:
+                logger.error(f"Batch analysis failed for user {user_id}: {e}")
+                for index, question in pending:
+                    await results.put({
+                        "index": index, "user_id": user_id, "question": question,
+                        "response": "", "analysis": {}, "optimization_stats": {},
+                        "success": False, "error": str(e)
+                    })
+
+    tasks = [asyncio.create_task(run_user(user_id, questions)) for user_id, questions in by_user.items()]
+    try:
+        for _ in range(len(items)):
+            yield await results.get()
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,57 @@
+import asyncio
+from datetime import date, timedelta
+
+import pandas as pd
+
+from app.agents.aggregate_cube import AggregateCubeCache
+
+TODAY = date.today()
+MONTH = {"start": TODAY.replace(day=1), "end": TODAY + timedelta(days=1)}
+
+
+class OneUserDB:
+    def execute_query(self, query, params=None, **kwargs):
+        if "FROM categories WHERE" in query:
+            return pd.DataFrame({"id": ["c1"], "name": ["Ăn uống"]})
+        return pd.DataFrame({
+            "day": [TODAY],
+            "category_id": ["c1"],
+            "category_name": ["Ăn uống"],
+            "income": [0.0],
+            "expenses": [100_000.0],
+            "income_transactions": [0],
+            "expense_transactions": [1],
+            "transactions": [1],
+            "ids": [["t1"]],
+        })
+
+
+class Versions:
+    listening = True
+
+    def change_marker(self, user_id):
+        return 0, 0
+
+
+def built_cache():
+    cache = AggregateCubeCache(db_service=OneUserDB(), versions=Versions(), hot_requests=1)
+    asyncio.run(cache._build("u1"))
+    return cache
+
+
+def test_late_notification_of_a_loaded_row_is_not_counted_twice():
+    cache = built_cache()
+    cache.apply_insert("u1", TODAY, -100_000.0, "c1", "t1")
+
+    summary = cache.answer("u1", "financial_summary", MONTH)
+    assert summary["total_expenses"][0] == 100_000.0
+    assert cache.get_stats()["inserts_already_loaded"] == 1
+
+
+def test_new_rows_are_added_in_place():
+    cache = built_cache()
+    cache.apply_insert("u1", TODAY, -50_000.0, "c1", "t2")
+
+    summary = cache.answer("u1", "financial_summary", MONTH)
+    assert summary["total_expenses"][0] == 150_000.0
+    assert summary["expense_transactions"][0] == 2
@@ -0,0 +1,157 @@
+import asyncio
+from collections import Counter
+from contextlib import asynccontextmanager
+from datetime import date
+
+import pandas as pd
+import pytest
+
+from app.agents.aggregate_cube import AggregateCubeCache
+from app.agents.precomputed_results import PrecomputedResults
+from app.agents.sql_agent import FinancialSQLAgent
+from app.agents.sql_validator import SQLValidator
+from app.workflows import financial_analysis
+
+INTENTS = {
+    "Chi tiêu theo danh mục tháng này": "spending_analysis",
+    "Tổng quan tài chính tháng này": "financial_summary",
+    "Tỷ lệ tiết kiệm mấy tháng gần đây": "savings_analysis",
+    "Thu nhập tháng này": "income_analysis",
+}
+
+
+class CountingDB:
+    """Answers the cube and template reads with canned frames, counting executions per user"""
+
+    def __init__(self):
+        self.executions = Counter()
+
+    def execute_query(self, query, params=None, **kwargs):
+        self.executions[(params or {}).get("user_id")] += 1
+        if "FROM categories WHERE" in query:
+            return pd.DataFrame({"id": ["c1"], "name": ["Ăn uống"]})
+        if "GROUP BY CAST(t.date AS DATE)" in query:
+            return pd.DataFrame({
+                "day": [date.today(), date.today()],
+                "category_id": ["c1", None],
+                "category_name": ["Ăn uống", None],
+                "income": [0.0, 15_000_000.0],
+                "expenses": [250_000.0, 0.0],
+                "income_transactions": [0, 1],
+                "expense_transactions": [2, 0],
+                "transactions": [2, 1],
+                "ids": [["t1", "t2"], ["t3"]],
+            })
+        return pd.DataFrame()
+
+    @asynccontextmanager
+    async def unit_of_work(self, user_id):
+        yield None
+
+
+class Router:
+    async def route_many(self, question, known_categories=None, embedding=None):
+        return [{"question": question, "intent": INTENTS[question], "confidence": 1.0, "slots": {}, "source": "test"}]
+
+
+class Grok:
+    async def generate_response(self, context, system_prompt, stream=True, use_cache=True):
+        yield "ok"
+
+
+class Conversations:
+    async def save_conversation(self, **kwargs):
+        pass
+
+    async def retrieve(self, user_id, question, embedding=None):
+        return []
+
+
+@pytest.fixture
+def db(monkeypatch):
+    db = CountingDB()
+
+    agent = FinancialSQLAgent.__new__(FinancialSQLAgent)
+    agent.db_service = db
+    agent.intent_router = Router()
+    agent.precomputed = PrecomputedResults()
+    agent.aggregate_cube = AggregateCubeCache(db_service=db)
+    agent.sql_validator = SQLValidator()
+
+    workflow = financial_analysis.FinancialWorkflow.__new__(financial_analysis.FinancialWorkflow)
+    workflow.sql_agent = agent
+    workflow.grok_service = Grok()
+    workflow.context_service = Conversations()
+    workflow.conversation_memory = Conversations()
+    workflow._prompt_cache = {}
+    workflow._context_cache = {}
+    workflow.checkpointer = None
+    workflow._checkpointer_ready = True
+    workflow.app = workflow._create_workflow().compile()
+
+    monkeypatch.setattr(financial_analysis, "workflow", workflow)
+    monkeypatch.setattr(financial_analysis, "db_service", db)
+    monkeypatch.setattr(financial_analysis, "embeddings_service", None)
+    return db
+
+
+async def _collect(items):
+    return [result async for result in financial_analysis.analyze_financial_batch(items, use_cache=False)]
+
+
+def test_batch_reads_each_users_aggregates_once(db):
+    items = [
+        ("u1", "Chi tiêu theo danh mục tháng này"),
+        ("u2", "Thu nhập tháng này"),
+        ("u1", "Tổng quan tài chính tháng này"),
+        ("u1", "Tỷ lệ tiết kiệm mấy tháng gần đây"),
+        ("u2", "Chi tiêu theo danh mục tháng này"),
+        ("u3", "Tổng quan tài chính tháng này"),
+    ]
+
+    results = asyncio.run(_collect(items))
+
+    assert sorted(r["index"] for r in results) == list(range(len(items)))
+    assert all(r["success"] for r in results)
+    # Cube rows and category names per user with several questions, the one template query otherwise
+    assert db.executions == {"u1": 2, "u2": 2, "u3": 1}
+
+
+def test_questions_outside_a_batch_query_per_question(db):
+    async def run():
+        for question in ("Chi tiêu theo danh mục tháng này", "Tổng quan tài chính tháng này", "Thu nhập tháng này"):
+            await financial_analysis.analyze_financial("u1", question, use_cache=False)
+
+    asyncio.run(run())
+
+    assert db.executions == {"u1": 3}
+
+
+def test_question_is_embedded_once_per_request(db, monkeypatch):
+    calls = []
+
+    class Embeddings:
+        async def embed_text(self, text):
+            calls.append(text)
+            return [0.5, 0.5, 0.5, 0.5]
+
+    seen = {}
+
+    async def route_many(question, known_categories=None, embedding=None):
+        seen["router"] = embedding
+        return [{"question": question, "intent": INTENTS[question], "confidence": 1.0, "slots": {}, "source": "test"}]
+
+    async def retrieve(user_id, question, embedding=None):
+        seen["memory"] = embedding
+        return []
+
+    monkeypatch.setattr(financial_analysis, "embeddings_service", Embeddings())
+    financial_analysis.workflow.sql_agent.intent_router.route_many = route_many
+    financial_analysis.workflow.conversation_memory.retrieve = retrieve
+
+    question = "Thu nhập tháng này"
+    result = asyncio.run(financial_analysis.analyze_financial("u1", question, use_cache=False))
+
+    assert result["success"]
+    assert calls == [question]
+    assert seen == {"router": [0.5, 0.5, 0.5, 0.5], "memory": [0.5, 0.5, 0.5, 0.5]}
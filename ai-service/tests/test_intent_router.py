@@ -0,0 +1,18 @@
+import asyncio
+
+from app.agents.intent_router import IntentRouter
+
+
+def test_route_many_keeps_same_intent_for_different_periods():
+    router = IntentRouter(embeddings=None)
+    routes = asyncio.run(router.route_many("Tôi chi tiêu bao nhiêu tháng này? Tôi chi tiêu bao nhiêu tháng trước?"))
+
+    assert [route["intent"] for route in routes] == ["spending_analysis", "spending_analysis"]
+    assert [route["slots"]["time_window"]["offset"] for route in routes] == [0, 1]
+
+
+def test_route_many_folds_repeated_clauses():
+    router = IntentRouter(embeddings=None)
+    routes = asyncio.run(router.route_many("Tôi chi tiêu bao nhiêu tháng này? Tôi chi tiêu bao nhiêu trong tháng này?"))
+
+    assert len(routes) == 1
@@ -0,0 +1,52 @@
+import asyncio
+
+import numpy as np
+
+from app.agents.sql_template_cache import SQLTemplateCache, has_id_literals
+
+SQL = (
+    "SELECT COALESCE(SUM(t.amount), 0) AS total FROM transactions t "
+    "WHERE t.user_id = 'u1' AND t.date >= '2026-10-01'"
+)
+
+
+class SameEmbedding:
+    """Embeds every question to the same vector so only slot checks can tell them apart"""
+
+    async def embed_text(self, question):
+        return np.ones(4, dtype=np.float32) / 2
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_semantic_hit_requires_same_time_window():
+    cache = SQLTemplateCache(embeddings=SameEmbedding())
+    run(cache.store("Tôi chi bao nhiêu tháng này?", SQL, "u1"))
+
+    paraphrase = run(cache.lookup("Tháng này tôi đã chi bao nhiêu?", "u2"))
+    other_month = run(cache.lookup("Tôi chi bao nhiêu tháng trước?", "u2"))
+
+    assert paraphrase["hit"] and paraphrase["params"]["user_id"] == "u2"
+    assert not other_month["hit"]
+    assert cache.get_stats()["signature_mismatches"] == 1
+
+
+def test_semantic_hit_requires_same_category():
+    cache = SQLTemplateCache(embeddings=SameEmbedding())
+    run(cache.store("Chi tiêu cho ăn uống tháng này", SQL, "u1"))
+
+    assert not run(cache.lookup("Chi tiêu cho mua sắm tháng này", "u2"))["hit"]
+
+
+def test_templates_with_id_literals_are_not_shared():
+    cache = SQLTemplateCache(embeddings=SameEmbedding())
+    by_category = SQL + " AND t.category_id = 'cm3x9k2lq0000abcd1234'"
+    run(cache.store("Chi tiêu ăn uống tháng này", by_category, "u1"))
+
+    assert has_id_literals(by_category)
+    assert has_id_literals("SELECT 1 FROM accounts a WHERE a.id IN ('acc-1', 'acc-2')")
+    assert not has_id_literals("SELECT 1 FROM categories c WHERE c.name ILIKE '%ăn uống%'")
+    assert cache.get_stats()["stores"] == 0
+    assert not run(cache.lookup("Chi tiêu ăn uống tháng này", "u2"))["hit"]
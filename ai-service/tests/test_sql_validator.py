@@ -0,0 +1,76 @@
+import pytest
+
+from app.agents.sql_validator import SQLValidator, SQLValidationError
+
+USER_ID = "u1"
+
+validator = SQLValidator()
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT table_to_xml('users', true, false, '') FROM accounts a WHERE a.user_id = 'u1'",
+    "SELECT query_to_xml('SELECT * FROM users', true, false, '') FROM accounts a WHERE a.user_id = 'u1'",
+    "SELECT pg_read_file('/etc/passwd') FROM accounts a WHERE a.user_id = 'u1'",
+    "SELECT pg_catalog.pg_read_file('/etc/passwd') FROM accounts a WHERE a.user_id = 'u1'",
+    "SELECT pg_catalog.lower(a.name) FROM accounts a WHERE a.user_id = 'u1'",
+    "SELECT a.name FROM accounts a WHERE a.user_id = 'u1' AND pg_sleep(5) IS NOT NULL",
+    "SELECT current_setting('is_superuser') FROM accounts a WHERE a.user_id = 'u1'",
+])
+def test_rejects_functions_outside_allowlist(sql):
+    with pytest.raises(SQLValidationError):
+        validator.validate(sql, USER_ID)
+
+
+@pytest.mark.parametrize("sql", [
+    """
+    SELECT COALESCE(c.name, 'Uncategorized') as category_name, COUNT(*), SUM(ABS(t.amount)),
+        ROUND(SUM(ABS(t.amount)) * 100.0 / NULLIF(SUM(SUM(ABS(t.amount))) OVER (), 0), 2)
+    FROM transactions t LEFT JOIN categories c ON t.category_id = c.id
+    WHERE t.user_id = :user_id AND t.date >= :start_date AND t.date < :end_date
+    GROUP BY c.name
+    """,
+    """
+    SELECT DATE_TRUNC('month', t.date) as month, TO_CHAR(t.date, 'YYYY-MM'), EXTRACT(DOW FROM t.date),
+        SUM(CASE WHEN t.amount > 0 THEN t.amount ELSE 0 END), CAST(:start_date AS DATE),
+        RANK() OVER (ORDER BY SUM(t.amount) DESC), AGE(MAX(t.date))
+    FROM transactions t
+    WHERE t.user_id = :user_id AND t.date >= CURRENT_DATE - INTERVAL '30 days'
+    GROUP BY DATE_TRUNC('month', t.date), TO_CHAR(t.date, 'YYYY-MM'), EXTRACT(DOW FROM t.date)
+    """,
+])
+def test_allows_aggregate_scalar_and_date_functions(sql):
+    assert validator.validate(sql, USER_ID, {"user_id": USER_ID}).upper().startswith("SELECT")
+
+
+@pytest.mark.parametrize("sql", [
+    # The accounts CTE only exists inside EXISTS; the outer accounts is the real table
+    """
+    SELECT a.user_id, a.name FROM accounts a
+    WHERE EXISTS (WITH accounts AS (SELECT t.id FROM transactions t WHERE t.user_id = 'u1') SELECT 1 FROM accounts)
+    """,
+    # The transactions CTE belongs to the last branch only
+    """
+    SELECT t.id, t.amount FROM transactions t
+    UNION ALL
+    SELECT a.id, 0 FROM accounts a WHERE a.user_id = 'u1'
+    UNION ALL
+    SELECT s.id, s.amount FROM (WITH transactions AS (SELECT 'x' AS id, 0 AS amount) SELECT id, amount FROM transactions) s
+    """,
+    # A CTE body cannot see CTEs defined after it
+    """
+    WITH a AS (SELECT id, amount FROM transactions),
+         transactions AS (SELECT t.id, t.amount FROM transactions t WHERE t.user_id = 'u1')
+    SELECT id, amount FROM a
+    """,
+])
+def test_rejects_tables_shadowed_by_ctes_of_other_scopes(sql):
+    with pytest.raises(SQLValidationError):
+        validator.validate(sql, USER_ID)
+
+
+def test_allows_cte_referenced_in_its_own_scope():
+    sql = """
+    WITH mine AS (SELECT t.id, t.amount FROM transactions t WHERE t.user_id = 'u1')
+    SELECT id, amount FROM mine UNION ALL SELECT id, amount FROM mine
+    """
+    assert validator.validate(sql, USER_ID).upper().startswith("WITH")
@@ -46,6 +46,8 @@ export const transactions = pgTable(
     categoryId: text("category_id").references(() => categories.id, {
       onDelete: "set null",
     }),
+    // Copy of accounts.user_id, kept in sync by database triggers (ai-service migration 4)
+    userId: text("user_id"),
   },
   (table) => ({
     accountIdIdx: index("transactions_account_id_idx").on(table.accountId),
@@ -65,6 +67,11 @@ export const transactions = pgTable(
       table.date.desc(),
       table.amount
     ),
+    // Created with INCLUDE (amount, category_id) by the same migration
+    userDateIdx: index("transactions_user_date_idx").on(
+      table.userId,
+      table.date.desc()
+    ),
   })
 );
 